@@ -1,10 +1,14 @@
 # api_client.py
 import requests
+from requests.adapters import HTTPAdapter
 import base64
 import time
 import json
+import threading
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
+from rate_limiter import get_rate_limiter, parse_retry_after
+import json_codec
 
 class ETAApiClient:
     def __init__(self, client_id, client_secret):
@@ -14,21 +18,30 @@ class ETAApiClient:
         self.auth_url = "https://id.eta.gov.eg/connect/token"
         self.access_token = None
         self.token_expiry_time = 0
-        self.last_api_call_time = 0
-        self.min_request_interval = 0.6  # tuned for max safe speed (2 req/sec)
+        # Shared, adaptive token buckets (per endpoint and per credential) for the whole process
+        self.rate_limiter = get_rate_limiter()
+        # Several fetcher threads share one client, so the token refresh is guarded
+        self._token_lock = threading.Lock()
+        # Why the calling thread's last request failed, as (error_class, message); read by the retry queue
+        self._local = threading.local()
         
         # ✅ Persistent session to reuse TCP/TLS connection
         self.session = requests.Session()
         self.session.headers.update({'Content-Type': 'application/json'})
+        # Allow enough pooled connections for concurrent detail fetches
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("https://", adapter)
 
-    def _enforce_rate_limit(self):
-        now = time.monotonic()
-        elapsed = now - self.last_api_call_time
-        if elapsed < self.min_request_interval:
-            wait_time = self.min_request_interval - elapsed
-            print(f"Rate limit: waiting for {wait_time:.2f} seconds...")
-            time.sleep(wait_time)
-        self.last_api_call_time = time.monotonic()
+    @property
+    def last_error(self):
+        """(error_class, message) of the calling thread's last failed request, or None if it succeeded."""
+        return getattr(self._local, 'last_error', None)
+
+    def _set_last_error(self, error_class, message=""):
+        self._local.last_error = (error_class, str(message)[:500]) if error_class else None
+
+    def _enforce_rate_limit(self, endpoint):
+        self.rate_limiter.acquire(endpoint, self.client_id)
 
     def test_authentication(self):
         self.access_token = None 
@@ -39,8 +52,10 @@ class ETAApiClient:
         }
         payload = {'grant_type': 'client_credentials'}
         try:
-            self._enforce_rate_limit()
+            self._enforce_rate_limit('token')
             response = self.session.post(self.auth_url, headers=headers, data=payload, timeout=10)
+            if response.status_code == 429:
+                self.rate_limiter.record_throttled('token', self.client_id, parse_retry_after(response.headers.get("Retry-After")))
             response.raise_for_status()
             token_data = response.json()
             self.access_token = token_data['access_token']
@@ -52,43 +67,58 @@ class ETAApiClient:
     def _get_access_token(self):
         if self.access_token and time.time() < self.token_expiry_time:
             return self.access_token
-        print("Token expired or missing. Re-authenticating...")
-        success, message = self.test_authentication()
-        return self.access_token if success else None
-
-    def _make_request(self, method, url, **kwargs):
+        with self._token_lock:
+            # Another thread may have refreshed the token while we waited for the lock
+            if self.access_token and time.time() < self.token_expiry_time:
+                return self.access_token
+            print("Token expired or missing. Re-authenticating...")
+            success, message = self.test_authentication()
+            return self.access_token if success else None
+
+    def _make_request(self, method, url, endpoint='details', **kwargs):
         """Centralized request handler with retries, backoff, and error handling."""
         max_retries = 5
+        self._set_last_error(None)
         for attempt in range(max_retries):
             try:
-                self._enforce_rate_limit()
+                self._enforce_rate_limit(endpoint)
                 response = self.session.request(method, url, **kwargs)
 
                 if response.status_code == 429:
-                    # --- Handle rate limit hit ---
-                    retry_after = response.headers.get("Retry-After")
-                    wait_time = int(response.headers.get("Retry-After", 3))
-
-                    print(f"⚠️ Hit API rate limit (429). Waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
-                    continue  # retry after waiting
+                    # --- Handle rate limit hit: slow the shared buckets down and pause them for Retry-After ---
+                    wait_time = parse_retry_after(response.headers.get("Retry-After"))
+                    self.rate_limiter.record_throttled(endpoint, self.client_id, wait_time)
+                    print(f"⚠️ Hit API rate limit (429) on '{endpoint}'. Pausing {wait_time:.0f}s and slowing down...")
+                    self._set_last_error("throttled", f"429 on '{endpoint}'")
+                    continue  # the next acquire waits out the pause
 
                 response.raise_for_status()
-                return response.json()
+                self.rate_limiter.record_success(endpoint, self.client_id)
+                self._set_last_error(None)
+                # Decode the raw bytes with the fastest available JSON library (detail payloads can be hundreds of KB)
+                return json_codec.loads(response.content)
 
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 400 and "/documents/search" in url:
                     print(f"API returned 400 on search for {url}. Treating as no results found.")
                     return {"result": [], "metadata": {}}
                 print(f"Unrecoverable HTTP error: {e}")
+                self._set_last_error(f"http_{e.response.status_code}", e)
                 return None
 
+            except ValueError as e:
+                print(f"Malformed JSON response: {e}. Retrying... (Attempt {attempt + 1}/{max_retries})")
+                self._set_last_error("malformed_json", e)
+                time.sleep(3 * (attempt + 1))
+
             except requests.exceptions.ReadTimeout:
                 print(f"Read timeout. Retrying... (Attempt {attempt + 1}/{max_retries})")
+                self._set_last_error("timeout", f"Read timeout on '{endpoint}'")
                 time.sleep(3 * (attempt + 1))
 
             except requests.exceptions.RequestException as e:
                 print(f"Network error: {e}. Retrying... (Attempt {attempt + 1}/{max_retries})")
+                self._set_last_error("network", e)
                 time.sleep(3 * (attempt + 1))
 
         print(f"Request failed after {max_retries} attempts.")
@@ -112,17 +142,18 @@ class ETAApiClient:
             params['direction'] = direction
         
         url = f"{self.base_url}/api/v1.0/documents/search"
-        return self._make_request('GET', url, headers=headers, params=params, timeout=20)
+        return self._make_request('GET', url, endpoint='search', headers=headers, params=params, timeout=20)
         
     def get_document_details(self, uuid):
         """Retrieves full details for a single document."""
         token = self._get_access_token()
         if not token:
+            self._set_last_error("auth", "No access token")
             return None
         
         headers = {'Authorization': f'Bearer {token}'}
         url = f"{self.base_url}/api/v1.0/documents/{uuid}/details"
-        return self._make_request('GET', url, headers=headers, timeout=20)
+        return self._make_request('GET', url, endpoint='details', headers=headers, timeout=20)
 
     # ⬇️ Kept your discovery functions untouched for compatibility
     def find_newest_invoice_date(self):
@@ -0,0 +1,72 @@
+# backfill_scheduler.py
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DEFAULT_MAX_PARALLEL_UNITS = 3
+
+class BackfillScheduler:
+    """
+    Runs independent backfill work units (a search window + direction) on a
+    bounded thread pool. Every pool thread gets its own DatabaseManager cloned
+    from `db_manager`, so each unit owns its connection and transaction. The API
+    side needs no extra coordination: all clients share the process-wide rate limiter.
+    """
+    def __init__(self, db_manager, max_parallel_units=DEFAULT_MAX_PARALLEL_UNITS):
+        self.db_manager = db_manager
+        self.max_parallel_units = max(1, int(max_parallel_units))
+        self._local = threading.local()
+        self._unit_managers = []
+        self._managers_lock = threading.Lock()
+
+    def _thread_db_manager(self):
+        """Returns the calling pool thread's DatabaseManager, connecting it on first use."""
+        db_manager = getattr(self._local, 'db_manager', None)
+        if db_manager is None:
+            db_manager = self.db_manager.clone()
+            if not db_manager.connect():
+                raise ConnectionError("Could not open a database connection for a backfill unit.")
+            self._local.db_manager = db_manager
+            with self._managers_lock:
+                self._unit_managers.append(db_manager)
+        return db_manager
+
+    def _run_one(self, run_unit, unit):
+        return run_unit(unit, self._thread_db_manager())
+
+    def run(self, work_units, run_unit, should_continue=None):
+        """
+        Calls `run_unit(unit, db_manager)` for every unit and yields (unit, result)
+        in completion order. Exceptions are yielded as the result so the caller can
+        record the unit as failed. No new units start once `should_continue()` is False.
+        """
+        pending = iter(work_units)
+        in_flight = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_parallel_units, thread_name_prefix="backfill") as pool:
+                def submit_next():
+                    if should_continue is not None and not should_continue():
+                        return False
+                    unit = next(pending, None)
+                    if unit is None:
+                        return False
+                    in_flight[pool.submit(self._run_one, run_unit, unit)] = unit
+                    return True
+
+                for _ in range(self.max_parallel_units):
+                    if not submit_next(): break
+
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        unit = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = e
+                        submit_next()
+                        yield unit, result
+        finally:
+            with self._managers_lock:
+                for db_manager in self._unit_managers:
+                    db_manager.disconnect()
+                self._unit_managers = []
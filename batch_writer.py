@@ -0,0 +1,124 @@
+# batch_writer.py
+import datetime
+import time
+from db_manager import WRITE_MODE_UPSERT
+from field_mapping import core_document
+
+DEFAULT_WRITE_BATCH_SIZE = 200
+DEFAULT_COMMIT_EVERY_DOCS = 100
+DEFAULT_COMMIT_EVERY_SECONDS = 30
+
+def parse_eta_datetime(date_str):
+    """Parses an ETA timestamp (which may carry 7 fractional digits) into a naive UTC datetime."""
+    if not date_str:
+        return None
+    if '.' in date_str and len(date_str.split('.')[1]) > 7:
+        date_str = date_str[:26] + "Z"
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            return datetime.datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class DocumentBatchWriter:
+    """
+    Collects fetched document details and writes them to one header/lines table
+    pair in bulk via DatabaseManager.insert_documents. It upserts by default, so a
+    retried batch or a race with another run does not abort the transaction.
+
+    Writes are committed in chunks: `commit_if_due` commits once `commit_every_docs`
+    documents or `commit_every_seconds` have accumulated, and `commit` forces it.
+    A `before_commit(cursor, uuids)` callback runs inside the same transaction, which
+    is how callers record a checkpoint atomically with the data it describes.
+    Committed UUIDs are added to `uuid_index`, if given, so discovery sees them.
+    """
+    def __init__(self, db_manager, table_prefix="", batch_size=DEFAULT_WRITE_BATCH_SIZE, mode=WRITE_MODE_UPSERT,
+                 commit_every_docs=DEFAULT_COMMIT_EVERY_DOCS, commit_every_seconds=DEFAULT_COMMIT_EVERY_SECONDS, uuid_index=None):
+        self.db_manager = db_manager
+        self.uuid_index = uuid_index
+        self.table_prefix = table_prefix
+        self.batch_size = batch_size
+        self.mode = mode
+        self.commit_every_docs = commit_every_docs
+        self.commit_every_seconds = commit_every_seconds
+        self.buffer = []
+        self.uncommitted_uuids = []
+        self.written_count = 0  # Committed documents only
+        self.newest_doc = {'timestamp': None, 'uuid': None, 'internal_id': None}
+        self._pending_newest = dict(self.newest_doc)
+        self._last_commit_time = time.monotonic()
+
+    def add(self, details):
+        """Buffers one document and flushes automatically once the batch is full."""
+        self.buffer.append(details)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered documents in one bulk statement per table (without committing). Raises on DB errors."""
+        if not self.buffer:
+            return 0
+        self.db_manager._ensure_connection()
+        with self.db_manager.conn.cursor() as cur:
+            written = self.db_manager.insert_documents(cur, self.buffer, self.table_prefix, self.mode)
+        for details in self.buffer:
+            self._track_newest(self._pending_newest, details)
+            self.uncommitted_uuids.append(details.get('uuid'))
+        self.buffer = []
+        return written
+
+    def pending_count(self):
+        return len(self.buffer) + len(self.uncommitted_uuids)
+
+    def commit_if_due(self, before_commit=None):
+        """Commits the current chunk if it reached the size or age limit. Returns True if it committed."""
+        pending = self.pending_count()
+        if pending == 0:
+            return False
+        if pending >= self.commit_every_docs or time.monotonic() - self._last_commit_time >= self.commit_every_seconds:
+            self.commit(before_commit)
+            return True
+        return False
+
+    def commit(self, before_commit=None):
+        """Flushes, runs `before_commit` in the same transaction, then commits. Returns the number of documents committed."""
+        self.flush()
+        committed_uuids = self.uncommitted_uuids
+        if before_commit is not None:
+            with self.db_manager.conn.cursor() as cur:
+                before_commit(cur, committed_uuids)
+        self.db_manager.conn.commit()
+        if self.uuid_index is not None:
+            self.uuid_index.add(committed_uuids)
+
+        self.written_count += len(committed_uuids)
+        merge_newest_doc(self.newest_doc, self._pending_newest)
+        self._pending_newest = {'timestamp': None, 'uuid': None, 'internal_id': None}
+        self.uncommitted_uuids = []
+        self._last_commit_time = time.monotonic()
+        return len(committed_uuids)
+
+    def rollback(self):
+        """Discards everything written since the last commit."""
+        self.db_manager.conn.rollback()
+        self.buffer = []
+        self.uncommitted_uuids = []
+        self._pending_newest = {'timestamp': None, 'uuid': None, 'internal_id': None}
+
+    @staticmethod
+    def _track_newest(newest, details):
+        doc_dt = parse_eta_datetime(details.get('dateTimeReceived') or details.get('dateTimeRecevied'))
+        if doc_dt and (newest['timestamp'] is None or doc_dt > newest['timestamp']):
+            newest['timestamp'] = doc_dt
+            newest['uuid'] = details.get('uuid')
+            core = core_document(details)
+            newest['internal_id'] = details.get('internalId') or core.get('internalID') or core.get('internalId')
+
+
+def merge_newest_doc(target, candidate):
+    """Keeps whichever of the two 'newest document' records is more recent, updating `target` in place."""
+    if candidate['timestamp'] and (target['timestamp'] is None or candidate['timestamp'] > target['timestamp']):
+        target.update(candidate)
+    return target
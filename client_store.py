@@ -0,0 +1,202 @@
+# client_store.py
+import configparser
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+STORE_FILE = 'settings.db'
+LEGACY_CONFIG_FILE = 'settings.ini'
+BUSY_TIMEOUT_SECONDS = 10
+
+# Scalar per-client settings, stored as text like they were in settings.ini
+CLIENT_FIELDS = ('client_id', 'client_secret', 'db_host', 'db_port', 'db_name', 'db_user', 'db_pass', 'date_span', 'oldest_invoice_date')
+JSON_FIELDS = ('date_span',)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS clients (
+        name TEXT PRIMARY KEY,
+        client_id TEXT, client_secret TEXT, db_host TEXT, db_port TEXT, db_name TEXT,
+        db_user TEXT, db_pass TEXT, date_span TEXT, oldest_invoice_date TEXT,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # Sets are one row per member, so adding or removing a UUID never rewrites the rest
+    "CREATE TABLE IF NOT EXISTS client_skipped_days (client_name TEXT NOT NULL, day TEXT NOT NULL, PRIMARY KEY (client_name, day)) WITHOUT ROWID;",
+    "CREATE TABLE IF NOT EXISTS client_failed_uuids (client_name TEXT NOT NULL, uuid TEXT NOT NULL, PRIMARY KEY (client_name, uuid)) WITHOUT ROWID;",
+    "CREATE TABLE IF NOT EXISTS app_state (key TEXT PRIMARY KEY, value TEXT);",
+)
+SET_TABLES = {'skipped_days': ('client_skipped_days', 'day'), 'failed_uuids': ('client_failed_uuids', 'uuid')}
+
+
+def _encode(field, value):
+    if value is None or value == "":
+        return None
+    return json.dumps(value) if field in JSON_FIELDS else str(value)
+
+def _decode(field, value):
+    if field in JSON_FIELDS:
+        try:
+            return json.loads(value) if value else None
+        except (json.JSONDecodeError, TypeError):
+            return None
+    return value if value is not None else ""
+
+
+class ClientStore:
+    """
+    Client configuration and per-client sync state in SQLite (WAL mode). Every
+    change is one short transaction touching only the affected rows, so parallel
+    workers can record their results without overwriting each other, and reads
+    are primary-key lookups instead of parsing an INI file.
+    """
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            for command in SCHEMA:
+                conn.execute(command)
+
+    def _connection(self):
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write sequences cannot interleave
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK;")
+            raise
+        conn.execute("COMMIT;")
+
+    # --- Reads ---
+    def load_all_clients(self):
+        """Returns {name: config dict} in the shape config_manager has always returned."""
+        conn = self._connection()
+        clients = {}
+        for row in conn.execute(f"SELECT name, {', '.join(CLIENT_FIELDS)} FROM clients ORDER BY name;"):
+            clients[row[0]] = {field: _decode(field, value) for field, value in zip(CLIENT_FIELDS, row[1:])}
+            clients[row[0]].update(skipped_days=[], failed_uuids=[])
+        for key, (table, column) in SET_TABLES.items():
+            for client_name, member in conn.execute(f"SELECT client_name, {column} FROM {table} ORDER BY client_name, {column};"):
+                if client_name in clients:
+                    clients[client_name][key].append(member)
+        return clients
+
+    def load_client(self, name):
+        conn = self._connection()
+        row = conn.execute(f"SELECT {', '.join(CLIENT_FIELDS)} FROM clients WHERE name = ?;", (name,)).fetchone()
+        if row is None:
+            return None
+        client = {field: _decode(field, value) for field, value in zip(CLIENT_FIELDS, row)}
+        for key, (table, column) in SET_TABLES.items():
+            client[key] = [member for (member,) in conn.execute(f"SELECT {column} FROM {table} WHERE client_name = ? ORDER BY {column};", (name,))]
+        return client
+
+    # --- Writes ---
+    def save_client(self, name, fields, skipped_days=None, failed_uuids=None):
+        """Creates or updates a client. The skipped-day/failed-UUID sets are replaced only when given."""
+        columns = [field for field in CLIENT_FIELDS if field in fields]
+        with self._transaction() as conn:
+            conn.execute(
+                f"INSERT INTO clients (name, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+                f"ON CONFLICT (name) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in columns)}, updated_at = CURRENT_TIMESTAMP;",
+                (name, *(_encode(col, fields[col]) for col in columns)))
+            for key, members in (('skipped_days', skipped_days), ('failed_uuids', failed_uuids)):
+                if members is not None:
+                    table, column = SET_TABLES[key]
+                    conn.execute(f"DELETE FROM {table} WHERE client_name = ?;", (name,))
+                    conn.executemany(f"INSERT OR IGNORE INTO {table} (client_name, {column}) VALUES (?, ?);", [(name, m) for m in members])
+
+    def update_client_fields(self, name, **fields):
+        """Updates only the given scalar fields of an existing client. Returns False if the client is unknown."""
+        unknown = set(fields) - set(CLIENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown client field(s): {', '.join(sorted(unknown))}")
+        if not fields:
+            return self.load_client(name) is not None
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE clients SET {', '.join(f'{col} = ?' for col in fields)}, updated_at = CURRENT_TIMESTAMP WHERE name = ?;",
+                (*(_encode(col, value) for col, value in fields.items()), name))
+            return cursor.rowcount > 0
+
+    def update_client_sets(self, name, add_skipped_days=(), add_failed_uuids=(), remove_failed_uuids=()):
+        """Adds/removes set members in one transaction (removals first). Returns False if the client is unknown."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM clients WHERE name = ?;", (name,)).fetchone() is None:
+                return False
+            conn.executemany("DELETE FROM client_failed_uuids WHERE client_name = ? AND uuid = ?;", [(name, u) for u in remove_failed_uuids])
+            conn.executemany("INSERT OR IGNORE INTO client_failed_uuids (client_name, uuid) VALUES (?, ?);", [(name, u) for u in add_failed_uuids])
+            conn.executemany("INSERT OR IGNORE INTO client_skipped_days (client_name, day) VALUES (?, ?);", [(name, d) for d in add_skipped_days])
+            conn.execute("UPDATE clients SET updated_at = CURRENT_TIMESTAMP WHERE name = ?;", (name,))
+            return True
+
+    # --- App state ---
+    def get_state(self, key, default=None):
+        row = self._connection().execute("SELECT value FROM app_state WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO app_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value;", (key, value))
+
+    # --- Migration ---
+    def migrate_from_ini(self, config_file=LEGACY_CONFIG_FILE):
+        """
+        One-time import of settings.ini (clients and the last selected client). The INI
+        file is left in place as a backup. Returns the number of clients imported.
+        """
+        if self.get_state('migrated_from_ini') or not os.path.exists(config_file):
+            return 0
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        imported = 0
+        for section in config.sections():
+            if not section.startswith('Client_'):
+                continue
+            values = dict(config.items(section))
+            fields = {field: values.get(field) for field in CLIENT_FIELDS}
+            sets = {}
+            for key in ('date_span', 'skipped_days', 'failed_uuids'):
+                try:
+                    parsed = json.loads(values.get(key) or 'null')
+                except json.JSONDecodeError:
+                    parsed = None
+                if key == 'date_span':
+                    fields[key] = parsed
+                else:
+                    sets[key] = parsed or []
+            self.save_client(section.replace('Client_', '', 1), fields, **sets)
+            imported += 1
+        last_client = config.get('AppState', 'last_client', fallback=None)
+        if last_client:
+            self.set_state('last_client', last_client)
+        self.set_state('migrated_from_ini', config_file)
+        print(f"Migrated {imported} clients from {config_file} to {self.path}.")
+        return imported
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_client_store():
+    """Returns the process-wide store, importing settings.ini the first time it is opened."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ClientStore()
+            _store.migrate_from_ini()
+        return _store
@@ -1,73 +1,52 @@
-import configparser
-import os
-import json
-
-CONFIG_FILE = 'settings.ini'
+from client_store import get_client_store
 
 def save_client_config(client_name, client_id, client_secret, db_host, db_port, db_name, db_user, db_pass, date_span=None, oldest_invoice_date=None, skipped_days=None, failed_uuids=None):
-    config = configparser.ConfigParser()
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-    section_name = f"Client_{client_name}"
-    config[section_name] = {
+    # Only this client's row is written; skipped days / failed UUIDs are left alone unless given
+    get_client_store().save_client(client_name, {
         'client_id': client_id,
         'client_secret': client_secret,
         'db_host': db_host,
-        'db_port': str(db_port),
+        'db_port': db_port,
         'db_name': db_name,
         'db_user': db_user,
         'db_pass': db_pass,
-        'date_span': json.dumps(date_span) if date_span else "",
-        'oldest_invoice_date': oldest_invoice_date if oldest_invoice_date else "",
-        'skipped_days': json.dumps(skipped_days) if skipped_days else "[]",
-        'failed_uuids': json.dumps(failed_uuids) if failed_uuids else "[]"
-    }
-    with open(CONFIG_FILE, 'w') as configfile:
-        config.write(configfile)
+        'date_span': date_span,
+        'oldest_invoice_date': oldest_invoice_date,
+    }, skipped_days=skipped_days, failed_uuids=failed_uuids)
 
-def load_all_clients():
-    if not os.path.exists(CONFIG_FILE): return {}
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    clients = {}
-    for section in config.sections():
-        if section.startswith('Client_'):
-            client_name = section.replace('Client_', '', 1)
-            clients[client_name] = dict(config.items(section))
-            try:
-                clients[client_name]['date_span'] = json.loads(clients[client_name].get('date_span', 'null'))
-            except (json.JSONDecodeError, TypeError):
-                clients[client_name]['date_span'] = None
+def update_client_fields(client_name, **fields):
+    """Updates only the given fields (e.g. oldest_invoice_date) of one client. Returns False if it is unknown."""
+    return get_client_store().update_client_fields(client_name, **fields)
 
-            try:
-                clients[client_name]['skipped_days'] = json.loads(clients[client_name].get('skipped_days', '[]'))
-            except (json.JSONDecodeError, TypeError):
-                clients[client_name]['skipped_days'] = []
+def update_failed_uuids(client_name, add=(), remove=()):
+    """Removes then adds retry-queue UUIDs for one client in a single transaction."""
+    return get_client_store().update_client_sets(client_name, add_failed_uuids=add, remove_failed_uuids=remove)
 
-            try:
-                clients[client_name]['failed_uuids'] = json.loads(clients[client_name].get('failed_uuids', '[]'))
-            except (json.JSONDecodeError, TypeError):
-                clients[client_name]['failed_uuids'] = []
-    return clients
+def load_all_clients():
+    return get_client_store().load_all_clients()
+
+def client_db_params(client_config):
+    """Builds the DatabaseManager connection parameters from a loaded client config."""
+    return {
+        'host': client_config.get('db_host'), 'dbname': client_config.get('db_name'),
+        'user': client_config.get('db_user'), 'password': client_config.get('db_pass'),
+        'port': int(client_config.get('db_port', 5432) or 5432),
+    }
+
+def merge_sync_results(client_name, skipped_days, failed_uuids):
+    """
+    Merges a historical sync's skipped days and failed UUIDs into the saved
+    client config. Returns the updated client dict, or None if the client is unknown.
+    """
+    store = get_client_store()
+    if not store.update_client_sets(client_name, add_skipped_days=skipped_days, add_failed_uuids=failed_uuids):
+        return None
+    return store.load_client(client_name)
 
 def save_last_selected_client(client_name):
     """Saves the name of the last used client."""
-    config = configparser.ConfigParser()
-    if os.path.exists(CONFIG_FILE):
-        config.read(CONFIG_FILE)
-    
-    if 'AppState' not in config:
-        config['AppState'] = {}
-    config['AppState']['last_client'] = client_name
-
-    with open(CONFIG_FILE, 'w') as configfile:
-        config.write(configfile)
+    get_client_store().set_state('last_client', client_name)
 
 def load_last_selected_client():
     """Loads the name of the last used client."""
-    if not os.path.exists(CONFIG_FILE):
-        return None
-    
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    return config.get('AppState', 'last_client', fallback=None)
\ No newline at end of file
+    return get_client_store().get_state('last_client')
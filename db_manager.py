@@ -3,91 +3,245 @@ import psycopg2
 import psycopg2.extras
 import json
 from datetime import datetime
+from functools import lru_cache
+from db_pool import get_pool
+from field_mapping import HEADER_COLUMNS, LINE_COLUMNS, header_row, line_rows
+from json_codec import compress_payload, decompress_payload, COMPRESSION
+
+# --- Column layout used by the bulk writer comes from the declarative field mapping ---
+BULK_PAGE_SIZE = 1000
+UUID_SCAN_BATCH = 10000 # Rows per round trip when streaming all UUIDs (UUID index rebuilds)
+
+# --- Optional partitioned layout: monthly RANGE partitions on the receipt time ---
+# Lines carry their header's receipt time so both live in the same month.
+PARTITION_COLUMNS = {"documents": "date_time_received", "document_lines": "document_date_time_received"}
+PARTITIONED_CONFLICT_COLUMNS = ("uuid", "date_time_received") # A partitioned primary key must include the partition column
+DEFAULT_PARTITION_MONTHS_AHEAD = 3
+# The partition column is part of the primary key, so it can never be NULL there. A document without a
+# receipt time is keyed by its issue time instead, or by this fixed value (DEFAULT partition) if it has neither.
+PARTITION_KEY_FALLBACK = datetime(1970, 1, 1)
+_HEADER_RECEIVED_INDEX = HEADER_COLUMNS.index("date_time_received")
+_HEADER_ISSUED_INDEX = HEADER_COLUMNS.index("date_time_issued")
+_LINE_RECEIVED_INDEX = LINE_COLUMNS.index("document_date_time_received")
+_partitioned_layouts = {} # pool -> True/False, detected once per database
+_ledger_tables = {}       # pool -> whether the materialized ledger exists (databases set up before it was added have none)
+
+# --- Optional raw-payload archive: the compressed details JSON next to the mapped columns ---
+# Off until enable_raw_payload_archive() adds the column; re-mapping then needs no API calls.
+RAW_PAYLOAD_COLUMN = "raw_payload"
+ARCHIVED_HEADER_COLUMNS = HEADER_COLUMNS + (RAW_PAYLOAD_COLUMN,)
+REMAP_BATCH_SIZE = 500
+# Changed in place by the status recheck after a document was archived, so a re-map must not revert them
+REMAP_PRESERVED_COLUMNS = ("status", "document_status_reason")
+_raw_payload_archives = {} # pool -> whether the documents tables carry raw_payload
+
+# --- Durable retry queue for documents whose details could not be fetched or written ---
+RETRY_BASE_DELAY_MINUTES = 15    # Doubles with every failed attempt...
+RETRY_MAX_DELAY_MINUTES = 24 * 60 # ...up to once a day
+RETRY_MAX_ATTEMPTS = 8            # Then the document is dead-lettered and left for manual review
+RETRY_QUEUE_COMMANDS = (
+    """
+    CREATE TABLE IF NOT EXISTS retry_queue (
+        uuid VARCHAR(255) PRIMARY KEY,
+        direction VARCHAR(20),               -- 'Received' / 'Sent', NULL when unknown (e.g. imported from settings)
+        attempts INT NOT NULL DEFAULT 0,
+        last_error_class VARCHAR(50),
+        last_error TEXT,
+        next_eligible_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+        dead_lettered_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_retry_queue_eligible ON retry_queue (next_eligible_at) WHERE dead_lettered_at IS NULL;",
+)
+_retry_queues = set() # pools whose retry_queue table is known to exist
+
+# --- Secondary indexes for the hot read paths: (index name, table, column/expression, partial predicate) ---
+INDEX_DEFINITIONS = tuple(
+    definition
+    for prefix in ("", "sent_")
+    for definition in (
+        # Phase 1 in-flux selection and the due-slice ordering only ever look at 'Valid' documents
+        (f"idx_{prefix}documents_valid_deadline", f"{prefix}documents", "GREATEST(canbe_cancelled_until, canbe_rejected_until)", "status = 'Valid'"),
+        (f"idx_{prefix}documents_valid_next_check", f"{prefix}documents", "next_check_at", "status = 'Valid'"),
+        # MAX(date_time_received) for live sync and date-range reporting
+        (f"idx_{prefix}documents_date_time_received", f"{prefix}documents", "date_time_received", None),
+        # Line lookups by header in the views and the upsert's line replacement
+        (f"idx_{prefix}document_lines_document_uuid", f"{prefix}document_lines", "document_uuid", None),
+    )
+) + (
+    # Per-document refreshes of the materialized ledger
+    ("idx_unified_financial_ledger_document_uuid", "unified_financial_ledger", "document_uuid", None),
+)
+
+# --- Materialized ledger: one row per line item, refreshed per document by the writers ---
+LEDGER_TABLE = "unified_financial_ledger"
+# Every committed chunk deletes its documents' ledger rows by document_uuid, so the table never goes without this index
+LEDGER_INDEX_SQL = f"CREATE INDEX IF NOT EXISTS idx_{LEDGER_TABLE}_document_uuid ON {LEDGER_TABLE} ((document_uuid));"
+LEDGER_VIEW_COLUMNS = (
+    "transaction_type", "document_category", "line_item_uuid", "document_uuid", "document_internal_id", "issue_date",
+    "partner_name", "item_name", "item_description", "quantity", "unit_price_egp", "gross_amount_egp", "discount_amount_egp",
+    "net_amount_egp", "tax_amount_egp", "total_amount_egp", "original_currency", "total_amount_foreign",
+)
+
+# --- Write modes ---
+# 'insert' fails on an existing uuid (and aborts the transaction);
+# 'upsert' overwrites the header and replaces that document's lines, so retries are harmless.
+WRITE_MODE_INSERT = "insert"
+WRITE_MODE_UPSERT = "upsert"
+
+@lru_cache(maxsize=None)
+def _insert_sql(table_name, columns):
+    """Builds the execute_values INSERT statement once per table/column layout."""
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s"
+
+@lru_cache(maxsize=None)
+def _upsert_sql(table_name, columns, conflict_columns=("uuid",), preserved_columns=()):
+    """
+    Builds the execute_values INSERT ... ON CONFLICT DO UPDATE statement once per table/column layout.
+    `preserved_columns` are only set on insert; an existing row keeps its values.
+    """
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in columns if col not in conflict_columns and col not in preserved_columns)
+    return f"{_insert_sql(table_name, columns)} ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET {updates}"
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1).date()
+
+def _add_months(month_start, months):
+    month_index = month_start.month - 1 + months
+    return month_start.replace(year=month_start.year + month_index // 12, month=month_index % 12 + 1)
+
+def _partition_name(parent_table, month_start):
+    return f"{parent_table}_p{month_start.strftime('%Y%m')}"
+
+def _with_partition_key(row, document_line_rows):
+    """Fills a missing receipt time in a header row and its line rows (stable, so re-upserts hit the same row)."""
+    if row[_HEADER_RECEIVED_INDEX] is not None:
+        return row, document_line_rows
+    received = row[_HEADER_ISSUED_INDEX] or PARTITION_KEY_FALLBACK
+    row = row[:_HEADER_RECEIVED_INDEX] + (received,) + row[_HEADER_RECEIVED_INDEX + 1:]
+    document_line_rows = [line[:_LINE_RECEIVED_INDEX] + (received,) + line[_LINE_RECEIVED_INDEX + 1:] for line in document_line_rows]
+    return row, document_line_rows
+
+# --- Table layouts shared by the flat and the partitioned schema ---
+DOCUMENT_COLUMNS_SQL = """
+    uuid VARCHAR(255) NOT NULL, submission_uuid VARCHAR(255), long_id VARCHAR(255), internal_id VARCHAR(255), type_name VARCHAR(255),
+    document_type_name_primary_lang VARCHAR(255), document_type_name_secondary_lang VARCHAR(255), type_version_name VARCHAR(255),
+    document_type_version VARCHAR(255), document_type VARCHAR(255), issuer_id VARCHAR(255), issuer_name VARCHAR(255), issuer_type VARCHAR(255),
+    issuer_address_branch_id VARCHAR(255), issuer_address_country VARCHAR(255), issuer_address_governate VARCHAR(255),
+    issuer_address_region_city VARCHAR(255), issuer_address_street TEXT, issuer_address_building_number VARCHAR(255),
+    issuer_address_floor VARCHAR(255), issuer_address_room VARCHAR(255), issuer_address_landmark VARCHAR(255), issuer_address_additional_information TEXT,
+    receiver_id VARCHAR(255), receiver_name VARCHAR(255), receiver_type VARCHAR(255), receiver_address_branch_id VARCHAR(255),
+    receiver_address_country VARCHAR(255), receiver_address_governate VARCHAR(255), receiver_address_region_city VARCHAR(255),
+    receiver_address_street TEXT, receiver_address_building_number VARCHAR(255), receiver_address_floor VARCHAR(255),
+    receiver_address_room VARCHAR(255), receiver_address_landmark VARCHAR(255), receiver_address_additional_information TEXT,
+    date_time_issued TIMESTAMP, date_time_received TIMESTAMP, service_delivery_date TIMESTAMP, customs_clearance_date TIMESTAMP,
+    validation_status VARCHAR(255), transformation_status VARCHAR(255), status_id INT, status VARCHAR(255), document_status_reason TEXT,
+    cancel_request_date TIMESTAMP, reject_request_date TIMESTAMP, cancel_request_delayed_date TIMESTAMP, reject_request_delayed_date TIMESTAMP,
+    decline_cancel_request_date TIMESTAMP, decline_reject_request_date TIMESTAMP, canbe_cancelled_until TIMESTAMP, canbe_rejected_until TIMESTAMP,
+    submission_channel INT, freeze_status_frozen BOOLEAN, freeze_status_type VARCHAR(255), freeze_status_scope VARCHAR(255),
+    freeze_status_action_date TIMESTAMP, freeze_status_au_code VARCHAR(255), freeze_status_au_name VARCHAR(255),
+    customs_declaration_number VARCHAR(255), e_payment_number VARCHAR(255), public_url TEXT, purchase_order_description TEXT,
+    sales_order_description TEXT, sales_order_reference VARCHAR(255), proforma_invoice_number VARCHAR(255), purchase_order_reference VARCHAR(255),
+    late_submission_request_number VARCHAR(255), additional_metadata TEXT, alert_details TEXT, signatures TEXT, doc_references TEXT,
+    total_items_discount_amount NUMERIC, total_amount NUMERIC, net_amount NUMERIC, total_discount NUMERIC, total_sales NUMERIC,
+    extra_discount_amount NUMERIC, max_percision INT, document_lines_total_count INT,
+    tax1_type VARCHAR(50), tax1_amount NUMERIC, tax2_type VARCHAR(50), tax2_amount NUMERIC,
+    tax3_type VARCHAR(50), tax3_amount NUMERIC, tax4_type VARCHAR(50), tax4_amount NUMERIC,
+    tax5_type VARCHAR(50), tax5_amount NUMERIC,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    next_check_at TIMESTAMP, status_changed_at TIMESTAMP
+"""
+LINE_COLUMNS_SQL = """
+    id SERIAL, custom_uuid VARCHAR(255), document_uuid VARCHAR(255), item_primary_name TEXT, item_primary_description TEXT,
+    item_secondary_name TEXT, item_secondary_description TEXT, item_type VARCHAR(255), item_code VARCHAR(255),
+    internal_code VARCHAR(255), description TEXT, unit_type VARCHAR(255), unit_type_primary_name TEXT,
+    unit_type_primary_description TEXT, unit_type_secondary_name TEXT, unit_type_secondary_description TEXT,
+    quantity NUMERIC, weight_unit_type VARCHAR(255), weight_unit_type_primary_name TEXT, weight_unit_type_primary_description TEXT,
+    weight_unit_type_secondary_name TEXT, weight_unit_type_secondary_description TEXT, weight_quantity NUMERIC,
+    unit_value_currency_sold VARCHAR(50), unit_value_amount_sold NUMERIC, unit_value_amount_egp NUMERIC,
+    unit_value_currency_exchange_rate NUMERIC, factory_unit_value_currency_sold VARCHAR(50),
+    factory_unit_value_amount_sold NUMERIC, factory_unit_value_amount_egp NUMERIC,
+    factory_unit_value_currency_exchange_rate NUMERIC, sales_total NUMERIC, sales_total_foreign NUMERIC,
+    net_total NUMERIC, net_total_foreign NUMERIC, total NUMERIC, total_foreign NUMERIC,
+    items_discount NUMERIC, items_discount_foreign NUMERIC, total_taxable_fees NUMERIC,
+    total_taxable_fees_foreign NUMERIC, value_difference NUMERIC, value_difference_foreign NUMERIC,
+    discount_amount NUMERIC, discount_rate NUMERIC, discount_amount_foreign NUMERIC,
+    tax1_type VARCHAR(50), tax1_amount NUMERIC, tax2_type VARCHAR(50), tax2_amount NUMERIC,
+    tax3_type VARCHAR(50), tax3_amount NUMERIC, tax4_type VARCHAR(50), tax4_amount NUMERIC,
+    tax5_type VARCHAR(50), tax5_amount NUMERIC,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    document_date_time_received TIMESTAMP
+"""
+
+def _document_table_commands(partitioned):
+    """CREATE statements for documents/sent_documents and their line tables in the chosen layout."""
+    commands = []
+    for prefix in ("", "sent_"):
+        if partitioned:
+            commands += [
+                f"CREATE TABLE IF NOT EXISTS {prefix}documents ({DOCUMENT_COLUMNS_SQL}, PRIMARY KEY (uuid, date_time_received)) PARTITION BY RANGE (date_time_received);",
+                f"CREATE TABLE IF NOT EXISTS {prefix}documents_default PARTITION OF {prefix}documents DEFAULT;",
+                f"CREATE TABLE IF NOT EXISTS {prefix}document_lines ({LINE_COLUMNS_SQL}, PRIMARY KEY (id, document_date_time_received)) PARTITION BY RANGE (document_date_time_received);",
+                f"CREATE TABLE IF NOT EXISTS {prefix}document_lines_default PARTITION OF {prefix}document_lines DEFAULT;",
+            ]
+        else:
+            commands += [
+                f"CREATE TABLE IF NOT EXISTS {prefix}documents ({DOCUMENT_COLUMNS_SQL}, PRIMARY KEY (uuid));",
+                f"CREATE TABLE IF NOT EXISTS {prefix}document_lines ({LINE_COLUMNS_SQL}, PRIMARY KEY (id));",
+            ]
+    return commands
 
 class DatabaseManager:
     def __init__(self, db_params):
         self.db_params = db_params
+        self.pool = get_pool(db_params)
         self.conn = None
 
     def connect(self):
+        """Checks a connection out of the shared pool for these db_params."""
+        if self.conn is not None and self.conn.closed == 0:
+            return True
         try:
-            self.conn = self.conn = psycopg2.connect(**self.db_params, sslmode='require')
+            self.conn = self.pool.getconn()
             return True
-        except psycopg2.OperationalError:
+        except psycopg2.OperationalError as e:
+            print(f"Could not get a database connection: {e}")
             return False
 
     def disconnect(self):
+        """Returns the connection to the pool (it stays open for the next user)."""
         if self.conn:
-            self.conn.close()
+            self.pool.putconn(self.conn)
+            self.conn = None
+
+    def clone(self):
+        """Returns a new, unconnected manager for the same database (one per worker thread)."""
+        return DatabaseManager(self.db_params)
 
     def _ensure_connection(self):
         """Checks if the connection is open and reconnects if it's not."""
         if self.conn is None or self.conn.closed != 0:
             print("Database connection is closed. Reconnecting...")
+            if self.conn is not None:
+                self.pool.putconn(self.conn, discard=True)
+                self.conn = None
             self.connect()
 
-    def check_and_create_tables(self):
+    def check_and_create_tables(self, partitioned=None):
         self._ensure_connection()
         """
         Creates the FULL, detailed schema matching your 'menna' database.
+        `partitioned=True` creates new document tables as monthly range partitions;
+        None keeps whatever layout the database already has (flat for a new database).
+        Existing flat tables are converted with migrate_to_partitioned().
         """
+        if partitioned is None:
+            partitioned = bool(self.is_partitioned())
         commands = (
-            # --- Documents and Sent_Documents (Identical, detailed schema) ---
-            """
-            CREATE TABLE IF NOT EXISTS documents (
-                uuid VARCHAR(255) PRIMARY KEY, submission_uuid VARCHAR(255), long_id VARCHAR(255), internal_id VARCHAR(255), type_name VARCHAR(255),
-                document_type_name_primary_lang VARCHAR(255), document_type_name_secondary_lang VARCHAR(255), type_version_name VARCHAR(255),
-                document_type_version VARCHAR(255), document_type VARCHAR(255), issuer_id VARCHAR(255), issuer_name VARCHAR(255), issuer_type VARCHAR(255),
-                issuer_address_branch_id VARCHAR(255), issuer_address_country VARCHAR(255), issuer_address_governate VARCHAR(255),
-                issuer_address_region_city VARCHAR(255), issuer_address_street TEXT, issuer_address_building_number VARCHAR(255),
-                issuer_address_floor VARCHAR(255), issuer_address_room VARCHAR(255), issuer_address_landmark VARCHAR(255), issuer_address_additional_information TEXT,
-                receiver_id VARCHAR(255), receiver_name VARCHAR(255), receiver_type VARCHAR(255), receiver_address_branch_id VARCHAR(255),
-                receiver_address_country VARCHAR(255), receiver_address_governate VARCHAR(255), receiver_address_region_city VARCHAR(255),
-                receiver_address_street TEXT, receiver_address_building_number VARCHAR(255), receiver_address_floor VARCHAR(255),
-                receiver_address_room VARCHAR(255), receiver_address_landmark VARCHAR(255), receiver_address_additional_information TEXT,
-                date_time_issued TIMESTAMP, date_time_received TIMESTAMP, service_delivery_date TIMESTAMP, customs_clearance_date TIMESTAMP,
-                validation_status VARCHAR(255), transformation_status VARCHAR(255), status_id INT, status VARCHAR(255), document_status_reason TEXT,
-                cancel_request_date TIMESTAMP, reject_request_date TIMESTAMP, cancel_request_delayed_date TIMESTAMP, reject_request_delayed_date TIMESTAMP,
-                decline_cancel_request_date TIMESTAMP, decline_reject_request_date TIMESTAMP, canbe_cancelled_until TIMESTAMP, canbe_rejected_until TIMESTAMP,
-                submission_channel INT, freeze_status_frozen BOOLEAN, freeze_status_type VARCHAR(255), freeze_status_scope VARCHAR(255),
-                freeze_status_action_date TIMESTAMP, freeze_status_au_code VARCHAR(255), freeze_status_au_name VARCHAR(255),
-                customs_declaration_number VARCHAR(255), e_payment_number VARCHAR(255), public_url TEXT, purchase_order_description TEXT,
-                sales_order_description TEXT, sales_order_reference VARCHAR(255), proforma_invoice_number VARCHAR(255), purchase_order_reference VARCHAR(255),
-                late_submission_request_number VARCHAR(255), additional_metadata TEXT, alert_details TEXT, signatures TEXT, doc_references TEXT,
-                total_items_discount_amount NUMERIC, total_amount NUMERIC, net_amount NUMERIC, total_discount NUMERIC, total_sales NUMERIC,
-                extra_discount_amount NUMERIC, max_percision INT, document_lines_total_count INT,
-                tax1_type VARCHAR(50), tax1_amount NUMERIC, tax2_type VARCHAR(50), tax2_amount NUMERIC,
-                tax3_type VARCHAR(50), tax3_amount NUMERIC, tax4_type VARCHAR(50), tax4_amount NUMERIC,
-                tax5_type VARCHAR(50), tax5_amount NUMERIC,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            """,
-            """ CREATE TABLE IF NOT EXISTS sent_documents (LIKE documents INCLUDING ALL); """, # Efficiently duplicates the table
-            
-            # --- Document_Lines and Sent_Document_Lines (Identical, detailed schema) ---
-            """
-            CREATE TABLE IF NOT EXISTS document_lines (
-                id SERIAL PRIMARY KEY, custom_uuid VARCHAR(255), document_uuid VARCHAR(255), item_primary_name TEXT, item_primary_description TEXT,
-                item_secondary_name TEXT, item_secondary_description TEXT, item_type VARCHAR(255), item_code VARCHAR(255),
-                internal_code VARCHAR(255), description TEXT, unit_type VARCHAR(255), unit_type_primary_name TEXT,
-                unit_type_primary_description TEXT, unit_type_secondary_name TEXT, unit_type_secondary_description TEXT,
-                quantity NUMERIC, weight_unit_type VARCHAR(255), weight_unit_type_primary_name TEXT, weight_unit_type_primary_description TEXT,
-                weight_unit_type_secondary_name TEXT, weight_unit_type_secondary_description TEXT, weight_quantity NUMERIC,
-                unit_value_currency_sold VARCHAR(50), unit_value_amount_sold NUMERIC, unit_value_amount_egp NUMERIC,
-                unit_value_currency_exchange_rate NUMERIC, factory_unit_value_currency_sold VARCHAR(50),
-                factory_unit_value_amount_sold NUMERIC, factory_unit_value_amount_egp NUMERIC,
-                factory_unit_value_currency_exchange_rate NUMERIC, sales_total NUMERIC, sales_total_foreign NUMERIC,
-                net_total NUMERIC, net_total_foreign NUMERIC, total NUMERIC, total_foreign NUMERIC,
-                items_discount NUMERIC, items_discount_foreign NUMERIC, total_taxable_fees NUMERIC,
-                total_taxable_fees_foreign NUMERIC, value_difference NUMERIC, value_difference_foreign NUMERIC,
-                discount_amount NUMERIC, discount_rate NUMERIC, discount_amount_foreign NUMERIC,
-                tax1_type VARCHAR(50), tax1_amount NUMERIC, tax2_type VARCHAR(50), tax2_amount NUMERIC,
-                tax3_type VARCHAR(50), tax3_amount NUMERIC, tax4_type VARCHAR(50), tax4_amount NUMERIC,
-                tax5_type VARCHAR(50), tax5_amount NUMERIC,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            """,
-            """ CREATE TABLE IF NOT EXISTS sent_document_lines (LIKE document_lines INCLUDING ALL); """,
+            # --- Documents and Sent_Documents with their line tables (identical, detailed schema) ---
+            *_document_table_commands(partitioned),
             # --- NEW SYNC STATUS TABLE ---
            """
             CREATE TABLE IF NOT EXISTS SyncStatus (
@@ -97,7 +251,29 @@ class DatabaseManager:
                 last_synced_uuid VARCHAR(255),      -- NEW
                 last_synced_internal_id VARCHAR(255) -- NEW
             );
+            """,
+            # --- Resumable historical sync: one row per client/day/direction ---
             """
+            CREATE TABLE IF NOT EXISTS SyncCheckpoint (
+                client_id VARCHAR(255) NOT NULL,
+                sync_day DATE NOT NULL,
+                direction VARCHAR(20) NOT NULL,
+                window_end DATE,
+                continuation_token TEXT,
+                processed_uuids TEXT[] NOT NULL DEFAULT '{}',
+                failed_uuids TEXT[] NOT NULL DEFAULT '{}',
+                completed BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (client_id, sync_day, direction)
+            );
+            """,
+            """ ALTER TABLE SyncCheckpoint ADD COLUMN IF NOT EXISTS window_end DATE; """,
+            *RETRY_QUEUE_COMMANDS,
+            # --- Status recheck scheduling (added to existing databases as well) ---
+            """ ALTER TABLE documents ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP, ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP; """,
+            """ ALTER TABLE sent_documents ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP, ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP; """,
+            """ ALTER TABLE document_lines ADD COLUMN IF NOT EXISTS document_date_time_received TIMESTAMP; """,
+            """ ALTER TABLE sent_document_lines ADD COLUMN IF NOT EXISTS document_date_time_received TIMESTAMP; """
         )
         view_commands = (
             """
@@ -158,8 +334,9 @@ class DatabaseManager:
             JOIN 
                 sent_document_lines line ON hdr.uuid = line.document_uuid;
             """,
+            # --- Unified ledger: the live source view feeds a table the sync keeps current ---
             """
-            CREATE OR REPLACE VIEW vw_unified_financial_ledger AS
+            CREATE OR REPLACE VIEW vw_unified_financial_ledger_source AS
             WITH all_transactions AS (
                 SELECT 
                     'Revenue' AS transaction_type,
@@ -167,7 +344,7 @@ class DatabaseManager:
                     issue_date, customer_name AS partner_name, item_name, item_description,
                     quantity, unit_price_egp, gross_amount_egp, discount_amount_egp,
                     net_amount_egp, tax_amount_egp, total_amount_egp,
-                    original_currency, total_amount_foreign
+                    original_currency, total_amount_foreign, status
                 FROM 
                     vw_accounts_receivable_line_items
                 UNION ALL
@@ -177,7 +354,7 @@ class DatabaseManager:
                     issue_date, supplier_name AS partner_name, item_name, item_description,
                     quantity, unit_price_egp, gross_amount_egp, discount_amount_egp,
                     net_amount_egp, tax_amount_egp, total_amount_egp,
-                    original_currency, total_amount_foreign
+                    original_currency, total_amount_foreign, status
                 FROM 
                     vw_accounts_payable_line_items
             )
@@ -193,8 +370,18 @@ class DatabaseManager:
                 partner_name, item_name, item_description, quantity,
                 unit_price_egp, gross_amount_egp, discount_amount_egp,
                 net_amount_egp, tax_amount_egp, total_amount_egp,
-                original_currency, total_amount_foreign
+                original_currency, total_amount_foreign,
+                status AS document_status
             FROM all_transactions t;
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} AS SELECT * FROM vw_unified_financial_ledger_source;
+            """,
+            LEDGER_INDEX_SQL,
+            # Same column contract as the original view, so BI queries keep working unchanged
+            f"""
+            CREATE OR REPLACE VIEW vw_unified_financial_ledger AS
+            SELECT {', '.join(LEDGER_VIEW_COLUMNS)} FROM {LEDGER_TABLE};
             """
         )
         try:
@@ -216,6 +403,11 @@ class DatabaseManager:
                     else:
                         self.conn.commit() # Commit the single successful command
 
+            _partitioned_layouts.pop(self.pool, None)
+            _ledger_tables.pop(self.pool, None)
+            _raw_payload_archives.pop(self.pool, None)
+            if partitioned:
+                self.ensure_partitions()
             print("Schema verification complete.")
             return (True, "Schema is ready.")
 
@@ -224,6 +416,266 @@ class DatabaseManager:
             self.conn.rollback()
             return (False, str(e).strip())
 
+    # --- Partitioned layout ---
+    def is_partitioned(self, cursor=None):
+        """True if the document tables are range-partitioned, False if flat, None if they do not exist yet."""
+        if self.pool in _partitioned_layouts:
+            return _partitioned_layouts[self.pool]
+        try:
+            if cursor is None:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('documents');")
+                    row = cur.fetchone()
+                self.conn.rollback()
+            else:
+                cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('documents');")
+                row = cursor.fetchone()
+        except psycopg2.Error as e:
+            print(f"Failed to detect the document table layout: {e}")
+            return None
+        if row is None:
+            return None
+        _partitioned_layouts[self.pool] = row[0] == 'p'
+        return _partitioned_layouts[self.pool]
+
+    def ensure_partitions(self, from_date=None, months_ahead=DEFAULT_PARTITION_MONTHS_AHEAD):
+        self._ensure_connection()
+        """
+        Makes sure every partitioned document/line table has a monthly partition from
+        `from_date`'s month (default: this month) until `months_ahead` months from now.
+        Rows that already landed in the DEFAULT partition for a new month are moved into it.
+        Returns (ok, list of created partition names). A flat schema is left alone.
+        """
+        if not self.is_partitioned():
+            return True, []
+        first_month = _month_start(from_date or datetime.now())
+        last_month = _add_months(_month_start(datetime.now()), months_ahead)
+        created = []
+        ok = True
+        for prefix in ("", "sent_"):
+            for base_table, column in PARTITION_COLUMNS.items():
+                parent_table = f"{prefix}{base_table}"
+                try:
+                    with self.conn.cursor() as cur:
+                        cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s);", (parent_table,))
+                        existing = {row[0] for row in cur.fetchall()}
+                    self.conn.rollback()
+                except psycopg2.Error as e:
+                    print(f"Failed to list partitions of {parent_table}: {e}")
+                    self.conn.rollback()
+                    ok = False
+                    continue
+
+                month = first_month
+                while month <= last_month:
+                    partition = _partition_name(parent_table, month)
+                    if partition not in existing:
+                        if self._create_partition(parent_table, column, partition, month, _add_months(month, 1)):
+                            created.append(partition)
+                        else:
+                            ok = False
+                    month = _add_months(month, 1)
+        return ok, created
+
+    def _create_partition(self, parent_table, column, partition, range_start, range_end):
+        """Creates one monthly partition, moving any rows for that month out of the DEFAULT partition first."""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"CREATE TABLE {partition} (LIKE {parent_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);")
+                cur.execute(f"""
+                    WITH moved AS (DELETE FROM {parent_table}_default WHERE {column} >= %s AND {column} < %s RETURNING *)
+                    INSERT INTO {partition} SELECT * FROM moved;
+                """, (range_start, range_end))
+                cur.execute(f"ALTER TABLE {parent_table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s);", (range_start, range_end))
+            self.conn.commit()
+            print(f"Created partition {partition}.")
+            return True
+        except psycopg2.Error as e:
+            print(f"Failed to create partition {partition}: {e}")
+            self.conn.rollback()
+            return False
+
+    def migrate_to_partitioned(self, keep_flat_copy=False):
+        self._ensure_connection()
+        """
+        Converts the flat document and line tables into the partitioned layout in one
+        transaction: the flat tables are renamed to *_flat, the partitioned tables and
+        monthly partitions covering the existing data are created, every row is copied
+        (lines get their header's receipt time), and the flat copies are dropped unless
+        `keep_flat_copy`. Views and indexes are recreated afterwards. Returns (ok, message).
+        """
+        layout = self.is_partitioned()
+        if layout:
+            return (True, "Document tables are already partitioned.")
+        if layout is None:
+            return self.check_and_create_tables(partitioned=True)
+
+        try:
+            with self.conn.cursor() as cur:
+                # Views bind to the renamed tables by oid, so they are dropped and rebuilt by check_and_create_tables
+                cur.execute("DROP VIEW IF EXISTS vw_unified_financial_ledger_source, vw_accounts_payable_line_items, vw_accounts_receivable_line_items CASCADE;")
+                for prefix in ("", "sent_"):
+                    for base_table in PARTITION_COLUMNS:
+                        table_name = f"{prefix}{base_table}"
+                        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s;", (table_name,))
+                        for (index_name,) in cur.fetchall():
+                            cur.execute(f"ALTER INDEX {index_name} RENAME TO {index_name[:57]}_flat;")
+                        cur.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}_flat;")
+
+                for command in _document_table_commands(partitioned=True):
+                    cur.execute(command)
+
+                # Same partition key as the writer (_with_partition_key), so later upserts find the migrated rows.
+                # Rows keyed by PARTITION_KEY_FALLBACK go to the DEFAULT partition and do not widen the range.
+                cur.execute("""
+                    SELECT MIN(d), MAX(d) FROM (
+                        SELECT MIN(COALESCE(date_time_received, date_time_issued)) AS d FROM documents_flat
+                        UNION ALL SELECT MAX(COALESCE(date_time_received, date_time_issued)) FROM documents_flat
+                        UNION ALL SELECT MIN(COALESCE(date_time_received, date_time_issued)) FROM sent_documents_flat
+                        UNION ALL SELECT MAX(COALESCE(date_time_received, date_time_issued)) FROM sent_documents_flat
+                    ) AS bounds;
+                """)
+                oldest, newest = cur.fetchone()
+                first_month = _month_start(oldest or datetime.now())
+                last_month = _add_months(_month_start(max(newest or datetime.now(), datetime.now())), DEFAULT_PARTITION_MONTHS_AHEAD)
+                for prefix in ("", "sent_"):
+                    for base_table in PARTITION_COLUMNS:
+                        parent_table = f"{prefix}{base_table}"
+                        month = first_month
+                        while month <= last_month:
+                            cur.execute(f"CREATE TABLE {_partition_name(parent_table, month)} PARTITION OF {parent_table} FOR VALUES FROM (%s) TO (%s);",
+                                        (month, _add_months(month, 1)))
+                            month = _add_months(month, 1)
+
+                for prefix in ("", "sent_"):
+                    if self._has_column(cur, f"{prefix}documents_flat", RAW_PAYLOAD_COLUMN): # Keep the archive
+                        cur.execute(f"ALTER TABLE {prefix}documents ADD COLUMN {RAW_PAYLOAD_COLUMN} BYTEA;")
+                    header_columns = self._shared_columns(cur, f"{prefix}documents_flat", f"{prefix}documents")
+                    select_list = ", ".join("COALESCE(date_time_received, date_time_issued, %(fallback)s)" if col == "date_time_received" else col for col in header_columns)
+                    cur.execute(f"INSERT INTO {prefix}documents ({', '.join(header_columns)}) SELECT {select_list} FROM {prefix}documents_flat;",
+                                {'fallback': PARTITION_KEY_FALLBACK})
+
+                    line_columns = [col for col in self._shared_columns(cur, f"{prefix}document_lines_flat", f"{prefix}document_lines") if col != "document_date_time_received"]
+                    cur.execute(f"""
+                        INSERT INTO {prefix}document_lines ({', '.join(line_columns)}, document_date_time_received)
+                        SELECT {', '.join('l.' + col for col in line_columns)}, COALESCE(h.date_time_received, h.date_time_issued, %(fallback)s)
+                        FROM {prefix}document_lines_flat l LEFT JOIN {prefix}documents_flat h ON h.uuid = l.document_uuid;
+                    """, {'fallback': PARTITION_KEY_FALLBACK})
+                    cur.execute(f"SELECT setval(pg_get_serial_sequence('{prefix}document_lines', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {prefix}document_lines;")
+
+                if not keep_flat_copy:
+                    cur.execute("DROP TABLE documents_flat, sent_documents_flat, document_lines_flat, sent_document_lines_flat;")
+            self.conn.commit()
+        except psycopg2.Error as e:
+            print(f"Partition migration failed, nothing was changed: {e}")
+            self.conn.rollback()
+            return (False, str(e).strip())
+
+        _partitioned_layouts[self.pool] = True
+        tables_ok, tables_message = self.check_and_create_tables(partitioned=True)
+        self.ensure_indexes()
+        months = (last_month.year - first_month.year) * 12 + last_month.month - first_month.month + 1
+        return (tables_ok, f"Migrated to monthly partitions ({months} months from {first_month}). {tables_message}")
+
+    @staticmethod
+    def _has_column(cursor, table_name, column):
+        cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s;",
+                       (table_name, column))
+        return cursor.fetchone() is not None
+
+    @staticmethod
+    def _shared_columns(cursor, source_table, target_table):
+        """Columns present in both tables, in the target's order."""
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+              AND column_name IN (SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s)
+            ORDER BY ordinal_position;
+        """, (target_table, source_table))
+        return [row[0] for row in cursor.fetchall()]
+
+    def ensure_indexes(self):
+        self._ensure_connection()
+        """
+        Creates the secondary indexes in INDEX_DEFINITIONS that are missing, and rebuilds any
+        left invalid by an interrupted build. Uses CREATE INDEX CONCURRENTLY so syncs can
+        keep writing meanwhile. Returns (ok, list of messages).
+        """
+        messages = []
+        ok = True
+        previous_autocommit = self.conn.autocommit
+        self.conn.autocommit = True # CONCURRENTLY cannot run inside a transaction block
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    SELECT c.relname, i.indisvalid FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = current_schema() AND c.relname = ANY(%s);
+                """, ([definition[0] for definition in INDEX_DEFINITIONS],))
+                existing = dict(cur.fetchall())
+                # CONCURRENTLY is not supported on partitioned tables; their index builds take a short write lock instead
+                concurrently = "" if self.is_partitioned() else " CONCURRENTLY"
+
+                for index_name, table_name, expression, predicate in INDEX_DEFINITIONS:
+                    if existing.get(index_name) is True:
+                        continue
+                    try:
+                        if index_name in existing:
+                            cur.execute(f"DROP INDEX{concurrently} IF EXISTS {index_name};")
+                            messages.append(f"Rebuilding invalid index {index_name}.")
+                        where_clause = f" WHERE {predicate}" if predicate else ""
+                        print(f"Creating index {index_name} on {table_name}...")
+                        cur.execute(f"CREATE INDEX{concurrently} IF NOT EXISTS {index_name} ON {table_name} (({expression})){where_clause};")
+                        messages.append(f"Created index {index_name}.")
+                    except psycopg2.Error as e:
+                        ok = False
+                        messages.append(f"Could not create index {index_name}: {str(e).strip()}")
+        except psycopg2.Error as e:
+            ok = False
+            messages.append(f"Index verification failed: {str(e).strip()}")
+        finally:
+            self.conn.autocommit = previous_autocommit
+        return ok, messages
+
+    def get_index_report(self):
+        self._ensure_connection()
+        """
+        Reports index health for the document tables: expected indexes that are missing or
+        invalid, and non-key indexes that have not been scanned since statistics were last reset.
+        Returns {'missing': [...], 'invalid': [...], 'unused': [(index, table, size)]}.
+        """
+        report = {'missing': [], 'invalid': [], 'unused': []}
+        tables = sorted({definition[1] for definition in INDEX_DEFINITIONS})
+        try:
+            with self.conn.cursor() as cur:
+                # Expected indexes by name (pg_class also covers partitioned parent indexes, which have no usage stats)
+                cur.execute("""
+                    SELECT c.relname, i.indisvalid FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = current_schema() AND c.relname = ANY(%s);
+                """, ([definition[0] for definition in INDEX_DEFINITIONS],))
+                found = dict(cur.fetchall())
+                report['missing'] = [definition[0] for definition in INDEX_DEFINITIONS if definition[0] not in found]
+                report['invalid'] = [index_name for index_name, is_valid in found.items() if not is_valid]
+
+                # Usage is tracked per table, or per partition in the partitioned layout
+                cur.execute("""
+                    SELECT s.indexrelname, s.relname, pg_size_pretty(pg_relation_size(s.indexrelid))
+                    FROM pg_stat_user_indexes s
+                    JOIN pg_index i ON i.indexrelid = s.indexrelid
+                    WHERE s.schemaname = current_schema() AND s.idx_scan = 0 AND NOT (i.indisprimary OR i.indisunique)
+                      AND (s.relname = ANY(%s) OR s.relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent IN
+                                                              (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t)));
+                """, (tables, tables))
+                report['unused'] = cur.fetchall()
+            self.conn.rollback()
+        except psycopg2.Error as e:
+            print(f"Failed to build index report: {e}")
+            self.conn.rollback()
+        return report
+
     def check_and_create_readonly_user(self):
         self._ensure_connection()
         """
@@ -319,6 +771,270 @@ class DatabaseManager:
             print(f"Failed to update sync status: {e}")
             self.conn.rollback()
 
+    def get_sync_checkpoints(self, client_id):
+        self._ensure_connection()
+        """
+        Loads the historical-sync checkpoints of a client, keyed by (sync_day, direction).
+        sync_day is the first day of the checkpointed search window, window_end its last.
+        """
+        sql = """
+            SELECT sync_day, direction, window_end, continuation_token, processed_uuids, failed_uuids, completed
+            FROM SyncCheckpoint WHERE client_id = %s;
+        """
+        checkpoints = {}
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(sql, (client_id,))
+                for sync_day, direction, window_end, token, processed, failed, completed in cur.fetchall():
+                    checkpoints[(sync_day, direction)] = {
+                        'window_end': window_end or sync_day,
+                        'continuation_token': token,
+                        'processed_uuids': processed or [],
+                        'failed_uuids': failed or [],
+                        'completed': completed,
+                    }
+            self.conn.commit()
+            return checkpoints
+        except psycopg2.Error as e:
+            print(f"Failed to load sync checkpoints: {e}")
+            self.conn.rollback()
+            return {}
+
+    def save_sync_checkpoint(self, cursor, client_id, sync_day, window_end, direction, continuation_token, new_processed_uuids, new_failed_uuids=(), completed=False):
+        """
+        Records progress for one search window/direction using the caller's cursor, so
+        the checkpoint commits atomically with the documents it describes.
+        UUID lists are appended to what is already stored.
+        """
+        sql = """
+            INSERT INTO SyncCheckpoint (client_id, sync_day, window_end, direction, continuation_token, processed_uuids, failed_uuids, completed, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s::TEXT[], %s::TEXT[], %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (client_id, sync_day, direction) DO UPDATE
+            SET window_end = EXCLUDED.window_end,
+                continuation_token = EXCLUDED.continuation_token,
+                processed_uuids = SyncCheckpoint.processed_uuids || EXCLUDED.processed_uuids,
+                failed_uuids = SyncCheckpoint.failed_uuids || EXCLUDED.failed_uuids,
+                completed = EXCLUDED.completed,
+                updated_at = CURRENT_TIMESTAMP;
+        """
+        cursor.execute(sql, (client_id, sync_day, window_end, direction, continuation_token, list(new_processed_uuids), list(new_failed_uuids), completed))
+
+    def clear_sync_checkpoints(self, client_id):
+        self._ensure_connection()
+        """Removes all checkpoints of a client once a historical sync has run to completion."""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("DELETE FROM SyncCheckpoint WHERE client_id = %s;", (client_id,))
+            self.conn.commit()
+        except psycopg2.Error as e:
+            print(f"Failed to clear sync checkpoints: {e}")
+            self.conn.rollback()
+
+    # --- Retry queue ---
+    def _ensure_retry_queue(self, cursor):
+        # Databases set up before the queue existed get it on first use
+        if self.pool not in _retry_queues:
+            for command in RETRY_QUEUE_COMMANDS:
+                cursor.execute(command)
+            _retry_queues.add(self.pool)
+
+    def _in_transaction(self, work, cursor=None, error_result=None, action="update the retry queue"):
+        """Runs work(cursor) in the caller's transaction, or in its own committed one when no cursor is given."""
+        if cursor is not None:
+            self._ensure_retry_queue(cursor)
+            return work(cursor)
+        self._ensure_connection()
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_retry_queue(cur)
+                result = work(cur)
+            self.conn.commit()
+            return result
+        except psycopg2.Error as e:
+            print(f"Failed to {action}: {e}")
+            self.conn.rollback()
+            return error_result
+
+    def enqueue_retries(self, items, cursor=None):
+        """Queues (uuid, direction) pairs for an immediate retry; UUIDs already queued keep their history."""
+        items = list(items)
+        if not items:
+            return 0
+        def work(cur):
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO retry_queue (uuid, direction) VALUES %s
+                ON CONFLICT (uuid) DO UPDATE SET direction = COALESCE(retry_queue.direction, EXCLUDED.direction);
+            """, items, page_size=BULK_PAGE_SIZE)
+            return len(items)
+        return self._in_transaction(work, cursor, 0, "enqueue retries")
+
+    def record_retry_failures(self, failures, cursor=None):
+        """
+        Records failed attempts as (uuid, direction, error_class, message) rows: the attempt
+        count goes up, the next try is pushed back exponentially and documents that reached
+        RETRY_MAX_ATTEMPTS are dead-lettered. Returns the number of rows this call dead-lettered,
+        or None if the failures could not be recorded (only without a caller's cursor).
+        """
+        failures = list({failure[0]: failure for failure in failures}.values()) # One row per uuid per statement
+        if not failures:
+            return 0
+        def work(cur):
+            rows = psycopg2.extras.execute_values(cur, f"""
+                INSERT INTO retry_queue AS q (uuid, direction, last_error_class, last_error, attempts, next_eligible_at)
+                SELECT v.uuid, v.direction, v.error_class, v.message, 1, (NOW() AT TIME ZONE 'UTC') + INTERVAL '{RETRY_BASE_DELAY_MINUTES} minutes'
+                FROM (VALUES %s) AS v (uuid, direction, error_class, message)
+                ON CONFLICT (uuid) DO UPDATE SET
+                    direction = COALESCE(EXCLUDED.direction, q.direction),
+                    attempts = q.attempts + 1,
+                    last_error_class = EXCLUDED.last_error_class,
+                    last_error = EXCLUDED.last_error,
+                    next_eligible_at = (NOW() AT TIME ZONE 'UTC')
+                        + LEAST(INTERVAL '{RETRY_BASE_DELAY_MINUTES} minutes' * POWER(2, q.attempts), INTERVAL '{RETRY_MAX_DELAY_MINUTES} minutes'),
+                    dead_lettered_at = CASE WHEN q.dead_lettered_at IS NULL AND q.attempts + 1 >= {RETRY_MAX_ATTEMPTS}
+                                            THEN (NOW() AT TIME ZONE 'UTC') ELSE q.dead_lettered_at END,
+                    updated_at = NOW()
+                RETURNING q.attempts = {RETRY_MAX_ATTEMPTS};
+            """, failures, page_size=BULK_PAGE_SIZE, fetch=True)
+            # attempts grows by one per call, so only the rows that crossed the limit just now match
+            return sum(1 for (crossed,) in rows if crossed)
+        return self._in_transaction(work, cursor, None, "record retry failures")
+
+    def get_eligible_retries(self, limit):
+        """Returns up to `limit` (uuid, direction, attempts) rows whose backoff has expired, longest-waiting first."""
+        def work(cur):
+            cur.execute("""
+                SELECT uuid, direction, attempts FROM retry_queue
+                WHERE dead_lettered_at IS NULL AND next_eligible_at <= (NOW() AT TIME ZONE 'UTC')
+                ORDER BY next_eligible_at LIMIT %s;
+            """, (limit,))
+            return cur.fetchall()
+        return self._in_transaction(work, error_result=[], action="read the retry queue")
+
+    def remove_retries(self, uuids, cursor=None):
+        uuids = list(uuids)
+        if not uuids:
+            return 0
+        def work(cur):
+            cur.execute("DELETE FROM retry_queue WHERE uuid = ANY(%s);", (uuids,))
+            return cur.rowcount
+        return self._in_transaction(work, cursor, 0, "remove retries")
+
+    def get_retry_queue_counts(self):
+        """Returns {'pending': n, 'eligible': n, 'dead_lettered': n}."""
+        def work(cur):
+            cur.execute("""
+                SELECT COUNT(*) FILTER (WHERE dead_lettered_at IS NULL),
+                       COUNT(*) FILTER (WHERE dead_lettered_at IS NULL AND next_eligible_at <= (NOW() AT TIME ZONE 'UTC')),
+                       COUNT(*) FILTER (WHERE dead_lettered_at IS NOT NULL)
+                FROM retry_queue;
+            """)
+            return dict(zip(('pending', 'eligible', 'dead_lettered'), cur.fetchone()))
+        return self._in_transaction(work, error_result={}, action="count the retry queue")
+
+    def requeue_dead_letters(self):
+        """Gives every dead-lettered document a fresh set of attempts."""
+        def work(cur):
+            cur.execute("""
+                UPDATE retry_queue SET dead_lettered_at = NULL, attempts = 0, next_eligible_at = (NOW() AT TIME ZONE 'UTC'), updated_at = NOW()
+                WHERE dead_lettered_at IS NOT NULL;
+            """)
+            return cur.rowcount
+        return self._in_transaction(work, error_result=0, action="requeue dead letters")
+
+    # --- Materialized ledger ---
+    def refresh_ledger_documents(self, cursor, document_uuids):
+        """
+        Replaces the ledger rows of the given documents with fresh rows from the source view,
+        inside the caller's transaction, so the ledger commits together with the documents.
+        """
+        if not document_uuids or not self._has_ledger_table(cursor):
+            return 0
+        document_uuids = list(document_uuids)
+        cursor.execute(f"DELETE FROM {LEDGER_TABLE} WHERE document_uuid = ANY(%s);", (document_uuids,))
+        cursor.execute(f"INSERT INTO {LEDGER_TABLE} SELECT * FROM vw_unified_financial_ledger_source WHERE document_uuid = ANY(%s);", (document_uuids,))
+        return cursor.rowcount
+
+    def _has_ledger_table(self, cursor):
+        if self.pool not in _ledger_tables:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (LEDGER_TABLE,))
+            _ledger_tables[self.pool] = cursor.fetchone()[0]
+            if _ledger_tables[self.pool]:
+                # Ledgers created before the index existed get it on first use; looked up first so the
+                # common case takes no table lock
+                cursor.execute("SELECT to_regclass(%s) IS NULL;", (f"idx_{LEDGER_TABLE}_document_uuid",))
+                if cursor.fetchone()[0]:
+                    cursor.execute(LEDGER_INDEX_SQL)
+        return _ledger_tables[self.pool]
+
+    def rebuild_financial_ledger(self):
+        self._ensure_connection()
+        """Recomputes the whole ledger table from the source view in one transaction. Returns (ok, message)."""
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"TRUNCATE {LEDGER_TABLE};")
+                cur.execute(f"INSERT INTO {LEDGER_TABLE} SELECT * FROM vw_unified_financial_ledger_source;")
+                row_count = cur.rowcount
+            self.conn.commit()
+            return (True, f"Ledger rebuilt with {row_count} rows.")
+        except psycopg2.Error as e:
+            print(f"Failed to rebuild the financial ledger: {e}")
+            self.conn.rollback()
+            return (False, str(e).strip())
+
+    # --- Raw-payload archive ---
+    def _has_raw_payload_archive(self, cursor):
+        if self.pool not in _raw_payload_archives:
+            _raw_payload_archives[self.pool] = self._has_column(cursor, "documents", RAW_PAYLOAD_COLUMN)
+        return _raw_payload_archives[self.pool]
+
+    def enable_raw_payload_archive(self):
+        self._ensure_connection()
+        """Adds the raw_payload column; from then on every written document keeps its compressed details JSON. Returns (ok, message)."""
+        try:
+            with self.conn.cursor() as cur:
+                for prefix in ("", "sent_"):
+                    cur.execute(f"ALTER TABLE {prefix}documents ADD COLUMN IF NOT EXISTS {RAW_PAYLOAD_COLUMN} BYTEA;")
+            self.conn.commit()
+            _raw_payload_archives[self.pool] = True
+            return (True, f"Raw-payload archive enabled ({COMPRESSION}). Documents synced from now on are archived.")
+        except psycopg2.Error as e:
+            print(f"Failed to enable the raw-payload archive: {e}")
+            self.conn.rollback()
+            return (False, str(e).strip())
+
+    def remap_archived_documents(self, table_prefix="", batch_size=REMAP_BATCH_SIZE, should_continue=None):
+        self._ensure_connection()
+        """
+        Re-runs the field mapping over the archived payloads, e.g. after columns were added,
+        without calling the ETA API. Headers are upserted and lines replaced in batches of
+        `batch_size`, one transaction each. The status columns (REMAP_PRESERVED_COLUMNS) and
+        the archive itself are left as they are. Returns (ok, message).
+        """
+        table_name = f"{table_prefix}documents"
+        remapped, last_uuid = 0, ""
+        try:
+            with self.conn.cursor() as cur:
+                if not self._has_raw_payload_archive(cur):
+                    return (False, "The raw-payload archive is not enabled for this database.")
+                while should_continue is None or should_continue():
+                    cur.execute(f"""
+                        SELECT uuid, {RAW_PAYLOAD_COLUMN} FROM {table_name}
+                        WHERE {RAW_PAYLOAD_COLUMN} IS NOT NULL AND uuid > %s ORDER BY uuid LIMIT %s;
+                    """, (last_uuid, batch_size))
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    last_uuid = rows[-1][0]
+                    docs = [decompress_payload(blob) for _, blob in rows]
+                    remapped += self._write_documents(cur, docs, table_prefix, WRITE_MODE_UPSERT, archive=False,
+                                                      preserved_columns=REMAP_PRESERVED_COLUMNS)
+                    self.conn.commit()
+            return (True, f"Re-mapped {remapped} archived '{table_name}' documents.")
+        except (psycopg2.Error, ValueError) as e:
+            print(f"Re-mapping archived documents failed after {remapped} documents: {e}")
+            self.conn.rollback()
+            return (False, str(e).strip())
+
     def update_document_status(self, uuid, new_status, reason, table_prefix=""):
         self._ensure_connection()
         """Updates the status and reason for a single document."""
@@ -327,6 +1043,7 @@ class DatabaseManager:
         try:
             with self.conn.cursor() as cur:
                 cur.execute(sql, (new_status, reason, uuid))
+                self.refresh_ledger_documents(cur, [uuid])
             self.conn.commit()
             return True
         except psycopg2.Error as e:
@@ -334,11 +1051,114 @@ class DatabaseManager:
             self.conn.rollback()
             return False
 
+    def update_document_statuses(self, status_updates, table_prefix=""):
+        self._ensure_connection()
+        """
+        Applies many (uuid, new_status, reason) changes with one UPDATE ... FROM (VALUES ...)
+        and a single commit. Returns the number of rows updated, or None on failure.
+        """
+        if not status_updates:
+            return 0
+        table_name = f"{table_prefix}documents"
+        sql = (f"UPDATE {table_name} AS d SET status = v.status, document_status_reason = v.reason, "
+               f"status_changed_at = (NOW() AT TIME ZONE 'UTC'), next_check_at = NULL "
+               f"FROM (VALUES %s) AS v(uuid, status, reason) WHERE d.uuid = v.uuid;")
+        try:
+            with self.conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, sql, list(status_updates), page_size=BULK_PAGE_SIZE)
+                updated = cur.rowcount
+                self.refresh_ledger_documents(cur, [update[0] for update in status_updates])
+            self.conn.commit()
+            return updated
+        except psycopg2.Error as e:
+            print(f"Failed to bulk update {len(status_updates)} document statuses: {e}")
+            self.conn.rollback()
+            return None
+
+    def set_next_check_times(self, schedule, table_prefix=""):
+        self._ensure_connection()
+        """Stores the next status recheck time for many (uuid, next_check_at) pairs in one statement."""
+        if not schedule:
+            return True
+        table_name = f"{table_prefix}documents"
+        sql = (f"UPDATE {table_name} AS d SET next_check_at = v.next_check_at "
+               f"FROM (VALUES %s) AS v(uuid, next_check_at) WHERE d.uuid = v.uuid;")
+        try:
+            with self.conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, sql, list(schedule), template="(%s, %s::timestamp)", page_size=BULK_PAGE_SIZE)
+            self.conn.commit()
+            return True
+        except psycopg2.Error as e:
+            print(f"Failed to store next check times for {len(schedule)} documents: {e}")
+            self.conn.rollback()
+            return False
+
     def document_exists(self, uuid, table_prefix=""):
         self._ensure_connection()
         table_name = f"{table_prefix}documents"; query = f"SELECT 1 FROM {table_name} WHERE uuid = %s"
         with self.conn.cursor() as cur: cur.execute(query, (uuid,)); return cur.fetchone() is not None
 
+    def count_documents(self, table_prefix=""):
+        self._ensure_connection()
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {table_prefix}documents;")
+                return cur.fetchone()[0]
+        except psycopg2.Error as e:
+            print(f"Error counting {table_prefix}documents: {e}")
+            self.conn.rollback()
+            return None
+
+    def scan_document_uuids(self, table_prefix="", consume=None, batch_size=UUID_SCAN_BATCH):
+        self._ensure_connection()
+        """
+        Streams every stored UUID of the header table to consume(batch) through a
+        server-side cursor, so memory stays flat. Returns the number scanned, or None on failure.
+        """
+        scanned = 0
+        try:
+            with self.conn.cursor(name=f"scan_{table_prefix}document_uuids") as cur:
+                cur.itersize = batch_size
+                cur.execute(f"SELECT uuid FROM {table_prefix}documents;")
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    consume([row[0] for row in rows])
+                    scanned += len(rows)
+            self.conn.commit()
+            return scanned
+        except psycopg2.Error as e:
+            print(f"Error scanning {table_prefix}documents UUIDs: {e}")
+            self.conn.rollback()
+            return None
+
+    def locate_documents(self, uuids):
+        self._ensure_connection()
+        """
+        Finds which header table each UUID is stored in with one query over both tables.
+        Returns {uuid: 'Received' | 'Sent' | None} for every given UUID, or None if the lookup failed.
+        """
+        uuids = list(dict.fromkeys(uuids))
+        if not uuids:
+            return {}
+        query = """
+            SELECT uuid, 'Received' FROM documents WHERE uuid = ANY(%(uuids)s)
+            UNION ALL
+            SELECT uuid, 'Sent' FROM sent_documents WHERE uuid = ANY(%(uuids)s);
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(query, {'uuids': uuids})
+                locations = dict.fromkeys(uuids)
+                for uuid, direction in cur.fetchall():
+                    locations[uuid] = locations[uuid] or direction
+            return locations
+        except psycopg2.Error as e:
+            print(f"Error locating documents: {e}")
+            self.conn.rollback()
+            return None
+
     def filter_existing_uuids(self, uuids_to_check, table_prefix=""):
         self._ensure_connection()
         """
@@ -369,57 +1189,14 @@ class DatabaseManager:
             return uuids_to_check
     
 
-    def insert_document(self, cursor, doc_data, table_prefix=""):
+    def insert_document(self, cursor, doc_data, table_prefix="", mode=WRITE_MODE_INSERT):
         self._ensure_connection()
         """
         Inserts a single document using a provided database cursor for batching.
         This version is designed to be called from a worker's transaction loop.
         """
-        header_table = f"{table_prefix}documents"
-        lines_table = f"{table_prefix}document_lines"
-        
         try:
-            # The logic for parsing is the same as the last complete version.
-            # It correctly handles all three JSON structures.
-            core_data_object = doc_data.get('document', doc_data)
-
-            header_data = {
-                "uuid": doc_data.get('uuid'),
-                "submission_uuid": doc_data.get('submissionUUID'),
-                "status": doc_data.get('status'),
-                "total_amount": doc_data.get('totalAmount'),
-                "net_amount": doc_data.get('netAmount'),
-                "total_sales": doc_data.get('totalSales'),
-                "total_discount": doc_data.get('totalDiscount'),
-                "date_time_received": doc_data.get('dateTimeReceived') or doc_data.get('dateTimeRecevied'),
-                "document_status_reason": doc_data.get('documentStatusReason'),
-                "internal_id": core_data_object.get('internalID') or core_data_object.get('internalId'),
-                "type_name": core_data_object.get('documentType'),
-                "date_time_issued": core_data_object.get('dateTimeIssued'),
-                "issuer_id": core_data_object.get('issuer', {}).get('id'),
-                "issuer_name": core_data_object.get('issuer', {}).get('name'),
-                "receiver_id": core_data_object.get('receiver', {}).get('id'),
-                "receiver_name": core_data_object.get('receiver', {}).get('name')
-            }
-            
-            columns = ', '.join(header_data.keys())
-            placeholders = ', '.join([f'%({key})s' for key in header_data.keys()])
-            header_sql = f"INSERT INTO {header_table} ({columns}) VALUES ({placeholders});"
-            # Use the provided cursor
-            cursor.execute(header_sql, header_data)
-
-            for line in core_data_object.get('invoiceLines', []):
-                line_data = {
-                    "document_uuid": doc_data.get('uuid'), "description": line.get('description'),
-                    "item_code": line.get('itemCode'), "quantity": line.get('quantity'),
-                    "net_total": line.get('netTotal'), "total": line.get('total')
-                }
-                line_columns = ', '.join(line_data.keys())
-                line_placeholders = ', '.join([f'%({key})s' for key in line_data.keys()])
-                lines_sql = f"INSERT INTO {lines_table} ({line_columns}) VALUES ({line_placeholders});"
-                # Use the provided cursor
-                cursor.execute(lines_sql, line_data)
-            
+            self.insert_documents(cursor, [doc_data], table_prefix, mode)
             return True # Signal success to the calling worker
 
         except (psycopg2.Error, ValueError) as e:
@@ -427,14 +1204,57 @@ class DatabaseManager:
             print(f"DB Batch Error on doc {doc_data.get('uuid')}: {e}")
             return False # Signal failure
 
+    def insert_documents(self, cursor, docs, table_prefix="", mode=WRITE_MODE_INSERT):
+        """
+        Bulk-writes many parsed documents with the provided cursor: one multi-row
+        statement for all headers and one for all of their lines (paged by execute_values).
+        In 'upsert' mode existing headers are updated in place and the lines of every
+        document in the batch are deleted and re-inserted, so the same batch can be
+        written twice without a primary-key violation.
+        Raises on failure; the caller owns the transaction and rolls back.
+        Returns the number of header rows written.
+        """
+        return self._write_documents(cursor, docs, table_prefix, mode, archive=self._has_raw_payload_archive(cursor))
+
+    def _write_documents(self, cursor, docs, table_prefix, mode, archive, preserved_columns=()):
+        """insert_documents, with the raw-payload archive and the upsert's preserved columns chosen by the caller."""
+        if not docs:
+            return 0
+        header_table = f"{table_prefix}documents"
+        lines_table = f"{table_prefix}document_lines"
+
+        if mode == WRITE_MODE_UPSERT:
+            # A uuid may only appear once per ON CONFLICT statement; the last copy wins.
+            docs = list({doc_data.get('uuid'): doc_data for doc_data in docs}.values())
+        partitioned = self.is_partitioned(cursor)
+        header_columns = ARCHIVED_HEADER_COLUMNS if archive else HEADER_COLUMNS
+        header_rows = []
+        document_line_rows = []
+        for doc_data in docs:
+            row, rows_of_lines = header_row(doc_data), line_rows(doc_data)
+            if partitioned:
+                row, rows_of_lines = _with_partition_key(row, rows_of_lines)
+            header_rows.append(row + (psycopg2.Binary(compress_payload(doc_data)),) if archive else row)
+            document_line_rows.extend(rows_of_lines)
+
+        if mode == WRITE_MODE_UPSERT:
+            conflict_columns = PARTITIONED_CONFLICT_COLUMNS if partitioned else ("uuid",)
+            psycopg2.extras.execute_values(cursor, _upsert_sql(header_table, header_columns, conflict_columns, preserved_columns), header_rows, page_size=BULK_PAGE_SIZE)
+            cursor.execute(f"DELETE FROM {lines_table} WHERE document_uuid = ANY(%s);", ([row[0] for row in header_rows],))
+        else:
+            psycopg2.extras.execute_values(cursor, _insert_sql(header_table, header_columns), header_rows, page_size=BULK_PAGE_SIZE)
+        if document_line_rows:
+            psycopg2.extras.execute_values(cursor, _insert_sql(lines_table, LINE_COLUMNS), document_line_rows, page_size=BULK_PAGE_SIZE)
+        self.refresh_ledger_documents(cursor, [row[0] for row in header_rows])
+        return len(header_rows)
+
     def get_latest_invoice_timestamp(self):
         self._ensure_connection()
         query = """
-            SELECT MAX(date_time_received) FROM (
-                SELECT date_time_received FROM documents
-                UNION ALL
-                SELECT date_time_received FROM sent_documents
-            ) AS all_dates;
+            SELECT GREATEST(
+                (SELECT MAX(date_time_received) FROM documents),
+                (SELECT MAX(date_time_received) FROM sent_documents)
+            ); -- Separate MAX()es so each one is a single index probe
         """
         try:
             with self.conn.cursor() as cur:
@@ -455,8 +1275,8 @@ class DatabaseManager:
         uuids = []
         # We check both tables. The NOW() function is timezone-aware in PostgreSQL.
         queries = [
-            "SELECT uuid FROM documents WHERE status = 'Valid' AND canbe_cancelled_until > NOW()",
-            "SELECT uuid FROM sent_documents WHERE status = 'Valid' AND canbe_cancelled_until > NOW()"
+            "SELECT uuid FROM documents WHERE status = 'Valid' AND GREATEST(canbe_cancelled_until, canbe_rejected_until) > NOW()",
+            "SELECT uuid FROM sent_documents WHERE status = 'Valid' AND GREATEST(canbe_cancelled_until, canbe_rejected_until) > NOW()"
         ]
         try:
             with self.conn.cursor() as cur:
@@ -472,6 +1292,41 @@ class DatabaseManager:
             self.conn.rollback()
             return []
 
+    def get_influx_documents(self, due_only=False, limit=None):
+        self._ensure_connection()
+        """
+        Returns (uuid, table_prefix, status, date_time_received, deadline, status_changed_at)
+        rows for 'Valid' documents that can still be cancelled or rejected, from both tables.
+        `deadline` is the later of the two windows. With `due_only`, only documents whose
+        next_check_at has passed (or was never set) are returned, the most overdue first,
+        capped at `limit` rows.
+        """
+        # next_check_at is stored as naive UTC
+        due_filter = "AND (next_check_at IS NULL OR next_check_at <= NOW() AT TIME ZONE 'UTC')" if due_only else ""
+        query = f"""
+            SELECT * FROM (
+                SELECT uuid, '' AS table_prefix, status, date_time_received,
+                       GREATEST(canbe_cancelled_until, canbe_rejected_until) AS deadline, status_changed_at, next_check_at
+                FROM documents
+                WHERE status = 'Valid' AND GREATEST(canbe_cancelled_until, canbe_rejected_until) > NOW() {due_filter}
+                UNION ALL
+                SELECT uuid, 'sent_' AS table_prefix, status, date_time_received,
+                       GREATEST(canbe_cancelled_until, canbe_rejected_until) AS deadline, status_changed_at, next_check_at
+                FROM sent_documents
+                WHERE status = 'Valid' AND GREATEST(canbe_cancelled_until, canbe_rejected_until) > NOW() {due_filter}
+            ) AS influx
+            ORDER BY next_check_at ASC NULLS FIRST, deadline ASC
+            LIMIT %s;
+        """
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(query, (limit,)) # LIMIT NULL means no limit
+                return [row[:6] for row in cur.fetchall()]
+        except psycopg2.Error as e:
+            print(f"Failed to get in-flux documents: {e}")
+            self.conn.rollback()
+            return []
+
     def create_database(self, new_db_name):
         """
         Connects to the maintenance 'postgres' DB to create a new database.
@@ -482,10 +1337,11 @@ class DatabaseManager:
         temp_params = self.db_params.copy()
         temp_params['dbname'] = 'postgres'
         
+        maintenance_pool = get_pool(temp_params)
         conn = None
         try:
-            # Establish the connection to the maintenance database
-            conn = psycopg2.connect(**temp_params, sslmode='require')
+            # Borrow a connection to the maintenance database from its pool
+            conn = maintenance_pool.getconn()
             # CREATE DATABASE cannot run inside a transaction, so we use autocommit.
             conn.autocommit = True
             
@@ -504,4 +1360,4 @@ class DatabaseManager:
             return (False, str(e).strip())
         finally:
             if conn:
-                conn.close()
\ No newline at end of file
+                maintenance_pool.putconn(conn)
\ No newline at end of file
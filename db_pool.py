@@ -0,0 +1,161 @@
+# db_pool.py
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_IDLE_TIMEOUT = 300        # Close connections nobody has used for this many seconds
+DEFAULT_HEALTH_CHECK_AFTER = 30   # Ping a connection with SELECT 1 if it sat idle longer than this
+DEFAULT_CHECKOUT_TIMEOUT = 60
+REAPER_INTERVAL = 60
+
+class PoolExhaustedError(psycopg2.OperationalError):
+    """Raised when no pooled connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of TLS connections to one database. Connections are
+    handed out most-recently-used first, health-checked when they sat idle for
+    a while, reset (rollback, autocommit off) when returned, and closed once
+    they stay idle longer than `idle_timeout`.
+    """
+    def __init__(self, conn_params, max_connections=DEFAULT_MAX_CONNECTIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 health_check_after=DEFAULT_HEALTH_CHECK_AFTER):
+        self.conn_params = conn_params
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self._idle = []        # [(conn, last_used_monotonic)], most recently used last
+        self._checked_out = 0
+        self._cond = threading.Condition()
+
+    def getconn(self, timeout=DEFAULT_CHECKOUT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            candidate = None
+            with self._cond:
+                while not self._idle and self._checked_out >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(f"All {self.max_connections} pooled connections are in use.")
+                    self._cond.wait(remaining)
+                self._checked_out += 1
+                if self._idle:
+                    candidate = self._idle.pop()
+
+            if candidate is None:
+                try:
+                    return psycopg2.connect(**self.conn_params, sslmode='require')
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            conn, last_used = candidate
+            # The health check runs outside the lock so a slow ping does not block other threads
+            if self._is_healthy(conn, time.monotonic() - last_used):
+                return conn
+            self._close_quietly(conn)
+            self._release_slot()
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, or closes it if it is broken or `discard` is set."""
+        if not discard and conn.closed == 0:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed != 0:
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._checked_out -= 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        self.evict_idle()
+
+    def evict_idle(self):
+        """Closes connections that have been idle longer than idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._cond:
+            expired = [conn for conn, last_used in self._idle if last_used < cutoff]
+            self._idle = [(conn, last_used) for conn, last_used in self._idle if last_used >= cutoff]
+        for conn in expired:
+            self._close_quietly(conn)
+        return len(expired)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {'idle': len(self._idle), 'checked_out': self._checked_out, 'max': self.max_connections}
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed != 0:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._checked_out -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+# --- Process-wide registry: one pool per distinct set of connection parameters ---
+_pools = {}
+_pools_lock = threading.Lock()
+_reaper_thread = None
+
+def _pool_key(conn_params):
+    return tuple(sorted((key, str(value)) for key, value in conn_params.items()))
+
+def get_pool(conn_params):
+    """Returns the shared pool for these connection parameters, creating it on first use."""
+    global _reaper_thread
+    key = _pool_key(conn_params)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(dict(conn_params))
+            _pools[key] = pool
+        if _reaper_thread is None:
+            _reaper_thread = threading.Thread(target=_reap_idle_connections, name="db-pool-reaper", daemon=True)
+            _reaper_thread.start()
+        return pool
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+def _reap_idle_connections():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        with _pools_lock:
+            pools = list(_pools.values())
+        for pool in pools:
+            pool.evict_idle()
@@ -0,0 +1,63 @@
+# detail_fetcher.py
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DEFAULT_MAX_IN_FLIGHT = 4
+
+class DetailFetcher:
+    """
+    Keeps a bounded number of document-detail requests in flight and hands the
+    results back as they complete. All requests go through the same api_client,
+    so they share its rate limit.
+    """
+    def __init__(self, api_client, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.api_client = api_client
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._errors = {} # uuid -> (error_class, message) of failed fetches, until popped
+
+    def _fetch_one(self, uuid):
+        # Runs on the pool thread, where the api_client's per-thread last_error is visible
+        details = self.api_client.get_document_details(uuid)
+        if not details:
+            self._errors[uuid] = self.api_client.last_error or ("empty_response", "")
+        return details
+
+    def pop_error(self, uuid):
+        """(error_class, message) for a uuid that was yielded with details=None."""
+        return self._errors.pop(uuid, ("unknown", ""))
+
+    def fetch(self, uuids, should_continue=None):
+        """
+        Yields (uuid, details) tuples in completion order. `details` is None when
+        the API call failed. No new requests are started once `should_continue()`
+        returns False; requests already in flight are still drained.
+        """
+        pending = iter(uuids)
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="eta-details") as pool:
+            def submit_next():
+                if should_continue is not None and not should_continue():
+                    return False
+                uuid = next(pending, None)
+                if uuid is None:
+                    return False
+                in_flight[pool.submit(self._fetch_one, uuid)] = uuid
+                return True
+
+            # --- Prime the pipeline up to the in-flight limit ---
+            for _ in range(self.max_in_flight):
+                if not submit_next(): break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    uuid = in_flight.pop(future)
+                    try:
+                        details = future.result()
+                    except Exception as e:
+                        print(f"Detail fetch for {uuid} raised: {e}")
+                        self._errors[uuid] = (type(e).__name__, str(e)[:500])
+                        details = None
+                    # Refill the slot before handing the result over so the network stays busy
+                    submit_next()
+                    yield uuid, details
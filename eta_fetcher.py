@@ -0,0 +1,347 @@
+# eta_fetcher.py
+"""
+Headless entry point for running syncs without the Tk GUI, e.g. under systemd:
+
+    python -m eta_fetcher clients
+    python -m eta_fetcher sync --clients "My Company" --from 2023-01-01 --to 2023-12-31
+    python -m eta_fetcher live [--clients A B]
+    python -m eta_fetcher daemon --at 08:00 [--clients A B]
+    python -m eta_fetcher partition [--clients A B] [--keep-flat-copy]
+    python -m eta_fetcher rebuild-ledger [--clients A B]
+    python -m eta_fetcher archive [--clients A B] [--remap]
+    python -m eta_fetcher retries [--clients A B] [--requeue-dead]
+    python -m eta_fetcher rebuild-uuid-index [--clients A B]
+
+Progress is written to stdout as one JSON object per line. Nothing from the
+UI stack (customtkinter, tkcalendar) is imported.
+"""
+import argparse
+import datetime
+import json
+import queue
+import signal
+import sys
+import threading
+import schedule
+import config_manager
+from api_client import ETAApiClient
+from db_manager import DatabaseManager
+from sync_worker import SyncWorker
+from live_sync_manager import LiveSyncManager, DEFAULT_MAX_CONCURRENT_CLIENTS
+from detail_fetcher import DEFAULT_MAX_IN_FLIGHT
+from backfill_scheduler import DEFAULT_MAX_PARALLEL_UNITS
+from log_sink import get_log_sink
+from uuid_index import get_uuid_index
+
+QUEUE_POLL_INTERVAL = 0.5
+
+def emit(event, **fields):
+    """Writes one structured log line to stdout."""
+    record = {'ts': datetime.datetime.now().isoformat(timespec='seconds'), 'event': event}
+    record.update(fields)
+    print(json.dumps(record, default=str, ensure_ascii=False), flush=True)
+
+def emit_log_records(records):
+    """Log sink listener: one JSON line per worker log record."""
+    lines = []
+    for ts, level, client, message in records:
+        record = {'ts': ts.isoformat(timespec='seconds'), 'event': 'log', 'level': level, 'message': message}
+        if client: record['client'] = client
+        lines.append(json.dumps(record, default=str, ensure_ascii=False))
+    print("\n".join(lines), flush=True)
+
+
+class QueueReporter:
+    """Drains a worker progress queue and turns its messages into structured stdout lines."""
+    def __init__(self, progress_queue):
+        self.progress_queue = progress_queue
+        self.last_progress = None
+        self.results = []
+
+    def drain(self):
+        while True:
+            try:
+                message_type, data = self.progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.handle(message_type, data)
+
+    def handle(self, message_type, data):
+        if message_type == "LOG":
+            get_log_sink().log(data)
+        elif message_type == "PROGRESS":
+            percent = int(float(data) * 100)
+            if percent != self.last_progress: # One line per whole percent is enough for a log
+                self.last_progress = percent
+                emit("progress", percent=percent)
+        elif message_type == "LIVE_UPDATE":
+            client_name, status_text = data
+            emit("client_status", client=client_name, status=status_text)
+        elif message_type == "HISTORICAL_SYNC_COMPLETE":
+            skipped_days, failed_uuids, client_name = data
+            config_manager.merge_sync_results(client_name, skipped_days, ()) # Failed UUIDs are already in the DB retry queue
+            self.results.append(data)
+            emit("historical_sync_complete", client=client_name, skipped_days=len(skipped_days), queued_for_retry=len(failed_uuids))
+        elif message_type == "LIVE_SYNC_COMPLETE":
+            emit("live_sync_complete")
+        else:
+            emit(message_type.lower(), data=data)
+
+    def follow(self, worker, stop_event):
+        """Reports until the worker thread exits; a stop request is forwarded to the worker."""
+        stop_sent = False
+        while worker.is_alive():
+            if stop_event.is_set() and not stop_sent:
+                worker.stop()
+                stop_sent = True
+            worker.join(QUEUE_POLL_INTERVAL)
+            self.drain()
+        self.drain()
+
+
+def select_clients(all_clients, names):
+    if not names:
+        return all_clients
+    missing = [name for name in names if name not in all_clients]
+    if missing:
+        raise SystemExit(f"Unknown client(s): {', '.join(missing)}. Run 'python -m eta_fetcher clients' to list them.")
+    return {name: all_clients[name] for name in names}
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+
+# --- Commands ---
+def cmd_clients(args, stop_event):
+    for name, config in config_manager.load_all_clients().items():
+        emit("client", client=name, db_host=config.get('db_host'), db_name=config.get('db_name'),
+             oldest_invoice_date=config.get('oldest_invoice_date'))
+    return 0
+
+def cmd_sync(args, stop_event):
+    clients = select_clients(config_manager.load_all_clients(), args.clients)
+    exit_code = 0
+    for client_name, client_config in clients.items():
+        if stop_event.is_set(): break
+        start_date = args.date_from
+        if start_date is None:
+            oldest = client_config.get('oldest_invoice_date')
+            start_date = parse_date(oldest) if oldest else datetime.date.today() - datetime.timedelta(days=30)
+        end_date = args.date_to or datetime.date.today()
+
+        api_client = ETAApiClient(client_config.get('client_id'), client_config.get('client_secret'))
+        success, message = api_client.test_authentication()
+        if not success:
+            emit("error", client=client_name, message=f"ETA authentication failed: {message}")
+            exit_code = 1
+            continue
+
+        emit("historical_sync_start", client=client_name, date_from=start_date, date_to=end_date)
+        progress_queue = queue.Queue()
+        worker = SyncWorker(client_name, client_config.get('client_id'), api_client,
+                            DatabaseManager(config_manager.client_db_params(client_config)), start_date, end_date, progress_queue,
+                            max_in_flight=args.max_in_flight, max_parallel_units=args.max_parallel_units)
+        get_log_sink().start_session(f"Historical_{client_name}")
+        worker.start()
+        QueueReporter(progress_queue).follow(worker, stop_event)
+        get_log_sink().end_session()
+    return exit_code
+
+def run_live_sync(clients, args, stop_event):
+    progress_queue = queue.Queue()
+    manager = LiveSyncManager(clients, progress_queue, max_concurrent_clients=args.max_clients)
+    get_log_sink().start_session("LiveSync_AllClients", client_prefix="LiveSync")
+    manager.start()
+    QueueReporter(progress_queue).follow(manager, stop_event)
+    get_log_sink().end_session()
+
+def cmd_live(args, stop_event):
+    clients = select_clients(config_manager.load_all_clients(), args.clients)
+    run_live_sync(clients, args, stop_event)
+    return 0
+
+def cmd_partition(args, stop_event):
+    """Converts each client's document tables to the monthly-partitioned layout."""
+    exit_code = 0
+    for client_name, client_config in select_clients(config_manager.load_all_clients(), args.clients).items():
+        if stop_event.is_set(): break
+        db_manager = DatabaseManager(config_manager.client_db_params(client_config))
+        if not db_manager.connect():
+            emit("error", client=client_name, message="Database connection failed.")
+            exit_code = 1
+            continue
+        try:
+            emit("partition_migration_start", client=client_name)
+            success, message = db_manager.migrate_to_partitioned(keep_flat_copy=args.keep_flat_copy)
+            emit("partition_migration_complete" if success else "error", client=client_name, message=message)
+            if not success: exit_code = 1
+        finally:
+            db_manager.disconnect()
+    return exit_code
+
+def cmd_rebuild_ledger(args, stop_event):
+    """Recomputes each client's materialized financial ledger from the document tables."""
+    exit_code = 0
+    for client_name, client_config in select_clients(config_manager.load_all_clients(), args.clients).items():
+        if stop_event.is_set(): break
+        db_manager = DatabaseManager(config_manager.client_db_params(client_config))
+        if not db_manager.connect():
+            emit("error", client=client_name, message="Database connection failed.")
+            exit_code = 1
+            continue
+        try:
+            success, message = db_manager.rebuild_financial_ledger()
+            emit("ledger_rebuilt" if success else "error", client=client_name, message=message)
+            if not success: exit_code = 1
+        finally:
+            db_manager.disconnect()
+    return exit_code
+
+def cmd_archive(args, stop_event):
+    """Enables the raw-payload archive and optionally re-maps the archived documents into their columns."""
+    exit_code = 0
+    for client_name, client_config in select_clients(config_manager.load_all_clients(), args.clients).items():
+        if stop_event.is_set(): break
+        db_manager = DatabaseManager(config_manager.client_db_params(client_config))
+        if not db_manager.connect():
+            emit("error", client=client_name, message="Database connection failed.")
+            exit_code = 1
+            continue
+        try:
+            success, message = db_manager.enable_raw_payload_archive()
+            emit("archive_enabled" if success else "error", client=client_name, message=message)
+            for table_prefix in ("", "sent_") if success and args.remap else ():
+                success, message = db_manager.remap_archived_documents(table_prefix, should_continue=lambda: not stop_event.is_set())
+                emit("archive_remapped" if success else "error", client=client_name, message=message)
+            if not success: exit_code = 1
+        finally:
+            db_manager.disconnect()
+    return exit_code
+
+def cmd_retries(args, stop_event):
+    """Reports each client's retry queue; --requeue-dead gives dead-lettered documents another round."""
+    exit_code = 0
+    for client_name, client_config in select_clients(config_manager.load_all_clients(), args.clients).items():
+        db_manager = DatabaseManager(config_manager.client_db_params(client_config))
+        if not db_manager.connect():
+            emit("error", client=client_name, message="Database connection failed.")
+            exit_code = 1
+            continue
+        try:
+            if args.requeue_dead:
+                emit("dead_letters_requeued", client=client_name, count=db_manager.requeue_dead_letters())
+            emit("retry_queue", client=client_name, **db_manager.get_retry_queue_counts())
+        finally:
+            db_manager.disconnect()
+    return exit_code
+
+def cmd_rebuild_uuid_index(args, stop_event):
+    """Rebuilds each client's local UUID indexes from the database, e.g. after documents were loaded by other means."""
+    exit_code = 0
+    for client_name, client_config in select_clients(config_manager.load_all_clients(), args.clients).items():
+        if stop_event.is_set(): break
+        db_manager = DatabaseManager(config_manager.client_db_params(client_config))
+        if not db_manager.connect():
+            emit("error", client=client_name, message="Database connection failed.")
+            exit_code = 1
+            continue
+        try:
+            for table_prefix in ("", "sent_"):
+                index = get_uuid_index(client_name, table_prefix)
+                if index.rebuild(db_manager):
+                    emit("uuid_index_rebuilt", client=client_name, table=f"{table_prefix}documents", documents=index.bloom.count)
+                else:
+                    emit("error", client=client_name, message=f"Could not rebuild the {table_prefix}documents UUID index.")
+                    exit_code = 1
+        finally:
+            db_manager.disconnect()
+    return exit_code
+
+def cmd_daemon(args, stop_event):
+    try:
+        datetime.datetime.strptime(args.at, "%H:%M")
+    except ValueError:
+        raise SystemExit("--at must be in HH:MM (24-hour) format.")
+
+    def job():
+        # Reload every run so clients added through the GUI are picked up
+        clients = select_clients(config_manager.load_all_clients(), args.clients)
+        emit("scheduled_live_sync", clients=len(clients))
+        run_live_sync(clients, args, stop_event)
+
+    scheduler = schedule.Scheduler()
+    scheduler.every().day.at(args.at).do(job)
+    emit("daemon_started", at=args.at)
+    if args.run_now:
+        job()
+    while not stop_event.is_set():
+        scheduler.run_pending()
+        stop_event.wait(1)
+    emit("daemon_stopped")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="eta_fetcher", description="Run ETA-Fetcher syncs without the GUI.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("clients", help="List the configured clients.")
+
+    sync = sub.add_parser("sync", help="Historical sync over a date range.")
+    sync.add_argument("--clients", nargs="+", help="Client names (default: all).")
+    sync.add_argument("--from", dest="date_from", type=parse_date, help="Start date YYYY-MM-DD (default: the client's oldest invoice date).")
+    sync.add_argument("--to", dest="date_to", type=parse_date, help="End date YYYY-MM-DD (default: today).")
+    sync.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Concurrent detail requests per window.")
+    sync.add_argument("--max-parallel-units", type=int, default=DEFAULT_MAX_PARALLEL_UNITS, help="Search windows processed at once.")
+
+    partition = sub.add_parser("partition", help="Convert document tables to monthly partitions.")
+    partition.add_argument("--clients", nargs="+", help="Client names (default: all).")
+    partition.add_argument("--keep-flat-copy", action="store_true", help="Keep the old tables as *_flat instead of dropping them.")
+
+    rebuild_ledger = sub.add_parser("rebuild-ledger", help="Rebuild the materialized financial ledger from scratch.")
+    rebuild_ledger.add_argument("--clients", nargs="+", help="Client names (default: all).")
+
+    archive = sub.add_parser("archive", help="Keep the compressed raw details JSON of every synced document.")
+    archive.add_argument("--clients", nargs="+", help="Client names (default: all).")
+    archive.add_argument("--remap", action="store_true", help="Also re-map already archived documents into their columns.")
+
+    retries = sub.add_parser("retries", help="Show the retry queue of each client.")
+    retries.add_argument("--clients", nargs="+", help="Client names (default: all).")
+    retries.add_argument("--requeue-dead", action="store_true", help="Retry dead-lettered documents again.")
+
+    rebuild_uuid_index = sub.add_parser("rebuild-uuid-index", help="Rebuild the local UUID presence indexes from the database.")
+    rebuild_uuid_index.add_argument("--clients", nargs="+", help="Client names (default: all).")
+
+    for name, help_text in (("live", "Live sync of new documents, once."), ("daemon", "Long-running daily live sync.")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument("--clients", nargs="+", help="Client names (default: all).")
+        command.add_argument("--max-clients", type=int, default=DEFAULT_MAX_CONCURRENT_CLIENTS, help="Clients synced at once.")
+        if name == "daemon":
+            command.add_argument("--at", default="08:00", help="Daily run time, HH:MM 24-hour (default: 08:00).")
+            command.add_argument("--run-now", action="store_true", help="Also run once immediately on start.")
+    return parser
+
+COMMANDS = {'clients': cmd_clients, 'sync': cmd_sync, 'live': cmd_live, 'daemon': cmd_daemon, 'partition': cmd_partition, 'rebuild-ledger': cmd_rebuild_ledger,
+            'archive': cmd_archive, 'retries': cmd_retries, 'rebuild-uuid-index': cmd_rebuild_uuid_index}
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        emit("signal", signal=signal.Signals(signum).name, message="Stopping after the current work finishes.")
+        stop_event.set()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    get_log_sink().add_listener(emit_log_records)
+    try:
+        return COMMANDS[args.command](args, stop_event)
+    finally:
+        get_log_sink().flush()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+# field_mapping.py
+"""
+Declarative mapping from the ETA document-details JSON to the documents /
+document_lines columns. Each field names its column, one or more source paths
+(the first non-empty value wins) and a coercer. The field lists are compiled
+once into extractors that return row tuples in column order, ready for
+execute_values.
+
+Path roots: '$' is the details payload, 'doc' the signed document inside it,
+'line' the current invoice line. A path may also be a callable that receives
+the row context.
+"""
+import json
+from decimal import Decimal, InvalidOperation
+import json_codec
+
+MAX_TAXES = 5
+
+# --- Coercers: turn whatever the API sent into something the column accepts, or None ---
+def to_text(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+def varchar(length):
+    def coerce(value):
+        text = to_text(value)
+        return text[:length] if text is not None else None
+    return coerce
+
+def to_numeric(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return value
+    try:
+        return Decimal(str(value).replace(",", ""))
+    except InvalidOperation:
+        return None
+
+def to_int(value):
+    number = to_numeric(value)
+    try:
+        return int(number) if number is not None else None
+    except (ValueError, OverflowError):
+        return None
+
+def to_bool(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+def to_timestamp(value):
+    """ETA timestamps are ISO-8601 strings, which PostgreSQL parses directly."""
+    if not value or not isinstance(value, str):
+        return None
+    return value
+
+to_json = to_text
+VARCHAR = varchar(255)
+SHORT_VARCHAR = varchar(50)
+
+
+def core_document(payload):
+    """The details payload nests the signed document under 'document' (sometimes as a JSON string); summaries are flat."""
+    document = payload.get('document', payload)
+    if isinstance(document, str):
+        try:
+            document = json_codec.loads(document)
+        except ValueError:
+            document = {}
+    return document if isinstance(document, dict) else {}
+
+def invoice_lines(payload, core=None):
+    core = core_document(payload) if core is None else core
+    lines = core.get('invoiceLines') or payload.get('invoiceLines') or []
+    return lines if isinstance(lines, list) else []
+
+
+# --- Computed values ---
+def _tax(list_path, index, key):
+    """Value of `key` in the index-th tax entry (taxTotals / taxableItems), for the tax1..tax5 columns."""
+    root, list_key = list_path
+    def get(ctx):
+        taxes = ctx[root].get(list_key) if isinstance(ctx[root], dict) else None
+        if isinstance(taxes, list) and index < len(taxes) and isinstance(taxes[index], dict):
+            return taxes[index].get(key)
+        return None
+    return get
+
+def _line_foreign(key):
+    """Foreign-currency amount: the API's *Foreign value, else derived from the EGP amount and the exchange rate."""
+    def get(ctx):
+        line = ctx[LINE]
+        value = line.get(f"{key}Foreign")
+        if value is not None:
+            return value
+        unit_value = line.get('unitValue') or {}
+        rate = to_numeric(unit_value.get('currencyExchangeRate'))
+        amount = to_numeric(line.get(key))
+        if unit_value.get('currencySold') not in (None, "", "EGP") and rate and amount is not None:
+            return Decimal(str(amount)) / Decimal(str(rate))
+        return None
+    return get
+
+def _received(ctx):
+    payload = ctx[PAYLOAD]
+    return payload.get('dateTimeReceived') or payload.get('dateTimeRecevied')
+
+
+# --- Context slots ---
+PAYLOAD, CORE, LINE, LINE_INDEX = 0, 1, 2, 3
+ROOTS = {'$': PAYLOAD, 'doc': CORE, 'line': LINE}
+
+def _address_fields(party):
+    return tuple(
+        (f"{party}_address_{column}", tuple(f"doc.{party}.address.{key}" for key in keys), coercer)
+        for column, keys, coercer in (
+            ("branch_id", ("branchID", "branchId"), VARCHAR), ("country", ("country",), VARCHAR),
+            ("governate", ("governate",), VARCHAR), ("region_city", ("regionCity",), VARCHAR),
+            ("street", ("street",), to_text), ("building_number", ("buildingNumber",), VARCHAR),
+            ("floor", ("floor",), VARCHAR), ("room", ("room",), VARCHAR), ("landmark", ("landmark",), VARCHAR),
+            ("additional_information", ("additionalInformation",), to_text),
+        )
+    )
+
+def _tax_fields(list_path):
+    return tuple(
+        field
+        for i in range(MAX_TAXES)
+        for field in (
+            (f"tax{i + 1}_type", (_tax(list_path, i, 'taxType'),), SHORT_VARCHAR),
+            (f"tax{i + 1}_amount", (_tax(list_path, i, 'amount'),), to_numeric),
+        )
+    )
+
+# (column, source paths, coercer). 'uuid' must stay first: the writer keys rows on row[0].
+HEADER_FIELDS = (
+    ("uuid", ("$.uuid",), VARCHAR),
+    ("submission_uuid", ("$.submissionUUID", "$.submissionUuid"), VARCHAR),
+    ("long_id", ("$.longId",), VARCHAR),
+    ("internal_id", ("$.internalId", "$.internalID", "doc.internalID", "doc.internalId"), VARCHAR),
+    ("type_name", ("$.typeName", "doc.documentType"), VARCHAR),
+    ("document_type_name_primary_lang", ("$.documentTypeNamePrimaryLang",), VARCHAR),
+    ("document_type_name_secondary_lang", ("$.documentTypeNameSecondaryLang",), VARCHAR),
+    ("type_version_name", ("$.typeVersionName",), VARCHAR),
+    ("document_type_version", ("doc.documentTypeVersion", "$.documentTypeVersion"), VARCHAR),
+    ("document_type", ("doc.documentType", "$.typeName"), VARCHAR),
+    ("issuer_id", ("doc.issuer.id", "$.issuerId"), VARCHAR),
+    ("issuer_name", ("doc.issuer.name", "$.issuerName"), VARCHAR),
+    ("issuer_type", ("doc.issuer.type", "$.issuerType"), VARCHAR),
+    *_address_fields("issuer"),
+    ("receiver_id", ("doc.receiver.id", "$.receiverId"), VARCHAR),
+    ("receiver_name", ("doc.receiver.name", "$.receiverName"), VARCHAR),
+    ("receiver_type", ("doc.receiver.type", "$.receiverType"), VARCHAR),
+    *_address_fields("receiver"),
+    ("date_time_issued", ("doc.dateTimeIssued", "$.dateTimeIssued"), to_timestamp),
+    ("date_time_received", (_received,), to_timestamp),
+    ("service_delivery_date", ("doc.serviceDeliveryDate", "$.serviceDeliveryDate"), to_timestamp),
+    ("customs_clearance_date", ("doc.customsClearanceDate", "$.customsClearanceDate"), to_timestamp),
+    ("validation_status", ("$.validationResults.status",), VARCHAR),
+    ("transformation_status", ("$.transformationStatus",), VARCHAR),
+    ("status_id", ("$.statusId",), to_int),
+    ("status", ("$.status",), VARCHAR),
+    ("document_status_reason", ("$.documentStatusReason",), to_text),
+    ("cancel_request_date", ("$.cancelRequestDate",), to_timestamp),
+    ("reject_request_date", ("$.rejectRequestDate",), to_timestamp),
+    ("cancel_request_delayed_date", ("$.cancelRequestDelayedDate",), to_timestamp),
+    ("reject_request_delayed_date", ("$.rejectRequestDelayedDate",), to_timestamp),
+    ("decline_cancel_request_date", ("$.declineCancelRequestDate",), to_timestamp),
+    ("decline_reject_request_date", ("$.declineRejectRequestDate",), to_timestamp),
+    ("canbe_cancelled_until", ("$.canbeCancelledUntil",), to_timestamp),
+    ("canbe_rejected_until", ("$.canbeRejectedUntil",), to_timestamp),
+    ("submission_channel", ("$.submissionChannel",), to_int),
+    ("freeze_status_frozen", ("$.freezeStatus.frozen",), to_bool),
+    ("freeze_status_type", ("$.freezeStatus.type",), VARCHAR),
+    ("freeze_status_scope", ("$.freezeStatus.scope",), VARCHAR),
+    ("freeze_status_action_date", ("$.freezeStatus.actionDate",), to_timestamp),
+    ("freeze_status_au_code", ("$.freezeStatus.auCode",), VARCHAR),
+    ("freeze_status_au_name", ("$.freezeStatus.auName",), VARCHAR),
+    ("customs_declaration_number", ("$.customsDeclarationNumber", "doc.customsDeclarationNumber"), VARCHAR),
+    ("e_payment_number", ("$.ePaymentNumber", "doc.ePaymentNumber"), VARCHAR),
+    ("public_url", ("$.publicUrl",), to_text),
+    ("purchase_order_description", ("doc.purchaseOrderDescription",), to_text),
+    ("sales_order_description", ("doc.salesOrderDescription",), to_text),
+    ("sales_order_reference", ("doc.salesOrderReference",), VARCHAR),
+    ("proforma_invoice_number", ("doc.proformaInvoiceNumber",), VARCHAR),
+    ("purchase_order_reference", ("doc.purchaseOrderReference",), VARCHAR),
+    ("late_submission_request_number", ("$.lateSubmissionRequestNumber",), VARCHAR),
+    ("additional_metadata", ("$.additionalMetadata",), to_json),
+    ("alert_details", ("$.alertDetails",), to_json),
+    ("signatures", ("doc.signatures",), to_json),
+    ("doc_references", ("doc.references",), to_json),
+    ("total_items_discount_amount", ("doc.totalItemsDiscountAmount", "$.totalItemsDiscountAmount"), to_numeric),
+    ("total_amount", ("$.totalAmount", "$.total", "doc.totalAmount"), to_numeric),
+    ("net_amount", ("$.netAmount", "doc.netAmount"), to_numeric),
+    ("total_discount", ("$.totalDiscount", "doc.totalDiscountAmount"), to_numeric),
+    ("total_sales", ("$.totalSales", "doc.totalSalesAmount"), to_numeric),
+    ("extra_discount_amount", ("doc.extraDiscountAmount", "$.extraDiscountAmount"), to_numeric),
+    ("max_percision", ("$.maxPercision", "$.maxPrecision"), to_int),
+    ("document_lines_total_count", ("$.documentLinesTotalCount", lambda ctx: len(invoice_lines(ctx[PAYLOAD], ctx[CORE])) or None), to_int),
+    *_tax_fields((CORE, 'taxTotals')),
+)
+
+LINE_FIELDS = (
+    # Stable per-document line key (the API has no line id); the views expose it as line_item_uuid
+    ("custom_uuid", (lambda ctx: f"{ctx[PAYLOAD].get('uuid')}-{ctx[LINE_INDEX] + 1}",), VARCHAR),
+    ("document_uuid", ("$.uuid",), VARCHAR),
+    ("item_primary_name", ("line.itemPrimaryName",), to_text),
+    ("item_primary_description", ("line.itemPrimaryDescription",), to_text),
+    ("item_secondary_name", ("line.itemSecondaryName",), to_text),
+    ("item_secondary_description", ("line.itemSecondaryDescription",), to_text),
+    ("item_type", ("line.itemType",), VARCHAR),
+    ("item_code", ("line.itemCode",), VARCHAR),
+    ("internal_code", ("line.internalCode",), VARCHAR),
+    ("description", ("line.description",), to_text),
+    ("unit_type", ("line.unitType",), VARCHAR),
+    ("unit_type_primary_name", ("line.unitTypePrimaryName",), to_text),
+    ("unit_type_primary_description", ("line.unitTypePrimaryDescription",), to_text),
+    ("unit_type_secondary_name", ("line.unitTypeSecondaryName",), to_text),
+    ("unit_type_secondary_description", ("line.unitTypeSecondaryDescription",), to_text),
+    ("quantity", ("line.quantity",), to_numeric),
+    ("weight_unit_type", ("line.weightUnitType",), VARCHAR),
+    ("weight_unit_type_primary_name", ("line.weightUnitTypePrimaryName",), to_text),
+    ("weight_unit_type_primary_description", ("line.weightUnitTypePrimaryDescription",), to_text),
+    ("weight_unit_type_secondary_name", ("line.weightUnitTypeSecondaryName",), to_text),
+    ("weight_unit_type_secondary_description", ("line.weightUnitTypeSecondaryDescription",), to_text),
+    ("weight_quantity", ("line.weightQuantity",), to_numeric),
+    ("unit_value_currency_sold", ("line.unitValue.currencySold",), SHORT_VARCHAR),
+    ("unit_value_amount_sold", ("line.unitValue.amountSold",), to_numeric),
+    ("unit_value_amount_egp", ("line.unitValue.amountEGP",), to_numeric),
+    ("unit_value_currency_exchange_rate", ("line.unitValue.currencyExchangeRate",), to_numeric),
+    ("factory_unit_value_currency_sold", ("line.factoryUnitValue.currencySold",), SHORT_VARCHAR),
+    ("factory_unit_value_amount_sold", ("line.factoryUnitValue.amountSold",), to_numeric),
+    ("factory_unit_value_amount_egp", ("line.factoryUnitValue.amountEGP",), to_numeric),
+    ("factory_unit_value_currency_exchange_rate", ("line.factoryUnitValue.currencyExchangeRate",), to_numeric),
+    ("sales_total", ("line.salesTotal",), to_numeric),
+    ("sales_total_foreign", (_line_foreign('salesTotal'),), to_numeric),
+    ("net_total", ("line.netTotal",), to_numeric),
+    ("net_total_foreign", (_line_foreign('netTotal'),), to_numeric),
+    ("total", ("line.total",), to_numeric),
+    ("total_foreign", (_line_foreign('total'),), to_numeric),
+    ("items_discount", ("line.itemsDiscount",), to_numeric),
+    ("items_discount_foreign", (_line_foreign('itemsDiscount'),), to_numeric),
+    ("total_taxable_fees", ("line.totalTaxableFees",), to_numeric),
+    ("total_taxable_fees_foreign", (_line_foreign('totalTaxableFees'),), to_numeric),
+    ("value_difference", ("line.valueDifference",), to_numeric),
+    ("value_difference_foreign", (_line_foreign('valueDifference'),), to_numeric),
+    ("discount_amount", ("line.discount.amount",), to_numeric),
+    ("discount_rate", ("line.discount.rate",), to_numeric),
+    ("discount_amount_foreign", ("line.discount.amountForeign",), to_numeric),
+    *_tax_fields((LINE, 'taxableItems')),
+    ("document_date_time_received", (_received,), to_timestamp),
+)
+
+
+# --- Compilation ---
+def _compile_path(path):
+    if callable(path):
+        return path
+    root, *keys = path.split(".")
+    slot = ROOTS[root]
+    keys = tuple(keys)
+    def get(ctx):
+        value = ctx[slot]
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+def _compile_field(paths, coercer):
+    getters = tuple(_compile_path(path) for path in paths)
+    if len(getters) == 1:
+        getter = getters[0]
+        return lambda ctx: coercer(getter(ctx))
+    def extract(ctx):
+        for getter in getters:
+            value = getter(ctx)
+            if value is not None and value != "":
+                return coercer(value)
+        return None
+    return extract
+
+def compile_extractor(fields):
+    """Compiles a field list into (columns, extractor), where extractor(ctx) returns the row tuple."""
+    columns = tuple(column for column, _, _ in fields)
+    extractors = tuple(_compile_field(paths, coercer) for _, paths, coercer in fields)
+    def extract(ctx):
+        return tuple([extractor(ctx) for extractor in extractors])
+    return columns, extract
+
+HEADER_COLUMNS, _extract_header = compile_extractor(HEADER_FIELDS)
+LINE_COLUMNS, _extract_line = compile_extractor(LINE_FIELDS)
+
+def header_row(payload):
+    return _extract_header((payload, core_document(payload), None, None))
+
+def line_rows(payload):
+    core = core_document(payload)
+    return [
+        _extract_line((payload, core, line, index))
+        for index, line in enumerate(invoice_lines(payload, core))
+        if isinstance(line, dict)
+    ]
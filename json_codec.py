@@ -0,0 +1,78 @@
+# json_codec.py
+"""
+JSON decoding/encoding for API payloads, using the fastest library available
+(orjson, then msgspec, then the standard library), plus the compression used
+for the raw-payload archive (zstd when `zstandard` is installed, else gzip).
+Blobs are self-describing, so archives written with either codec stay readable.
+"""
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# --- JSON backend ---
+if orjson is not None:
+    BACKEND = "orjson"
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+    _decode_errors = (orjson.JSONDecodeError,)
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _decoder = msgspec.json.Decoder()
+    _encoder = msgspec.json.Encoder()
+    _loads = _decoder.decode
+    _dumps = _encoder.encode
+    _decode_errors = (msgspec.DecodeError,)
+else:
+    BACKEND = "json"
+    _loads = json.loads
+    _dumps = lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _decode_errors = (ValueError,)
+
+def loads(data):
+    """Decodes JSON from bytes or str. Raises ValueError on malformed input, whatever the backend."""
+    try:
+        return _loads(data)
+    except _decode_errors as e:
+        raise ValueError(f"Invalid JSON: {e}") from e
+
+def dumps(obj):
+    """Encodes to compact UTF-8 JSON bytes."""
+    return _dumps(obj)
+
+
+# --- Raw-payload archive compression ---
+COMPRESSION = "zstd" if zstandard is not None else "gzip"
+
+def compress_payload(payload):
+    data = dumps(payload)
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+def decompress_payload(blob):
+    """Inverse of compress_payload; detects the codec from the blob's magic bytes."""
+    blob = bytes(blob)
+    if blob.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("Payload is zstd-compressed but the 'zstandard' package is not installed.")
+        return loads(zstandard.ZstdDecompressor().decompress(blob))
+    if blob.startswith(GZIP_MAGIC):
+        return loads(gzip.decompress(blob))
+    return loads(blob)
@@ -1,39 +1,94 @@
 # live_sync_manager.py
-from threading import Thread
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
 from single_client_sync_worker import SingleClientSyncWorker # Import the new worker
+from db_manager import DatabaseManager
+from log_sink import get_log_sink, INFO, ERROR
+import config_manager
+
+DEFAULT_MAX_CONCURRENT_CLIENTS = 8
 
 class LiveSyncManager(Thread):
-    def __init__(self, all_clients_data, progress_queue):
+    def __init__(self, all_clients_data, progress_queue, max_concurrent_clients=DEFAULT_MAX_CONCURRENT_CLIENTS):
         super().__init__()
         self.selected_clients = all_clients_data
         self.progress_queue = progress_queue
+        self.log_sink = get_log_sink()
+        self.max_concurrent_clients = max(1, int(max_concurrent_clients))
         self.worker_threads = []
+        self._workers_lock = Lock()
         self._is_running = True
 
+    def _log(self, message, level=INFO):
+        self.log_sink.log(message, level)
+
     def stop(self):
-        """Tells all running child worker threads to stop."""
+        """Tells all running client workers to stop; queued clients will not start."""
         self._is_running = False
-        self.progress_queue.put(("LOG", "--- Cancellation signal sent to all live sync threads ---"))
-        for worker in self.worker_threads:
-            worker.stop()
+        self._log("--- Cancellation signal sent to all live sync threads ---")
+        with self._workers_lock:
+            for worker in self.worker_threads:
+                worker.stop()
 
-    def run(self):
-        self.progress_queue.put(("LOG", "--- Live Sync Manager Started: Spawning parallel workers ---"))
-
-        # Create and start a worker thread for each selected client
-        for client_name, client_config in self.selected_clients.items():
-            if not self._is_running: break
-            
-            worker = SingleClientSyncWorker(client_name, client_config, self.progress_queue)
-            worker.daemon = True # Ensure they die if the main app closes
+    @staticmethod
+    def _last_sync_timestamp(client_config):
+        """Reads the client's SyncStatus timestamp; None means never synced (or unreachable)."""
+        db_params = config_manager.client_db_params(client_config)
+        db_manager = DatabaseManager(db_params)
+        if not db_manager.connect():
+            return None
+        try:
+            last_sync_info = db_manager.get_all_sync_statuses().get(client_config.get('client_id'))
+            return last_sync_info[0] if last_sync_info else None
+        finally:
+            db_manager.disconnect()
+
+    def _order_by_staleness(self, pool):
+        """Returns client names ordered most-stale first (never-synced clients lead)."""
+        names = list(self.selected_clients)
+        timestamps = dict(zip(names, pool.map(lambda name: self._last_sync_timestamp(self.selected_clients[name]), names)))
+        return sorted(names, key=lambda name: timestamps[name] or datetime.datetime.min)
+
+    def _sync_client(self, client_name):
+        """Runs one client's worker to completion on a pool thread."""
+        if not self._is_running:
+            self.progress_queue.put(("LIVE_UPDATE", (client_name, "Cancelled")))
+            return
+        self.progress_queue.put(("LIVE_UPDATE", (client_name, "Syncing...")))
+        worker = SingleClientSyncWorker(client_name, self.selected_clients[client_name], self.progress_queue)
+        with self._workers_lock:
             self.worker_threads.append(worker)
-            worker.start()
+        try:
+            worker.run() # Runs on this pool thread; the pool bounds how many clients sync at once
+        finally:
+            with self._workers_lock:
+                self.worker_threads.remove(worker)
+
+    def run(self):
+        total_clients = len(self.selected_clients)
+        self._log(f"--- Live Sync Manager Started: {total_clients} clients, up to {self.max_concurrent_clients} at a time ---")
+        self.progress_queue.put(("PROGRESS", 0))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_clients, thread_name_prefix="live-sync") as pool:
+            # --- Work queue: the clients that have waited longest go first ---
+            ordered_clients = self._order_by_staleness(pool)
+            for client_name in ordered_clients:
+                self.progress_queue.put(("LIVE_UPDATE", (client_name, "Queued")))
 
-        # Wait for all worker threads to complete their execution
-        for worker in self.worker_threads:
-            worker.join()
+            futures = {pool.submit(self._sync_client, name): name for name in ordered_clients}
+            finished = 0
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    client_name = futures[future]
+                    self._log(f"CRITICAL ERROR in live sync for {client_name}: {e}", ERROR)
+                    self.progress_queue.put(("LIVE_UPDATE", (client_name, "Failed")))
+                finished += 1
+                self.progress_queue.put(("PROGRESS", finished / total_clients if total_clients else 1))
 
         # Only send completion message if it wasn't cancelled
         if self._is_running:
-            self.progress_queue.put(("LOG", "--- All parallel sync threads have finished. ---"))
-            self.progress_queue.put(("LIVE_SYNC_COMPLETE", None))
\ No newline at end of file
+            self._log("--- All parallel sync threads have finished. ---")
+            self.progress_queue.put(("LIVE_SYNC_COMPLETE", None))
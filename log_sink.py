@@ -0,0 +1,229 @@
+# log_sink.py
+import os
+import queue
+import threading
+import datetime
+
+DEFAULT_LOG_DIR = "logs"
+DEFAULT_BUFFER_SIZE = 10000          # Records held in memory before producers have to wait
+DEFAULT_FLUSH_INTERVAL = 0.5         # Seconds between writes to disk / listeners
+DEFAULT_MAX_FILE_BYTES = 10 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = datetime.timedelta(days=1)
+ENQUEUE_TIMEOUT = 2                  # A producer never waits longer than this; the record is counted as dropped
+
+INFO, WARNING, ERROR = "INFO", "WARNING", "ERROR"
+
+def safe_file_part(name):
+    return str(name).replace(" ", "_").replace("/", "-").replace("\\", "-")
+
+def format_record(record, date_format='%Y-%m-%d %H:%M:%S'):
+    ts, level, client, message = record
+    client_part = f"[{client}] " if client else ""
+    level_part = f"{level}: " if level != INFO else ""
+    return f"{ts.strftime(date_format)} - {client_part}{level_part}{message}"
+
+
+class RotatingLogFile:
+    """A log file named <prefix>_<timestamp>.txt that rolls over to a new file by size or age."""
+    def __init__(self, log_dir, prefix, max_bytes=DEFAULT_MAX_FILE_BYTES, rotate_interval=DEFAULT_ROTATE_INTERVAL):
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.path = None
+        self._file = None
+        self._opened_at = None
+
+    def _open(self):
+        self.close()
+        now = datetime.datetime.now()
+        self.path = os.path.join(self.log_dir, f"{self.prefix}_{now.strftime('%Y-%m-%d_%H%M%S')}.txt")
+        suffix = 1
+        while os.path.exists(self.path): # Two rotations within the same second
+            self.path = os.path.join(self.log_dir, f"{self.prefix}_{now.strftime('%Y-%m-%d_%H%M%S')}_{suffix}.txt")
+            suffix += 1
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._opened_at = now
+
+    def write(self, text):
+        if self._file is None or self._file.tell() >= self.max_bytes or datetime.datetime.now() - self._opened_at >= self.rotate_interval:
+            self._open()
+        self._file.write(text)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _SessionChange:
+    """Queued with the records so a session starts/ends exactly between the records logged before and after it."""
+    def __init__(self, name=None, client_prefix=None):
+        self.name = name
+        self.client_prefix = client_prefix
+
+
+class LogSink:
+    """
+    Process-wide log sink. Producers (UI, workers, CLI) call `log()`, which only
+    enqueues a (timestamp, level, client, message) record. A background thread
+    drains the bounded buffer every `flush_interval` seconds, appends the batch
+    to the session's rotating log file (plus one file per client when the
+    session asks for it) and hands the same batch to every listener.
+
+    Session changes and flush requests travel through the same buffer as the
+    records, so they take effect in logging order and only the writer thread
+    touches the files.
+    """
+    def __init__(self, log_dir=DEFAULT_LOG_DIR, buffer_size=DEFAULT_BUFFER_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_file_bytes=DEFAULT_MAX_FILE_BYTES, rotate_interval=DEFAULT_ROTATE_INTERVAL):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.rotate_interval = rotate_interval
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._listeners = []
+        self._session_file = None
+        self._client_files = {}
+        self._client_prefix = None
+        self._dropped = 0
+        self._flush_requested = threading.Event()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+
+    # --- Producer side ---
+    def log(self, message, level=INFO, client=None):
+        record = (datetime.datetime.now(), level, client, str(message))
+        try:
+            self._buffer.put(record, timeout=ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self._dropped += 1
+
+    def add_listener(self, callback):
+        """`callback(records)` is called from the writer thread with each flushed batch."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def start_session(self, name, client_prefix=None):
+        """
+        Starts writing to logs/<name>_<timestamp>.txt. With `client_prefix`, records
+        tagged with a client are also written to logs/<client_prefix>_<client>_<timestamp>.txt.
+        Records logged before this call still go to the previous session. Does not block.
+        """
+        self._buffer.put(_SessionChange(safe_file_part(name), safe_file_part(client_prefix) if client_prefix else None))
+
+    def end_session(self, wait=True):
+        """
+        Closes the session files once everything logged before this call is written.
+        With wait=False (UI thread) it returns immediately and the writer closes them.
+        """
+        self._buffer.put(_SessionChange())
+        if wait:
+            self.flush()
+
+    def flush(self, timeout=5):
+        """Blocks until everything logged before this call has been written. Returns False on timeout."""
+        marker = threading.Event()
+        try:
+            self._buffer.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        self._flush_requested.set()
+        return marker.wait(timeout)
+
+    # --- Writer thread ---
+    def _run(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            records = []
+            for item in self._drain():
+                if isinstance(item, tuple):
+                    records.append(item)
+                    continue
+                # Control item: everything queued before it is written first
+                self._write_safely(records)
+                records = []
+                if isinstance(item, _SessionChange):
+                    self._change_session(item)
+                else:
+                    item.set() # Flush marker
+            self._write_safely(records)
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        if self._dropped:
+            dropped, self._dropped = self._dropped, 0
+            items.append((datetime.datetime.now(), WARNING, None, f"Log buffer full: {dropped} messages were dropped."))
+        return items
+
+    def _write_safely(self, records):
+        try:
+            self._write_batch(records)
+        except Exception as e:
+            print(f"!!! LOG SINK FAILED TO WRITE: {e}")
+
+    def _change_session(self, change):
+        self._close_session_files()
+        if change.name:
+            self._session_file = RotatingLogFile(self.log_dir, change.name, self.max_file_bytes, self.rotate_interval)
+            self._client_prefix = change.client_prefix
+
+    def _write_batch(self, records):
+        if not records:
+            return
+        if self._session_file is not None:
+            self._session_file.write("".join(format_record(r) + "\n" for r in records))
+            self._session_file.flush()
+            if self._client_prefix:
+                by_client = {}
+                for record in records:
+                    if record[2]:
+                        by_client.setdefault(record[2], []).append(record)
+                for client, client_records in by_client.items():
+                    client_file = self._client_files.get(client)
+                    if client_file is None:
+                        client_file = RotatingLogFile(self.log_dir, f"{self._client_prefix}_{safe_file_part(client)}",
+                                                      self.max_file_bytes, self.rotate_interval)
+                        self._client_files[client] = client_file
+                    client_file.write("".join(format_record(r) + "\n" for r in client_records))
+                    client_file.flush()
+        for listener in list(self._listeners):
+            try:
+                listener(records)
+            except Exception as e:
+                print(f"!!! LOG LISTENER FAILED: {e}")
+
+    def _close_session_files(self):
+        if self._session_file is not None:
+            self._session_file.close()
+        for client_file in self._client_files.values():
+            client_file.close()
+        self._session_file = None
+        self._client_files = {}
+        self._client_prefix = None
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+def get_log_sink():
+    """Returns the process-wide LogSink, starting its writer thread on first use."""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = LogSink()
+        return _sink
@@ -0,0 +1,86 @@
+# log_view.py
+import collections
+import customtkinter as ctk
+from log_sink import format_record, INFO, WARNING, ERROR
+
+DEFAULT_MAX_RECORDS = 5000     # Older lines are trimmed from the view; the full history lives in logs/
+ALL_LEVELS = "All levels"
+ALL_CLIENTS = "All clients"
+LEVEL_FILTERS = {ALL_LEVELS: (INFO, WARNING, ERROR), "Warnings & errors": (WARNING, ERROR), "Errors only": (ERROR,)}
+
+class LogView(ctk.CTkFrame):
+    """
+    On-screen tail of the log sink. Keeps at most `max_records` records in a
+    ring buffer and the textbox never holds more lines than that, so inserts
+    stay cheap during all-day runs. Records can be filtered by level and client,
+    and autoscroll can be paused while reading back.
+    """
+    def __init__(self, master, max_records=DEFAULT_MAX_RECORDS, **kwargs):
+        super().__init__(master, **kwargs)
+        self.max_records = max_records
+        self.records = collections.deque(maxlen=max_records)
+        self.clients = []
+
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        toolbar = ctk.CTkFrame(self, fg_color="transparent")
+        toolbar.grid(row=0, column=0, sticky="ew", padx=5, pady=(5, 0))
+        self.level_filter = ctk.StringVar(value=ALL_LEVELS)
+        self.client_filter = ctk.StringVar(value=ALL_CLIENTS)
+        self.pause_autoscroll = ctk.BooleanVar(value=False)
+        ctk.CTkOptionMenu(toolbar, variable=self.level_filter, values=list(LEVEL_FILTERS), width=150,
+                          command=lambda _: self.refresh()).pack(side="left", padx=(0, 5))
+        self.client_menu = ctk.CTkOptionMenu(toolbar, variable=self.client_filter, values=[ALL_CLIENTS], width=180,
+                                             command=lambda _: self.refresh())
+        self.client_menu.pack(side="left", padx=5)
+        ctk.CTkCheckBox(toolbar, text="Pause autoscroll", variable=self.pause_autoscroll).pack(side="left", padx=5)
+        ctk.CTkButton(toolbar, text="Clear", width=70, command=self.clear).pack(side="right")
+
+        self.textbox = ctk.CTkTextbox(self, state="disabled", wrap="word")
+        self.textbox.grid(row=1, column=0, sticky="nsew", padx=5, pady=5)
+
+    def _matches(self, record):
+        _, level, client, _ = record
+        if level not in LEVEL_FILTERS[self.level_filter.get()]:
+            return False
+        selected_client = self.client_filter.get()
+        return selected_client == ALL_CLIENTS or client == selected_client
+
+    def _track_clients(self, records):
+        new_clients = {record[2] for record in records if record[2] and record[2] not in self.clients}
+        if new_clients:
+            self.clients = sorted(set(self.clients) | new_clients)
+            self.client_menu.configure(values=[ALL_CLIENTS] + self.clients)
+
+    def append(self, records):
+        """Adds a batch of (timestamp, level, client, message) records with a single insert."""
+        self.records.extend(records)
+        self._track_clients(records)
+        visible = [record for record in records if self._matches(record)]
+        if visible:
+            self._render(visible)
+
+    def refresh(self):
+        """Redraws the textbox from the ring buffer, e.g. after a filter changed."""
+        self.textbox.configure(state="normal")
+        self.textbox.delete("1.0", "end")
+        self.textbox.configure(state="disabled")
+        self._render([record for record in self.records if self._matches(record)], force_scroll=True)
+
+    def clear(self):
+        self.records.clear()
+        self.refresh()
+
+    def _render(self, records, force_scroll=False):
+        should_autoscroll = not self.pause_autoscroll.get() and (force_scroll or self.textbox.yview()[1] == 1.0)
+        self.textbox.configure(state="normal")
+        self.textbox.insert("end", "".join(format_record(record, '%H:%M:%S') + "\n" for record in records[-self.max_records:]))
+        # --- Trim the oldest lines so the widget never outgrows the ring buffer ---
+        line_count = int(self.textbox.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_records:
+            self.textbox.delete("1.0", f"{line_count - self.max_records + 1}.0")
+        self.textbox.configure(state="disabled")
+
+        if should_autoscroll:
+            self.textbox.see("end")
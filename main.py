@@ -16,6 +16,13 @@ from api_client import ETAApiClient
 from db_manager import DatabaseManager
 from sync_worker import SyncWorker
 from live_sync_manager import LiveSyncManager # NEW IMPORT
+from log_sink import get_log_sink
+from log_view import LogView
+
+UI_QUEUE_BATCH_LIMIT = 500        # Max messages handled per tick
+UI_QUEUE_TIME_BUDGET = 0.05       # Seconds per tick before yielding back to Tk
+UI_QUEUE_IDLE_INTERVAL_MS = 100
+UI_QUEUE_BUSY_INTERVAL_MS = 10
 
 class App(ctk.CTk):
     def __init__(self):
@@ -40,8 +47,10 @@ class App(ctk.CTk):
         self.is_automation_running = False
         self.stop_automation_event = threading.Event()
         self.discovered_oldest_date = None
-        self.current_logfile = None
         os.makedirs("logs", exist_ok=True) # Creates the 'logs' directory if it doesn't exist
+        # Workers log straight to the sink; its writer thread hands each flushed batch to the UI as one message
+        self.log_sink = get_log_sink()
+        self.log_sink.add_listener(lambda records: self.ui_queue.put(("LOG_RECORDS", records)))
         self.create_client_management_frame()
         self.create_eta_setup_frame()
         self.create_db_setup_frame()
@@ -205,15 +214,13 @@ class App(ctk.CTk):
         self.log_frame.grid(row=3, column=0, sticky="nsew", padx=10, pady=(0, 10))
         self.log_frame.grid_rowconfigure(0, weight=1)
         self.log_frame.grid_columnconfigure(0, weight=1)
-        self.log_textbox = ctk.CTkTextbox(self.log_frame, state="disabled", wrap="word")
-        self.log_textbox.grid(row=0, column=0, sticky="nsew", padx=5, pady=5)
+        self.log_view = LogView(self.log_frame, fg_color="transparent")
+        self.log_view.grid(row=0, column=0, sticky="nsew")
         self.progressbar = ctk.CTkProgressBar(self, orientation="horizontal")
         self.progressbar.grid(row=4, column=0, sticky="ew", padx=10, pady=(0, 10))
         self.progressbar.set(0)
         # --- NEW: Create and set the log file for this session ---
-        client_name_safe = self.selected_client_name.get().replace(" ", "_").replace("/", "-")
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
-        self.current_logfile = f"logs/Historical_{client_name_safe}_{timestamp}.txt"
+        self.log_sink.start_session(f"Historical_{self.selected_client_name.get()}")
 
     # --- NEW: Worker Threads with improved logic ---
     def run_eta_auth_test(self):
@@ -281,6 +288,8 @@ class App(ctk.CTk):
     
     def _db_test_worker(self, db_params):
         """Worker that uses the provided db_params to test the connection."""
+        if self.db_manager:
+            self.db_manager.disconnect() # Hand the previous connection back to its pool
         self.db_manager = DatabaseManager(db_params)
         
         if not self.db_manager.connect():
@@ -293,6 +302,16 @@ class App(ctk.CTk):
             self.ui_queue.put(("DB_SCHEMA_DONE", (False, tables_message)))
             return
 
+        self.ui_queue.put(("DB_STATUS_UPDATE", "Tables OK. Verifying indexes (first run on a large database can take a while)..."))
+        _, index_messages = self.db_manager.ensure_indexes()
+        for message in index_messages:
+            self.log_message(f"DB index: {message}")
+        index_report = self.db_manager.get_index_report()
+        if index_report['missing'] or index_report['invalid']:
+            self.log_message(f"DB index: missing {index_report['missing'] or 'none'}, invalid {index_report['invalid'] or 'none'}.")
+        for index_name, table_name, size in index_report['unused']:
+            self.log_message(f"DB index: {index_name} on {table_name} ({size}) has not been used since statistics were reset.")
+
         self.ui_queue.put(("DB_STATUS_UPDATE", "Tables OK. Verifying read-only user..."))
         user_ok, user_message = self.db_manager.check_and_create_readonly_user()
         
@@ -300,183 +319,198 @@ class App(ctk.CTk):
 
     # --- NEW: UI Update Logic with more states ---
     def process_queue(self):
+        """
+        Drains the UI queue in batches, bounded by UI_QUEUE_BATCH_LIMIT messages and
+        UI_QUEUE_TIME_BUDGET seconds per tick. Log records are inserted in one go, and
+        only the latest PROGRESS value and LIVE_UPDATE per client are applied.
+        """
+        deadline = time.monotonic() + UI_QUEUE_TIME_BUDGET
+        pending_logs, pending_progress, pending_live_updates = [], None, {}
         try:
-            message_type, data = self.ui_queue.get_nowait()
-
-            if message_type == "ETA_AUTH_DONE":
-                success, message = data
-                self.eta_test_button.configure(state="normal", text="Test Authentication")
-                if success:
-                    self.eta_status_label.configure(text="Success! Authentication valid. Ready to analyze dates.", text_color="green")
-                    self.eta_analyze_button.configure(state="normal") # Enable next step
+            for _ in range(UI_QUEUE_BATCH_LIMIT):
+                try:
+                    message_type, data = self.ui_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if message_type == "LOG_RECORDS":
+                    pending_logs.extend(data)
+                elif message_type == "LOG":
+                    self.log_message(data)
+                elif message_type == "PROGRESS":
+                    pending_progress = data
+                elif message_type == "LIVE_UPDATE":
+                    client_name, status_text = data
+                    pending_live_updates[client_name] = status_text
                 else:
-                    self.eta_status_label.configure(text=f"Error: {message}", text_color="red")
-
-            elif message_type == "SKIP_ANALYSIS":
-                client_data = data
-                self.eta_test_button.configure(state="normal")
-                self.eta_status_label.configure(text="Success! Using saved date range.", text_color="green")
-                
-                # Use the saved dates to populate the calendars
-                oldest_str = client_data.get('oldest_invoice_date')
-                # --- CRASH FIX: The data is already a list, no need for json.loads() ---
-                date_span_list = client_data.get('date_span')
-                if date_span_list and len(date_span_list) > 1:
-                    newest_str = date_span_list[1]
-                    self.start_date_entry.set_date(datetime.datetime.strptime(oldest_str, '%Y-%m-%d').date())
-                    self.end_date_entry.set_date(datetime.datetime.strptime(newest_str, '%Y-%m-%d').date())
-                
-                self.show_frame(self.db_frame)
+                    # Anything else may depend on what came before it (e.g. a completion dialog), so flush first
+                    self._apply_coalesced(pending_logs, pending_progress, pending_live_updates)
+                    pending_logs, pending_progress, pending_live_updates = [], None, {}
+                    self._dispatch_message(message_type, data)
+
+                if time.monotonic() >= deadline:
+                    break
+            self._apply_coalesced(pending_logs, pending_progress, pending_live_updates)
+        finally:
+            # Come back sooner while there is a backlog
+            self.after(UI_QUEUE_BUSY_INTERVAL_MS if not self.ui_queue.empty() else UI_QUEUE_IDLE_INTERVAL_MS, self.process_queue)
+
+    def _apply_coalesced(self, logs, progress, live_updates):
+        if logs:
+            self.log_messages(logs)
+            if any(record[3] in ("Sync Finished!", "Sync cancelled by user.") for record in logs):
+                self.sync_button.configure(state="normal"); self.cancel_button.configure(state="disabled")
+        if progress is not None:
+            self.progressbar.set(float(progress))
+        for client_name, status_text in live_updates.items():
+            if client_name in self.live_sync_client_labels:
+                self.live_sync_client_labels[client_name]['status'].configure(text=status_text)
+
+    def _dispatch_message(self, message_type, data):
+        """Applies a single non-coalesced UI queue message."""
+        if message_type == "ETA_AUTH_DONE":
+            success, message = data
+            self.eta_test_button.configure(state="normal", text="Test Authentication")
+            if success:
+                self.eta_status_label.configure(text="Success! Authentication valid. Ready to analyze dates.", text_color="green")
+                self.eta_analyze_button.configure(state="normal") # Enable next step
+            else:
+                self.eta_status_label.configure(text=f"Error: {message}", text_color="red")
 
-            elif message_type == "ETA_STATUS_UPDATE":
-                self.eta_status_label.configure(text=f"Status: {data}", text_color="orange")
+        elif message_type == "SKIP_ANALYSIS":
+            client_data = data
+            self.eta_test_button.configure(state="normal")
+            self.eta_status_label.configure(text="Success! Using saved date range.", text_color="green")
             
-            elif message_type == "ETA_ANALYZE_DONE":
-                oldest, newest = data
-                self.eta_analyze_button.configure(state="normal")
-                if oldest and newest:
-                    date_span = (oldest.strftime('%Y-%m-%d'), newest.strftime('%Y-%m-%d'))
-                    self.eta_status_label.configure(text=f"Analysis Complete! Found invoices from {date_span[0]} to {date_span[1]}", text_color="green")
-                    self.start_date_entry.set_date(oldest.date())
-                    self.end_date_entry.set_date(newest.date())
-                    self.show_frame(self.db_frame)
-                else:
-                    self.eta_status_label.configure(text="Error: Could not find any invoices for this client.", text_color="red")
+            # Use the saved dates to populate the calendars
+            oldest_str = client_data.get('oldest_invoice_date')
+            # --- CRASH FIX: The data is already a list, no need for json.loads() ---
+            date_span_list = client_data.get('date_span')
+            if date_span_list and len(date_span_list) > 1:
+                newest_str = date_span_list[1]
+                self.start_date_entry.set_date(datetime.datetime.strptime(oldest_str, '%Y-%m-%d').date())
+                self.end_date_entry.set_date(datetime.datetime.strptime(newest_str, '%Y-%m-%d').date())
             
-            elif message_type == "DB_CONNECT_FAIL":
-                self.db_status_label.configure(text=f"Error: {data}", text_color="red")
-                self.db_test_button.configure(state="normal", text="Test & Save Connection")
-            
-            elif message_type == "DB_STATUS_UPDATE":
-                self.db_status_label.configure(text=f"Status: {data}", text_color="orange")
+            self.show_frame(self.db_frame)
+
+        elif message_type == "ETA_STATUS_UPDATE":
+            self.eta_status_label.configure(text=f"Status: {data}", text_color="orange")
+        
+        elif message_type == "ETA_ANALYZE_DONE":
+            oldest, newest = data
+            self.eta_analyze_button.configure(state="normal")
+            if oldest and newest:
+                date_span = (oldest.strftime('%Y-%m-%d'), newest.strftime('%Y-%m-%d'))
+                self.eta_status_label.configure(text=f"Analysis Complete! Found invoices from {date_span[0]} to {date_span[1]}", text_color="green")
+                self.start_date_entry.set_date(oldest.date())
+                self.end_date_entry.set_date(newest.date())
+                self.show_frame(self.db_frame)
+            else:
+                self.eta_status_label.configure(text="Error: Could not find any invoices for this client.", text_color="red")
+        
+        elif message_type == "DB_CONNECT_FAIL":
+            self.db_status_label.configure(text=f"Error: {data}", text_color="red")
+            self.db_test_button.configure(state="normal", text="Test & Save Connection")
+        
+        elif message_type == "DB_STATUS_UPDATE":
+            self.db_status_label.configure(text=f"Status: {data}", text_color="orange")
 
-            elif message_type == "DB_CREATE_DONE":
-                success, message = data
-                self.db_create_button.configure(state="normal", text="Create Database")
-                self.db_test_button.configure(state="normal")
-                
-                if success:
-                    self.db_status_label.configure(text=f"Success: {message} Ready to test connection.", text_color="green")
-                    # For good UX, let's automatically test the connection now
-                    self.db_test_button.invoke() 
-                else:
-                    self.db_status_label.configure(text=f"Info: {message}", text_color="orange") # Use orange for "already exists"
+        elif message_type == "DB_CREATE_DONE":
+            success, message = data
+            self.db_create_button.configure(state="normal", text="Create Database")
+            self.db_test_button.configure(state="normal")
+            
+            if success:
+                self.db_status_label.configure(text=f"Success: {message} Ready to test connection.", text_color="green")
+                # For good UX, let's automatically test the connection now
+                self.db_test_button.invoke() 
+            else:
+                self.db_status_label.configure(text=f"Info: {message}", text_color="orange") # Use orange for "already exists"
 
-            elif message_type == "DB_SCHEMA_DONE":
-                tables_ok, user_message = data
-                self.db_test_button.configure(state="normal", text="Test & Save Connection")
-                
-                if tables_ok:
-                    # Display the result of the user creation step
-                    self.db_status_label.configure(text=f"Success! {user_message}", text_color="green")
-                success = data
-                self.db_test_button.configure(state="normal", text="Test & Save Connection")
-                if success:
-                    self.db_status_label.configure(text="Success! Database is ready. Saving configuration...", text_color="green")
-                    # Save all credentials
-                     # 1. Prioritize the name from the text entry box.
-                    client_name = self.client_name_entry.get()
-                    # 2. If it's empty, fall back to the dropdown's selected value.
-                    if not client_name: client_name = f"Client-{self.client_id_entry.get()[:6]}"
-
-                    date_span = (self.start_date_entry.get_date().strftime('%Y-%m-%d'), self.end_date_entry.get_date().strftime('%Y-%m-%d'))
-                    config_manager.save_client_config(client_name, self.client_id_entry.get(), self.client_secret_entry.get(),
-                                                      self.db_host_entry.get(), int(self.db_port_entry.get() or 5432), self.db_name_entry.get(), self.db_user_entry.get(),
-                                                      self.db_pass_entry.get(), date_span, self.discovered_oldest_date)
-                     # First, save the last selected client name to the config
-                    config_manager.save_last_selected_client(client_name)
-                    # Then, reload all clients. This will now pick up the new client
-                    # AND the fact that it was the last one selected.
-                    self.load_clients_from_config()
-                    
-                    # Finally, move to the next screen
-                    self.show_frame(self.main_frame)
-                else:
-                    self.db_status_label.configure(text="Error: Failed to create database tables. Check permissions.", text_color="red")
+        elif message_type == "DB_SCHEMA_DONE":
+            tables_ok, user_message = data
+            self.db_test_button.configure(state="normal", text="Test & Save Connection")
             
-            # ... (LOG and PROGRESS cases remain the same) ...
-            elif message_type == "PROGRESS": self.progressbar.set(float(data))
-            elif message_type == "LOG":
-                self.log_message(data)
-                if data == "Sync Finished!" or data == "Sync cancelled by user.":
-                    self.sync_button.configure(state="normal"); self.cancel_button.configure(state="disabled")
-            elif message_type == "LIVE_UPDATE":
-                client_name, status_text = data
-                if client_name in self.live_sync_client_labels:
-                    # This part is correct, it updates the 'status' label
-                    self.live_sync_client_labels[client_name]['status'].configure(text=status_text)
-
-            elif message_type == "LIVE_STATUS_FETCHED":
-                client_name, sync_text = data
-                if client_name in self.live_sync_client_labels:
-                    # Update the main "last sync" label with the real data
-                    label_widget = self.live_sync_client_labels[client_name]['main']
-                    label_widget.configure(text=sync_text, text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"]) # Reset to default color
-                
-                # --- THIS IS THE CRASH FIX ---
-                # We need to check the 'status' label inside each dictionary value
-                if all("Done" in lbl_dict['status'].cget("text") or "Fail" in lbl_dict['status'].cget("text") for lbl_dict in self.live_sync_client_labels.values()):
-                    self.live_sync_start_button.configure(state="normal")
-                    self.live_sync_cancel_button.configure(state="disabled")
-                    self.live_sync_refresh_button.configure(state="normal") # Also re-enable refresh
-                    
-            elif message_type == "HISTORICAL_SYNC_COMPLETE":
-                skipped_days, failed_uuids, client_name_from_worker = data
-                
-                final_message = f"Sync Finished for '{client_name_from_worker}'! Skipped {len(skipped_days)} days and queued {len(failed_uuids)} documents for the next Live Sync."
-                self.log_message(final_message)
-                
-                if client_name_from_worker in self.clients:
-                    client_data = self.clients[client_name_from_worker]
-                    # Merge skipped days
-                    existing_skipped = set(client_data.get('skipped_days', []))
-                    final_skipped_list = sorted(list(existing_skipped | set(skipped_days)))
-                    # Merge failed UUIDs
-                    existing_failed = set(client_data.get('failed_uuids', []))
-                    final_failed_list = sorted(list(existing_failed | set(failed_uuids)))
-                    
-                    # Save the complete, updated configuration to the file
-                    config_manager.save_client_config(
-                        client_name_from_worker, client_data.get('client_id'), client_data.get('client_secret'),
-                        client_data.get('db_host'), client_data.get('db_port'), client_data.get('db_name'),
-                        client_data.get('db_user'), client_data.get('db_pass'), client_data.get('date_span'),
-                        client_data.get('oldest_invoice_date'), final_skipped_list, final_failed_list
-                    )
-                    
-                    # Manually update the in-memory dictionary for this one client
-                    self.clients[client_name_from_worker]['skipped_days'] = final_skipped_list
-                    self.clients[client_name_from_worker]['failed_uuids'] = final_failed_list
-                    config_manager.save_last_selected_client(client_name_from_worker)
-                    self.clients = config_manager.load_all_clients()
-                    
+            if tables_ok:
+                # Display the result of the user creation step
+                self.db_status_label.configure(text=f"Success! {user_message}", text_color="green")
+            success = data
+            self.db_test_button.configure(state="normal", text="Test & Save Connection")
+            if success:
+                self.db_status_label.configure(text="Success! Database is ready. Saving configuration...", text_color="green")
+                # Save all credentials
+                 # 1. Prioritize the name from the text entry box.
+                client_name = self.client_name_entry.get()
+                # 2. If it's empty, fall back to the dropdown's selected value.
+                if not client_name: client_name = f"Client-{self.client_id_entry.get()[:6]}"
+
+                date_span = (self.start_date_entry.get_date().strftime('%Y-%m-%d'), self.end_date_entry.get_date().strftime('%Y-%m-%d'))
+                config_manager.save_client_config(client_name, self.client_id_entry.get(), self.client_secret_entry.get(),
+                                                  self.db_host_entry.get(), int(self.db_port_entry.get() or 5432), self.db_name_entry.get(), self.db_user_entry.get(),
+                                                  self.db_pass_entry.get(), date_span, self.discovered_oldest_date)
+                 # First, save the last selected client name to the config
+                config_manager.save_last_selected_client(client_name)
+                # Then, reload all clients. This will now pick up the new client
+                # AND the fact that it was the last one selected.
+                self.load_clients_from_config()
                 
-                # The UI state (dropdown selection, text fields) is NOT changed.
-                self.sync_button.configure(state="normal")
-                self.cancel_button.configure(state="disabled")
-                messagebox.showinfo("Historical Sync", final_message)
-                self.current_logfile = None
-
-            elif message_type == "TRIGGER_LIVE_SYNC":
-                # Check if a sync is already running
-                if self.live_sync_worker_thread and self.live_sync_worker_thread.is_alive():
-                    self.log_message("Scheduled sync trigger ignored: a sync is already in progress.")
-                else:
-                    self.log_message("Starting scheduled live sync for all clients...")
-                    # In an automated run, we always want to sync all clients
-                    for checkbox_var in self.live_sync_client_checkboxes.values():
-                        checkbox_var.set(1)
-                    self.select_all_var.set(1)
-                    # Use the same start function as the manual button
-                    self.start_live_sync()
-
-            elif message_type == "LIVE_SYNC_COMPLETE":
+                # Finally, move to the next screen
+                self.show_frame(self.main_frame)
+            else:
+                self.db_status_label.configure(text="Error: Failed to create database tables. Check permissions.", text_color="red")
+        
+        elif message_type == "LIVE_STATUS_FETCHED":
+            client_name, sync_text = data
+            if client_name in self.live_sync_client_labels:
+                # Update the main "last sync" label with the real data
+                label_widget = self.live_sync_client_labels[client_name]['main']
+                label_widget.configure(text=sync_text, text_color=ctk.ThemeManager.theme["CTkLabel"]["text_color"]) # Reset to default color
+            
+            # --- THIS IS THE CRASH FIX ---
+            # We need to check the 'status' label inside each dictionary value
+            if all("Done" in lbl_dict['status'].cget("text") or "Fail" in lbl_dict['status'].cget("text") for lbl_dict in self.live_sync_client_labels.values()):
                 self.live_sync_start_button.configure(state="normal")
                 self.live_sync_cancel_button.configure(state="disabled")
-                self.live_sync_refresh_button.configure(state="normal")
-                messagebox.showinfo("Live Sync", "Live sync for all clients is complete.")
-                self.current_logfile = None # --- NEW: Close the log file ---
-        except queue.Empty: pass
-        finally: self.after(100, self.process_queue)
+                self.live_sync_refresh_button.configure(state="normal") # Also re-enable refresh
+                
+        elif message_type == "HISTORICAL_SYNC_COMPLETE":
+            skipped_days, failed_uuids, client_name_from_worker = data
+            
+            final_message = f"Sync Finished for '{client_name_from_worker}'! Skipped {len(skipped_days)} days and queued {len(failed_uuids)} documents for the next Live Sync."
+            self.log_message(final_message)
+            
+            if client_name_from_worker in self.clients:
+                # Merge skipped days into the saved configuration
+                config_manager.merge_sync_results(client_name_from_worker, skipped_days, ()) # Failed UUIDs are already in the DB retry queue
+                config_manager.save_last_selected_client(client_name_from_worker)
+                self.clients = config_manager.load_all_clients()
+                
+            
+            # The UI state (dropdown selection, text fields) is NOT changed.
+            self.sync_button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
+            messagebox.showinfo("Historical Sync", final_message)
+            self.log_sink.end_session(wait=False)
+
+        elif message_type == "TRIGGER_LIVE_SYNC":
+            # Check if a sync is already running
+            if self.live_sync_worker_thread and self.live_sync_worker_thread.is_alive():
+                self.log_message("Scheduled sync trigger ignored: a sync is already in progress.")
+            else:
+                self.log_message("Starting scheduled live sync for all clients...")
+                # In an automated run, we always want to sync all clients
+                for checkbox_var in self.live_sync_client_checkboxes.values():
+                    checkbox_var.set(1)
+                self.select_all_var.set(1)
+                # Use the same start function as the manual button
+                self.start_live_sync()
+
+        elif message_type == "LIVE_SYNC_COMPLETE":
+            self.live_sync_start_button.configure(state="normal")
+            self.live_sync_cancel_button.configure(state="disabled")
+            self.live_sync_refresh_button.configure(state="normal")
+            messagebox.showinfo("Live Sync", "Live sync for all clients is complete.")
+            self.log_sink.end_session(wait=False) # --- NEW: Close the log file ---
 
     def create_live_sync_frame(self):
         self.live_sync_frame = ctk.CTkFrame(self)
@@ -573,7 +607,7 @@ class App(ctk.CTk):
 
         for name, config in self.clients.items():
             sync_text = "Never Synced" # Default text
-            db_params = { 'host': config.get('db_host'), 'dbname': config.get('db_name'), 'user': config.get('db_user'), 'password': config.get('db_pass'), 'port': int(config.get('db_port', 5432)) }
+            db_params = config_manager.client_db_params(config)
             client_api_id = config.get('client_id')
             temp_db_manager = DatabaseManager(db_params)
             
@@ -695,15 +729,14 @@ class App(ctk.CTk):
         if not client_name: client_name = self.selected_client_name.get()
         if not client_name or client_name == "No clients configured": client_name = "Untitled_Client"
         
-        client_name_safe = client_name.replace(" ", "_").replace("/", "-")
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
-        self.current_logfile = f"logs/Historical_{client_name_safe}_{timestamp}.txt"
+        self.log_sink.start_session(f"Historical_{client_name}")
         
         self.log_message("--- Starting Sync ---")
         self.sync_button.configure(state="disabled"); self.cancel_button.configure(state="normal")
         start_date, end_date = self.start_date_entry.get_date(), self.end_date_entry.get_date()
         client_name_for_sync = self.selected_client_name.get()
-        self.sync_worker_thread = SyncWorker(client_name_for_sync, self.api_client.client_id, self.api_client, self.db_manager, start_date, end_date, self.ui_queue)
+        # The worker gets its own manager (and pooled connection) instead of sharing the UI's across threads
+        self.sync_worker_thread = SyncWorker(client_name_for_sync, self.api_client.client_id, self.api_client, self.db_manager.clone(), start_date, end_date, self.ui_queue)
         self.sync_worker_thread.start()
 
         
@@ -711,28 +744,14 @@ class App(ctk.CTk):
     def cancel_sync(self):
         if self.sync_worker_thread and self.sync_worker_thread.is_alive():
             self.sync_worker_thread.stop(); self.log_message("--- Cancellation requested ---"); self.cancel_button.configure(state="disabled")
-            self.current_logfile = None # --- NEW: Close the log file on cancellation ---
+            self.log_sink.end_session(wait=False) # --- NEW: Close the log file on cancellation ---
     def log_message(self, message):
-        """Appends a message to the UI textbox AND the external log file."""
-        should_autoscroll = self.log_textbox.yview()[1] == 1.0
-        
-        # --- NEW: Write to external log file first ---
-        if self.current_logfile:
-            try:
-                with open(self.current_logfile, 'a', encoding='utf-8') as f:
-                    # Write the full, timestamped message to the file
-                    f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}\n")
-            except Exception as e:
-                # If logging fails, print to console but don't crash the app
-                print(f"!!! FAILED TO WRITE TO LOG FILE {self.current_logfile}: {e}")
-
-        # Update the on-screen textbox
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.insert("end", f"{datetime.datetime.now().strftime('%H:%M:%S')} - {message}\n")
-        self.log_textbox.configure(state="disabled")
-
-        if should_autoscroll:
-            self.log_textbox.see("end")
+        """Sends a message to the log sink, which writes the log file and echoes it back to the textbox."""
+        self.log_sink.log(message)
+
+    def log_messages(self, records):
+        """Appends a batch of log sink records to the on-screen log view."""
+        self.log_view.append(records)
     
     def start_live_sync(self):
          # --- NEW: Build a dictionary of only the selected clients ---
@@ -747,8 +766,7 @@ class App(ctk.CTk):
 
         self.live_sync_start_button.configure(state="disabled")
         # --- NEW: Create and set the log file for this session ---
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
-        self.current_logfile = f"logs/LiveSync_AllClients_{timestamp}.txt"
+        self.log_sink.start_session("LiveSync_AllClients", client_prefix="LiveSync")
 
         self.live_sync_cancel_button.configure(state="normal")
         self.live_sync_refresh_button.configure(state="disabled") # Disable refresh during sync
@@ -763,7 +781,7 @@ class App(ctk.CTk):
             self.live_sync_worker_thread.stop()
             self.log_message("--- Live Sync cancellation requested ---")
             self.live_sync_cancel_button.configure(state="disabled")
-            self.current_logfile = None # --- NEW: Close the log file on cancellation ---
+            self.log_sink.end_session(wait=False) # --- NEW: Close the log file on cancellation ---
 
     def toggle_automation(self):
         """Starts or stops the daily automation scheduler."""
@@ -0,0 +1,136 @@
+# rate_limiter.py
+import threading
+import time
+
+# --- Default budgets (requests/second and burst size) ---
+# Endpoint budgets are shared by every client in the process (same egress IP);
+# credential budgets cap a single ETA client_id on top of that.
+ENDPOINT_BUDGETS = {
+    'token':   {'rate': 0.5, 'capacity': 2, 'min_rate': 0.1, 'max_rate': 1.0},
+    'search':  {'rate': 2.0, 'capacity': 4, 'min_rate': 0.2, 'max_rate': 5.0},
+    'details': {'rate': 4.0, 'capacity': 8, 'min_rate': 0.3, 'max_rate': 10.0},
+}
+CREDENTIAL_BUDGETS = {
+    'token':   {'rate': 0.2, 'capacity': 2, 'min_rate': 0.05, 'max_rate': 0.5},
+    'search':  {'rate': 1.0, 'capacity': 3, 'min_rate': 0.1, 'max_rate': 3.0},
+    'details': {'rate': 1.7, 'capacity': 4, 'min_rate': 0.2, 'max_rate': 5.0},
+}
+INCREASE_AFTER_SUCCESSES = 25   # Successful calls needed before the rate is raised again
+INCREASE_STEP = 0.1             # Additive increase (req/sec)
+DECREASE_FACTOR = 0.5           # Multiplicative decrease on every 429
+
+
+class TokenBucket:
+    """
+    A lock-protected token bucket with burst capacity. Tokens are reserved up
+    front, so callers learn how long to wait and sleep outside the lock.
+    The fill rate adapts: it is halved on throttling and slowly raised back
+    while calls keep succeeding (AIMD). The 429s of requests that were already
+    in flight belong to the same throttling event, so after a decrease the
+    rate is held for one interval at the new rate (or the Retry-After pause).
+    """
+    def __init__(self, rate, capacity, min_rate=None, max_rate=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.min_rate = float(min_rate if min_rate is not None else rate)
+        self.max_rate = float(max_rate if max_rate is not None else rate)
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.decrease_hold_until = 0.0
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+
+    def reserve(self):
+        """Takes one token and returns the number of seconds the caller must wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait_time = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait_time, self.paused_until - now)
+
+    def record_success(self):
+        with self.lock:
+            self.successes += 1
+            if self.successes >= INCREASE_AFTER_SUCCESSES:
+                self.successes = 0
+                self.rate = min(self.max_rate, self.rate + INCREASE_STEP)
+
+    def record_throttled(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.successes = 0
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if now < self.decrease_hold_until:
+                return # Already decreased for this throttling event
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            # Drain the burst so the next callers are spaced at the reduced rate
+            self.tokens = min(self.tokens, 0.0)
+            self.decrease_hold_until = max(now + 1.0 / self.rate, self.paused_until)
+
+
+class RateLimiter:
+    """Process-wide registry of token buckets, keyed by endpoint and by credential."""
+    def __init__(self, endpoint_budgets=None, credential_budgets=None):
+        self.endpoint_budgets = endpoint_budgets or ENDPOINT_BUDGETS
+        self.credential_budgets = credential_budgets or CREDENTIAL_BUDGETS
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, budget):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(**budget)
+                self._buckets[key] = bucket
+            return bucket
+
+    def _buckets_for(self, endpoint, credential):
+        buckets = [self._bucket(('endpoint', endpoint), self.endpoint_budgets[endpoint])]
+        if credential:
+            buckets.append(self._bucket(('credential', credential, endpoint), self.credential_budgets[endpoint]))
+        return buckets
+
+    def acquire(self, endpoint, credential=None):
+        """Blocks until both the endpoint budget and the credential budget allow one more request."""
+        wait_time = max(bucket.reserve() for bucket in self._buckets_for(endpoint, credential))
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    def record_success(self, endpoint, credential=None):
+        for bucket in self._buckets_for(endpoint, credential):
+            bucket.record_success()
+
+    def record_throttled(self, endpoint, credential=None, retry_after=None):
+        for bucket in self._buckets_for(endpoint, credential):
+            bucket.record_throttled(retry_after)
+
+    def current_rates(self):
+        """Returns a snapshot of the adapted rate for every bucket, for logging."""
+        with self._lock:
+            return {key: bucket.rate for key, bucket in self._buckets.items()}
+
+
+def parse_retry_after(value, default=3.0):
+    """Parses a Retry-After header given in seconds; falls back to `default` for missing or date values."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+_shared_limiter = RateLimiter()
+
+def get_rate_limiter():
+    """Returns the limiter shared by every ETAApiClient in this process."""
+    return _shared_limiter
@@ -0,0 +1,96 @@
+# retry_queue.py
+from detail_fetcher import DetailFetcher, DEFAULT_MAX_IN_FLIGHT
+from batch_writer import DocumentBatchWriter, merge_newest_doc
+from field_mapping import core_document
+
+DEFAULT_RETRY_BATCH = 500     # Eligible queue entries taken per drain round
+TABLE_PREFIXES = {"Received": "", "Sent": "sent_"}
+
+def _direction_from_details(details, api_client):
+    # Entries imported from settings have no direction; documents we issued are 'Sent'
+    issuer = core_document(details).get('issuer') or details.get('issuer') or {}
+    return "Sent" if issuer.get('id') == api_client.client_id else "Received"
+
+
+class RetryQueueProcessor:
+    """
+    Drains the durable retry_queue table: only entries whose backoff expired are
+    taken, in rounds of `batch_size`. Documents that already exist are dropped
+    from the queue, the rest are fetched concurrently and bulk-written per
+    direction, and each write removes its queue entries in the same transaction.
+    Failures go back with their error class and a longer backoff, and are
+    dead-lettered after RETRY_MAX_ATTEMPTS.
+    """
+    def __init__(self, api_client, db_manager, max_in_flight=DEFAULT_MAX_IN_FLIGHT, should_continue=None, log=print, batch_size=DEFAULT_RETRY_BATCH,
+                 uuid_indexes=None):
+        self.api_client = api_client
+        self.uuid_indexes = uuid_indexes or {} # table_prefix -> UuidIndex kept in step with the writes
+        self.db_manager = db_manager
+        self.detail_fetcher = DetailFetcher(api_client, max_in_flight)
+        self.should_continue = should_continue or (lambda: True)
+        self.log = log
+        self.batch_size = batch_size
+        self.newest_doc = {'timestamp': None, 'uuid': None, 'internal_id': None}
+        self.stats = {'taken': 0, 'already_present': 0, 'written': 0, 'failed': 0, 'dead_lettered': 0}
+
+    def run(self):
+        """Drains every eligible entry (failures are not eligible again in the same run). Returns the stats."""
+        while self.should_continue():
+            entries = self.db_manager.get_eligible_retries(self.batch_size)
+            if not entries:
+                break
+            self.stats['taken'] += len(entries)
+            if not self._drain(entries) or len(entries) < self.batch_size:
+                break
+        return self.stats
+
+    def _existing(self, uuids):
+        """UUIDs that are already stored in either header table (one lookup for both)."""
+        locations = self.db_manager.locate_documents(uuids)
+        if locations is None:
+            return set() # Lookup failed: fetch everything, the upserting writer tolerates duplicates
+        return {uuid for uuid, direction in locations.items() if direction is not None}
+
+    def _drain(self, entries):
+        """Processes one round. Returns False if its failures could not be recorded (they would be taken again at once)."""
+        directions = {uuid: direction for uuid, direction, _ in entries}
+        present = self._existing(list(directions))
+        if present:
+            self.db_manager.remove_retries(present)
+            self.stats['already_present'] += len(present)
+            self.log(f"      -> {len(present)} queued documents already exist. Removed from the retry queue.")
+
+        to_fetch = [uuid for uuid in directions if uuid not in present]
+        writers = {direction: DocumentBatchWriter(self.db_manager, table_prefix, uuid_index=self.uuid_indexes.get(table_prefix))
+                   for direction, table_prefix in TABLE_PREFIXES.items()}
+        remove_written = lambda cur, uuids: self.db_manager.remove_retries(uuids, cur)
+        failures = []
+        try:
+            for uuid, details in self.detail_fetcher.fetch(to_fetch, self.should_continue):
+                if not details:
+                    error_class, message = self.detail_fetcher.pop_error(uuid)
+                    failures.append((uuid, directions[uuid], error_class, message))
+                    continue
+                direction = directions[uuid] or _direction_from_details(details, self.api_client)
+                writers[direction].add(details)
+                writers[direction].commit_if_due(remove_written)
+            for writer in writers.values():
+                writer.commit(remove_written)
+        except Exception as e:
+            self.log(f"      -> Retry batch write failed: {e}. Rolling back the uncommitted chunk.")
+            for direction, writer in writers.items():
+                failures.extend((uuid, direction, type(e).__name__, str(e)[:500]) for uuid in writer.uncommitted_uuids)
+                failures.extend((details.get('uuid'), direction, type(e).__name__, str(e)[:500]) for details in writer.buffer)
+                writer.rollback()
+
+        for writer in writers.values():
+            self.stats['written'] += writer.written_count
+            merge_newest_doc(self.newest_doc, writer.newest_doc)
+        if failures:
+            self.stats['failed'] += len(failures)
+            dead_lettered = self.db_manager.record_retry_failures(failures)
+            if dead_lettered is None:
+                self.log(f"      -> Could not record {len(failures)} failed retries; they stay queued with their previous backoff.")
+                return False
+            self.stats['dead_lettered'] += dead_lettered
+        return True
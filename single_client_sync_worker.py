@@ -4,70 +4,112 @@ import datetime
 import pytz
 from api_client import ETAApiClient
 from db_manager import DatabaseManager
-import config_manager # Import config_manager to save failed UUIDs
+from detail_fetcher import DEFAULT_MAX_IN_FLIGHT
+from sync_pipeline import SyncPipeline, PAGE_DONE
+from batch_writer import DocumentBatchWriter, merge_newest_doc
+from status_recheck import StatusRecheckEngine, DEFAULT_RECHECK_BUDGET, DIRECTIONS
+from retry_queue import RetryQueueProcessor
+from uuid_index import open_uuid_indexes, save_uuid_indexes
+from log_sink import get_log_sink, INFO, WARNING, ERROR
+import config_manager # Import config_manager to move legacy failed UUIDs to the retry queue
 
 class SingleClientSyncWorker(Thread):
-    def __init__(self, client_name, client_config, progress_queue):
+    def __init__(self, client_name, client_config, progress_queue, max_in_flight=DEFAULT_MAX_IN_FLIGHT, recheck_budget=DEFAULT_RECHECK_BUDGET):
         super().__init__()
         self.client_name = client_name
         self.client_config = client_config
         self.progress_queue = progress_queue
+        self.log_sink = get_log_sink()
+        self.max_in_flight = max_in_flight
+        self.recheck_budget = recheck_budget
         self._is_running = True
         self.newest_doc_in_run = {'timestamp': None, 'uuid': None, 'internal_id': None}
-        self.failed_uuids_in_run = set()
+        self.uuid_indexes = {}
+        self.failed_uuids_in_run = {} # uuid -> (uuid, direction, error_class, message) for the retry queue
 
     def stop(self):
         self._is_running = False
 
-    def _process_batch(self, db_manager, api_client, uuids_to_process, table_prefix, batch_name=""):
-        """Processes a list of UUIDs by fetching details and saving them in a single batch."""
-        if not uuids_to_process:
-            return 0
+    def _log(self, message, level=INFO):
+        """Writes straight to the log sink; the UI/CLI pick the line up from there."""
+        self.log_sink.log(message, level, self.client_name)
+
+    def _sync_new_documents(self, db_manager, api_client, start_local_date, end_local_date, cairo_tz):
+        """
+        Phase 2 as a SyncPipeline: each day's search pages (both directions) are
+        filtered and fetched while earlier documents are still being written, so
+        nothing waits for a whole day's discovery. Returns the number of documents written.
+        """
+        pipeline = SyncPipeline(api_client, self.max_in_flight, lambda: self._is_running)
+        writers = {table_prefix: DocumentBatchWriter(db_manager, table_prefix, uuid_index=self.uuid_indexes.get(table_prefix))
+                   for table_prefix in DIRECTIONS}
+
+        # --- Stage 1: Search every day and direction page by page ---
+        def discover():
+            current_local_date = start_local_date
+            while current_local_date <= end_local_date:
+                self._log(f"  -> Processing Day: {current_local_date.strftime('%Y-%m-%d')} for {self.client_name}")
+                day_start_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.min))
+                day_end_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.max))
+                for table_prefix, direction in DIRECTIONS.items():
+                    continuation_token = None
+                    while True:
+                        search_result = api_client.search_documents(day_start_local, day_end_local, continuation_token=continuation_token, direction=direction)
+                        if search_result is None: break
+                        page_uuids = [s['uuid'] for s in search_result.get('result', []) if isinstance(s, dict) and 'uuid' in s]
+                        if page_uuids:
+                            yield table_prefix, page_uuids
+                        continuation_token = search_result.get('metadata', {}).get('continuationToken')
+                        if continuation_token == "EndofResultSet" or not continuation_token: break
+                current_local_date += datetime.timedelta(days=1)
+
+        # --- Stage 2: Keep only documents we do not have (own connection, local UUID index first) ---
+        filter_db_manager = db_manager.clone()
+        def select_new(table_prefix, page_uuids):
+            uuids_to_process = self.uuid_indexes[table_prefix].filter_new(filter_db_manager, page_uuids)
+            self._log(f"    -> Found {len(page_uuids)} '{DIRECTIONS[table_prefix]}' documents for {self.client_name}, {len(uuids_to_process)} new.")
+            return uuids_to_process
+
+        # --- Stage 3 (details are fetched by the pipeline): Batch them and commit in chunks ---
+        def consume(event, table_prefix, uuid, details):
+            if event == PAGE_DONE:
+                return
+            if details:
+                writers[table_prefix].add(details)
+                self._log(f"      -> Batched {DIRECTIONS[table_prefix]} doc (UUID: {uuid[:8]}...)")
+            else:
+                self._log(f"API_FAIL on doc {uuid[:8]}: Adding to retry queue.", WARNING)
+                self.failed_uuids_in_run[uuid] = (uuid, DIRECTIONS[table_prefix], *pipeline.pop_error(uuid))
+            if writers[table_prefix].commit_if_due():
+                merge_newest_doc(self.newest_doc_in_run, writers[table_prefix].newest_doc)
 
-        total_to_process = len(uuids_to_process)
-        self.progress_queue.put(("LOG", f"    -> {batch_name}: Found {total_to_process} new documents. Fetching and batching..."))
-        saved_count = 0
-        
+        if not filter_db_manager.connect():
+            self._log("  -> No database connection for the discovery filter. Skipping new-document discovery this run.", WARNING)
+            return 0
         try:
-            with db_manager.conn.cursor() as cur:
-                for i, uuid in enumerate(uuids_to_process):
-                    if not self._is_running: raise InterruptedError("Sync cancelled.")
-                    
-                    details = api_client.get_document_details(uuid)
-                    if details:
-                        success = db_manager.insert_document(cur, details, table_prefix)
-                        if success:
-                            saved_count += 1
-                            self.progress_queue.put(("LOG", f"      -> Batched {batch_name} doc {i+1}/{total_to_process} (UUID: {uuid[:8]}...)"))
-                            doc_ts_str = details.get('dateTimeReceived') or details.get('dateTimeRecevied')
-                            if doc_ts_str:
-                                if '.' in doc_ts_str and len(doc_ts_str.split('.')[1]) > 7: doc_ts_str = doc_ts_str[:26] + "Z"
-                                doc_dt = None
-                                for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-                                    try: doc_dt = datetime.datetime.strptime(doc_ts_str, fmt); break
-                                    except ValueError: continue
-                                if doc_dt and (self.newest_doc_in_run['timestamp'] is None or doc_dt > self.newest_doc_in_run['timestamp']):
-                                    self.newest_doc_in_run['timestamp'] = doc_dt
-                                    self.newest_doc_in_run['uuid'] = details.get('uuid')
-                                    self.newest_doc_in_run['internal_id'] = details.get('internalID') or details.get('document', {}).get('internalId')
-                        else:
-                            self.progress_queue.put(("LOG", f"DB_FAIL on doc {uuid[:8]}: {message}"))
-                            self.failed_uuids_in_run.add(uuid)
-                    else:
-                        self.progress_queue.put(("LOG", f"API_FAIL on doc {uuid[:8]}: Adding to retry queue."))
-                        self.failed_uuids_in_run.add(uuid)
-            
-            db_manager.conn.commit()
-            self.progress_queue.put(("LOG", f"    -> Batch of {saved_count} new '{batch_name}' documents committed."))
-            return saved_count
-            
-        except InterruptedError:
-            self.progress_queue.put(("LOG", f"  -> Batch cancelled for {batch_name}. Rolling back changes."))
-            db_manager.conn.rollback()
+            pipeline.run(discover, select_new, consume)
+            # Documents fetched before a stop are complete, so they are committed as well
+            for table_prefix, writer in writers.items():
+                if writer.pending_count():
+                    self._commit_batch(writer, DIRECTIONS[table_prefix])
         except Exception as e:
-            self.progress_queue.put(("LOG", f"  -> CRITICAL BATCH ERROR for {batch_name}: {e}. Rolling back changes."))
-            db_manager.conn.rollback()
-        return 0
+            self._log(f"  -> CRITICAL BATCH ERROR during discovery: {e}. Rolling back the uncommitted chunk.", ERROR)
+            # The rolled-back documents were fetched fine; queue them so the next run writes them
+            for table_prefix, writer in writers.items():
+                for uuid in writer.uncommitted_uuids + [details.get('uuid') for details in writer.buffer]:
+                    self.failed_uuids_in_run[uuid] = (uuid, DIRECTIONS[table_prefix], type(e).__name__, str(e)[:500])
+                writer.rollback()
+        finally:
+            filter_db_manager.disconnect()
+        for writer in writers.values():
+            merge_newest_doc(self.newest_doc_in_run, writer.newest_doc)
+        return sum(writer.written_count for writer in writers.values())
+
+    def _commit_batch(self, writer, batch_name):
+        writer.commit()
+        merge_newest_doc(self.newest_doc_in_run, writer.newest_doc)
+        self._log(f"    -> Batch of {writer.written_count} new '{batch_name}' documents committed.")
+        return writer.written_count
 
     def run(self):
         client_name = self.client_name
@@ -75,94 +117,71 @@ class SingleClientSyncWorker(Thread):
         cairo_tz = pytz.timezone('Africa/Cairo')
         now_in_cairo = datetime.datetime.now(cairo_tz)
 
-        self.progress_queue.put(("LOG", f"--- Starting sync thread for: {client_name} ---"))
-        db_params = { 'host': client_config.get('db_host'), 'dbname': client_config.get('db_name'), 'user': client_config.get('db_user'), 'password': client_config.get('db_pass'), 'port': int(client_config.get('db_port', 5432)) }
+        self._log(f"--- Starting sync thread for: {client_name} ---")
+        db_params = config_manager.client_db_params(client_config)
         api_client = ETAApiClient(client_config.get('client_id'), client_config.get('client_secret'))
         db_manager = DatabaseManager(db_params)
         
         if not db_manager.connect():
-            self.progress_queue.put(("LOG", f"DB connection failed for {client_name}. Thread stopping."))
+            self._log(f"DB connection failed for {client_name}. Thread stopping.", WARNING)
             self.progress_queue.put(("LIVE_UPDATE", (client_name, "DB Conn Fail")))
             return
+        try:
+            self._run_phases(db_manager, api_client, now_in_cairo, cairo_tz)
+        finally:
+            # The pooled connection and the index updates must not be lost when a phase raises
+            save_uuid_indexes(self.uuid_indexes)
+            db_manager.disconnect()
+
+    def _run_phases(self, db_manager, api_client, now_in_cairo, cairo_tz):
+        """Phases 0-2 and the finalization on the connected db_manager; run() owns the cleanup."""
+        client_name = self.client_name
+        client_config = self.client_config
 
-        # --- PHASE 0: Process Failed UUID Retry Queue (Robust Version) ---
-        self.progress_queue.put(("LOG", f"  -> Phase 0 ({client_name}): Checking retry queue..."))
-        uuids_to_retry = client_config.get('failed_uuids', [])
-        successfully_processed_retries = set()
-        
-        if uuids_to_retry:
-            self.progress_queue.put(("LOG", f"    -> Found {len(uuids_to_retry)} documents to retry for {client_name}."))
-            
-            docs_to_insert_received = []
-            docs_to_insert_sent = []
-
-            for uuid in uuids_to_retry:
-                if not self._is_running: break
-
-                # We still check for existence first to be efficient
-                if db_manager.document_exists(uuid, "") or db_manager.document_exists(uuid, "sent_"):
-                    successfully_processed_retries.add(uuid)
-                    self.progress_queue.put(("LOG", f"      -> Doc {uuid[:8]} from queue already exists. Removing."))
-                    continue
-
-                details = api_client.get_document_details(uuid)
-                if details:
-                    # We determine the direction and add the *details* to the correct list
-                    # NOTE: We assume 'api_client.client_id' is the issuer's tax ID. If this is not the case,
-                    # this line would need to use `client_config.get('tax_id')` if you re-add that field.
-                    is_sent = details.get('issuer', {}).get('id') == api_client.client_id
-                    if is_sent:
-                        docs_to_insert_sent.append(details)
-                    else:
-                        docs_to_insert_received.append(details)
-                    
-                    # We mark the UUID as successfully *processed* (not necessarily saved yet)
-                    successfully_processed_retries.add(uuid)
-                else:
-                    self.progress_queue.put(("LOG", f"      -> FAILED again on retried doc {uuid[:8]}. Keeping in queue."))
-                    self.failed_uuids_in_run.add(uuid) # Add it to this run's failures
-
-            # Now, we use the existing, efficient batching method to insert them
-            if docs_to_insert_received:
-                self._process_batch_from_details(db_manager, docs_to_insert_received, "", "Retry-Received")
-            
-            if docs_to_insert_sent:
-                self._process_batch_from_details(db_manager, docs_to_insert_sent, "sent_", "Retry-Sent")
-
+        db_manager.ensure_partitions() # Keeps upcoming months partitioned (no-op on a flat schema)
+        # Local UUID presence filters: discovery only asks the database about possible hits
+        self.uuid_indexes = open_uuid_indexes(client_name, db_manager, self._log)
+
+        # --- PHASE 0: Drain the durable retry queue (only entries whose backoff expired) ---
+        self._log(f"  -> Phase 0 ({client_name}): Checking retry queue...")
+        legacy_uuids = client_config.get('failed_uuids', [])
+        if legacy_uuids:
+            # UUIDs queued in settings before the retry_queue table existed move there once
+            if db_manager.enqueue_retries((uuid, None) for uuid in legacy_uuids):
+                config_manager.update_failed_uuids(client_name, remove=legacy_uuids)
+                self._log(f"    -> Moved {len(legacy_uuids)} queued documents from the client settings to the retry queue.")
+
+        retries = RetryQueueProcessor(api_client, db_manager, self.max_in_flight, lambda: self._is_running, self._log, uuid_indexes=self.uuid_indexes)
+        retry_stats = retries.run()
+        merge_newest_doc(self.newest_doc_in_run, retries.newest_doc)
+        if retry_stats['taken']:
+            self._log(f"    -> Retried {retry_stats['taken']} documents: {retry_stats['written']} written, {retry_stats['already_present']} already present, "
+                      f"{retry_stats['failed']} failed again ({retry_stats['dead_lettered']} dead-lettered).",
+                      WARNING if retry_stats['failed'] else INFO)
         else:
-            self.progress_queue.put(("LOG", f"    -> Retry queue is empty."))
+            self._log(f"    -> No retries are due.")
 
         # --- PHASE 1: Re-check status of in-flux documents ---
-        self.progress_queue.put(("LOG", f"  -> Phase 1 ({client_name}): Checking for status updates on recent documents..."))
-        docs_to_recheck = db_manager.get_influx_document_uuids()
-        updated_count = 0
-        if docs_to_recheck:
-            self.progress_queue.put(("LOG", f"    -> ({client_name}) Found {len(docs_to_recheck)} documents to re-validate."))
-            for uuid in docs_to_recheck:
-                if not self._is_running: break
-                details = api_client.get_document_details(uuid)
-                if details and details.get('status') != 'Valid':
-                    # Determine table prefix based on the document's issuer/receiver ID
-                    is_sent = details.get('issuer', {}).get('id') == api_client.client_id
-                    table_prefix = "sent_" if is_sent else ""
-                    
-                    new_status = details.get('status')
-                    reason = details.get('documentStatusReason', '')
-                    db_manager.update_document_status(uuid, new_status, reason, table_prefix)
-                    updated_count += 1
-                    self.progress_queue.put(("LOG", f"      -> STATUS UPDATE ({client_name}): Doc {uuid[:8]} changed to '{new_status}'."))
+        self._log(f"  -> Phase 1 ({client_name}): Checking for status updates on recent documents...")
+        recheck = StatusRecheckEngine(api_client, db_manager, self.max_in_flight, lambda: self._is_running, self._log, budget=self.recheck_budget)
+        applied = recheck.run()
+        if recheck.stats['checked']:
+            self._log(f"    -> ({client_name}) Re-validated {recheck.stats['checked']} due documents with {recheck.stats['search_pages']} search pages and {recheck.stats['detail_fetches']} detail calls; {recheck.stats['scheduled']} scheduled for a later check.")
+        for table_prefix, changes in applied.items():
+            for uuid, new_status, reason in changes:
+                self._log(f"      -> STATUS UPDATE ({client_name}): Doc {uuid[:8]} changed to '{new_status}'.")
+        updated_count = recheck.stats['updated']
         
         if updated_count > 0:
-            self.progress_queue.put(("LOG", f"  -> Phase 1 Complete ({client_name}): Updated {updated_count} document statuses."))
+            self._log(f"  -> Phase 1 Complete ({client_name}): Updated {updated_count} document statuses.")
         else:
-            self.progress_queue.put(("LOG", f"  -> Phase 1 Complete ({client_name}): All recent document statuses are up-to-date."))
+            self._log(f"  -> Phase 1 Complete ({client_name}): All recent document statuses are up-to-date.")
         
         if not self._is_running: # Allow cancellation after Phase 1
-             db_manager.disconnect()
-             return
+            return
 
         # PHASE 2: New Document Discovery
-        self.progress_queue.put(("LOG", f"  -> Phase 2 ({client_name}): Discovering new documents..."))
+        self._log(f"  -> Phase 2 ({client_name}): Discovering new documents...")
         start_date = db_manager.get_latest_invoice_timestamp()
         if start_date: start_date = start_date.astimezone(cairo_tz)
         else:
@@ -170,40 +189,11 @@ class SingleClientSyncWorker(Thread):
             if start_date_str: start_date = cairo_tz.localize(datetime.datetime.strptime(start_date_str, '%Y-%m-%d'))
             else: start_date = now_in_cairo - datetime.timedelta(days=30)
         
-        total_new_docs_in_phase2 = 0
-        current_local_date = start_date.date()
-
-        while current_local_date <= now_in_cairo.date() and self._is_running:
-            self.progress_queue.put(("LOG", f"  -> Processing Day: {current_local_date.strftime('%Y-%m-%d')} for {client_name}"))
-            day_start_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.min))
-            day_end_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.max))
-            directions_to_sync = [("Received", ""), ("Sent", "sent_")]
-            
-            for direction, table_prefix in directions_to_sync:
-                if not self._is_running: break
-                
-                all_summaries = []
-                continuation_token = None
-                while True:
-                    search_result = api_client.search_documents(day_start_local, day_end_local, continuation_token=continuation_token, direction=direction)
-                    if search_result is None: break
-                    all_summaries.extend(search_result.get('result', []))
-                    continuation_token = search_result.get('metadata', {}).get('continuationToken')
-                    if continuation_token == "EndofResultSet" or not continuation_token: break
-                
-                all_discovered_uuids = [s['uuid'] for s in all_summaries if isinstance(s, dict) and 'uuid' in s]
-                if not all_discovered_uuids: continue
-
-                if all_summaries:
-                    self.progress_queue.put(("LOG", f"    -> Found {len(all_summaries)} '{direction}' documents for {client_name}."))
-
-                uuids_to_process = db_manager.filter_existing_uuids(all_discovered_uuids, table_prefix)
-                total_new_docs_in_phase2 += self._process_batch(db_manager, api_client, uuids_to_process, table_prefix, direction)
-
-            if not self._is_running: break
-            current_local_date += datetime.timedelta(days=1)
+        total_new_docs_in_phase2 = self._sync_new_documents(db_manager, api_client, start_date.date(), now_in_cairo.date(), cairo_tz)
 
         # --- FINALIZATION ---
+        # Failed documents are queued on cancel as well: they were discovered but not written
+        db_manager.record_retry_failures(self.failed_uuids_in_run.values())
         if self._is_running:
             if total_new_docs_in_phase2 > 0 and self.newest_doc_in_run['timestamp']:
                 db_manager.update_sync_status(client_config['client_id'], self.newest_doc_in_run['timestamp'], self.newest_doc_in_run['uuid'], self.newest_doc_in_run['internal_id'])
@@ -212,13 +202,6 @@ class SingleClientSyncWorker(Thread):
             else:
                 self.progress_queue.put(("LIVE_UPDATE", (client_name, "Up to date")))
 
-            final_failed_uuids_list = sorted(list((set(uuids_to_retry) - successfully_processed_retries) | self.failed_uuids_in_run))
-            config_manager.save_client_config(
-                client_name, client_config.get('client_id'), client_config.get('client_secret'),
-                client_config.get('db_host'), client_config.get('db_port'), client_config.get('db_name'),
-                client_config.get('db_user'), client_config.get('db_pass'), client_config.get('date_span'),
-                client_config.get('oldest_invoice_date'), client_config.get('skipped_days'), final_failed_uuids_list
-            )
-            self.progress_queue.put(("LOG", f"--- Finished sync thread for {client_name}. Found {total_new_docs_in_phase2} new documents. {len(final_failed_uuids_list)} documents remain in retry queue. ---"))
-        
-        db_manager.disconnect()
\ No newline at end of file
+            queue_counts = db_manager.get_retry_queue_counts()
+            self._log(f"--- Finished sync thread for {client_name}. Found {total_new_docs_in_phase2} new documents. "
+                      f"{queue_counts.get('pending', 0)} documents remain in retry queue ({queue_counts.get('dead_lettered', 0)} dead-lettered). ---")
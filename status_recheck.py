@@ -0,0 +1,163 @@
+# status_recheck.py
+import datetime
+from detail_fetcher import DetailFetcher, DEFAULT_MAX_IN_FLIGHT
+
+DIRECTIONS = {"": "Received", "sent_": "Sent"}
+SEARCH_PAGE_SIZE = 500
+SEARCH_MARGIN = datetime.timedelta(days=1)   # Submission and receipt times can straddle the window edge
+MAX_SEARCH_DAYS = 30                          # The search API refuses longer ranges
+
+# --- Scheduling ---
+DEFAULT_RECHECK_BUDGET = 2000                 # Due documents taken per run; the rest wait for the next run
+DEFAULT_MAX_DETAIL_CALLS = 200                # Detail fetches per run for documents search could not resolve
+MIN_RECHECK_INTERVAL = datetime.timedelta(minutes=15)
+MAX_RECHECK_INTERVAL = datetime.timedelta(hours=12)
+DEADLINE_MARGIN = datetime.timedelta(minutes=30)   # A last look this long before the window closes
+
+def utc_now():
+    """Naive UTC, matching how timestamps are stored."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+def next_check_time(now, received, deadline, status_changed_at=None):
+    """
+    When a still-valid document should be looked at again. Fresh documents (or
+    ones whose status changed recently) are checked often; the interval grows
+    with age (a quarter of it, between 15 minutes and 12 hours) and the last
+    check lands shortly before the cancel/reject deadline. Returns None once
+    the deadline has passed.
+    """
+    now, received, deadline, status_changed_at = map(_naive_utc, (now, received, deadline, status_changed_at))
+    if deadline is None or deadline <= now:
+        return None
+    anchor = status_changed_at or received or now
+    interval = min(max((now - anchor) / 4, MIN_RECHECK_INTERVAL), MAX_RECHECK_INTERVAL)
+    next_check = now + interval
+    final_check = deadline - DEADLINE_MARGIN
+    if next_check > final_check:
+        next_check = final_check if final_check > now else deadline
+    return next_check
+
+
+class StatusRecheckEngine:
+    """
+    Re-validates documents that can still be cancelled or rejected. Each run
+    takes only the due slice (next_check_at passed), at most `budget` documents.
+    Instead of one detail call per document, each direction's recent window is
+    paged through the search API once and statuses are read from the summaries.
+    Only ambiguous documents (missing from the search results, summary without
+    a status, or the search itself failed) fall back to a detail fetch, up to
+    `max_detail_calls`. Changes are applied with one bulk UPDATE per table and
+    every resolved document gets its next check time.
+    """
+    def __init__(self, api_client, db_manager, max_in_flight=DEFAULT_MAX_IN_FLIGHT, should_continue=None, log=print,
+                 budget=DEFAULT_RECHECK_BUDGET, max_detail_calls=DEFAULT_MAX_DETAIL_CALLS):
+        self.api_client = api_client
+        self.db_manager = db_manager
+        self.detail_fetcher = DetailFetcher(api_client, max_in_flight)
+        self.should_continue = should_continue or (lambda: True)
+        self.log = log
+        self.budget = budget
+        self.max_detail_calls = max_detail_calls
+        self.stats = {'checked': 0, 'search_pages': 0, 'detail_fetches': 0, 'updated': 0, 'scheduled': 0, 'deferred': 0}
+
+    def run(self, candidates=None):
+        """
+        Rechecks `candidates` ((uuid, table_prefix, status, date_time_received, deadline,
+        status_changed_at) rows, by default the due slice) and returns the applied
+        changes as {table_prefix: [(uuid, new_status, reason), ...]}.
+        """
+        if candidates is None:
+            candidates = self.db_manager.get_influx_documents(due_only=True, limit=self.budget)
+        by_prefix = {}
+        for uuid, table_prefix, status, received, deadline, status_changed_at in candidates:
+            by_prefix.setdefault(table_prefix, {})[uuid] = (status, received, deadline, status_changed_at)
+
+        applied = {}
+        for table_prefix, documents in by_prefix.items():
+            if not self.should_continue(): break
+            self.stats['checked'] += len(documents)
+            changes, unchanged = self._recheck_direction(table_prefix, documents)
+            if changes:
+                updated = self.db_manager.update_document_statuses(changes, table_prefix)
+                if updated is not None:
+                    self.stats['updated'] += updated
+                    applied[table_prefix] = changes
+
+            now = utc_now()
+            schedule = []
+            for uuid in unchanged:
+                _, received, deadline, status_changed_at = documents[uuid]
+                next_check = next_check_time(now, received, deadline, status_changed_at)
+                if next_check is not None:
+                    schedule.append((uuid, next_check))
+            if self.db_manager.set_next_check_times(schedule, table_prefix):
+                self.stats['scheduled'] += len(schedule)
+        return applied
+
+    def _search_statuses(self, table_prefix, documents):
+        """Returns {uuid: summary} for the window covering `documents`, or None if a search page failed."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        received_times = [received for _, received, _, _ in documents.values() if received is not None]
+        if received_times:
+            window_start = min(received_times)
+            if window_start.tzinfo is None: # Timestamps are stored as naive UTC
+                window_start = window_start.replace(tzinfo=datetime.timezone.utc)
+            window_start -= SEARCH_MARGIN
+        else:
+            window_start = now - datetime.timedelta(days=MAX_SEARCH_DAYS)
+        window_start = max(window_start, now - datetime.timedelta(days=MAX_SEARCH_DAYS))
+
+        summaries = {}
+        continuation_token = None
+        while self.should_continue():
+            result = self.api_client.search_documents(window_start, now, page_size=SEARCH_PAGE_SIZE,
+                                                      continuation_token=continuation_token, direction=DIRECTIONS[table_prefix])
+            self.stats['search_pages'] += 1
+            if result is None:
+                return None
+            for summary in result.get('result', []):
+                if isinstance(summary, dict) and summary.get('uuid') in documents:
+                    summaries[summary['uuid']] = summary
+            continuation_token = result.get('metadata', {}).get('continuationToken')
+            if continuation_token == "EndofResultSet" or not continuation_token or len(summaries) == len(documents):
+                break
+        return summaries
+
+    def _recheck_direction(self, table_prefix, documents):
+        """Returns (changes, unchanged_uuids); documents that could not be resolved are in neither and stay due."""
+        direction = DIRECTIONS[table_prefix]
+        summaries = self._search_statuses(table_prefix, documents)
+        if summaries is None:
+            self.log(f"    -> '{direction}' status search failed. Falling back to detail checks for {len(documents)} documents.")
+            summaries = {}
+
+        changes, unchanged, ambiguous = [], [], []
+        for uuid, (stored_status, _, _, _) in documents.items():
+            summary = summaries.get(uuid)
+            if summary is None or not summary.get('status'):
+                ambiguous.append(uuid)
+            elif summary['status'] != stored_status:
+                changes.append((uuid, summary['status'], summary.get('documentStatusReason') or ''))
+            else:
+                unchanged.append(uuid)
+
+        if ambiguous:
+            detail_budget = max(0, self.max_detail_calls - self.stats['detail_fetches'])
+            deferred = len(ambiguous) - min(len(ambiguous), detail_budget)
+            self.log(f"    -> {len(documents) - len(ambiguous)} '{direction}' statuses read from search, {len(ambiguous)} need a detail check"
+                     + (f" ({deferred} deferred to the next run)." if deferred else "."))
+            self.stats['deferred'] += deferred
+            for uuid, details in self.detail_fetcher.fetch(ambiguous[:detail_budget], self.should_continue):
+                self.stats['detail_fetches'] += 1
+                if not details or not details.get('status'):
+                    continue
+                if details['status'] != documents[uuid][0]:
+                    changes.append((uuid, details['status'], details.get('documentStatusReason') or ''))
+                else:
+                    unchanged.append(uuid)
+        return changes, unchanged
@@ -0,0 +1,129 @@
+# sync_pipeline.py
+import queue
+import threading
+from detail_fetcher import DetailFetcher, DEFAULT_MAX_IN_FLIGHT
+
+DEFAULT_PAGE_QUEUE_SIZE = 2       # Search pages discovered/filtered ahead of the fetcher
+DEFAULT_DOCUMENT_QUEUE_SIZE = 400 # Fetched documents waiting for the writer
+PUT_POLL_INTERVAL = 0.5
+
+# --- Events handed to the consumer ---
+DOCUMENT = "document"   # (DOCUMENT, page, uuid, details); details is None if the fetch failed
+PAGE_DONE = "page_done" # (PAGE_DONE, page, None, None) once every document of the page was handed over
+_END = object()
+
+class _StageError:
+    """Carries an exception from a stage thread to the next stage, which re-raises it."""
+    def __init__(self, error):
+        self.error = error
+
+
+class SyncPipeline:
+    """
+    Streams a sync through bounded queues instead of finishing each stage first:
+
+        discovery -> filter -> detail fetch -> writer (the calling thread)
+
+    Discovery and filtering run one or two pages ahead while the current page's
+    details are fetched, and fetched documents are written while the next ones
+    are in flight. Every queue is bounded, so a slow stage holds the others back
+    and memory stays flat however large the window is.
+
+    `discover()` yields (page, uuids) on its own thread, `select_new(page, uuids)`
+    returns the UUIDs worth fetching on another (give it its own DB connection),
+    and `consume(event, page, uuid, details)` runs on the calling thread. Pages
+    keep their order, and a page's PAGE_DONE comes after all of its documents,
+    so the consumer can commit and checkpoint at page boundaries.
+    """
+    def __init__(self, api_client, max_in_flight=DEFAULT_MAX_IN_FLIGHT, should_continue=None,
+                 page_queue_size=DEFAULT_PAGE_QUEUE_SIZE, document_queue_size=DEFAULT_DOCUMENT_QUEUE_SIZE):
+        self.detail_fetcher = DetailFetcher(api_client, max_in_flight)
+        self.should_continue = should_continue or (lambda: True)
+        self.page_queue_size = page_queue_size
+        self.document_queue_size = document_queue_size
+        self._abort = threading.Event()
+        self.stats = {'pages': 0, 'discovered': 0, 'selected': 0, 'fetched': 0, 'failed': 0}
+
+    def _running(self):
+        return not self._abort.is_set() and self.should_continue()
+
+    def _put(self, target_queue, item):
+        """Blocks while the queue is full (backpressure); gives up once the pipeline is aborted."""
+        while not self._abort.is_set():
+            try:
+                target_queue.put(item, timeout=PUT_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _stage(self, name, work, output_queue):
+        """Runs a stage body; errors are forwarded downstream, and the end marker always follows."""
+        def target():
+            try:
+                work()
+            except Exception as e:
+                self._put(output_queue, _StageError(e))
+            finally:
+                self._put(output_queue, _END)
+        return threading.Thread(target=target, name=f"sync-{name}", daemon=True)
+
+    def run(self, discover, select_new, consume):
+        """Runs the pipeline to completion (or until should_continue() turns False). Returns the stats."""
+        discovered_pages = queue.Queue(self.page_queue_size)
+        selected_pages = queue.Queue(self.page_queue_size)
+        documents = queue.Queue(self.document_queue_size)
+
+        def discovery():
+            for page, uuids in discover():
+                if not self._running(): break
+                self.stats['pages'] += 1
+                self.stats['discovered'] += len(uuids)
+                if not self._put(discovered_pages, (page, uuids)): break
+
+        def filtering():
+            for page, uuids in self._drain(discovered_pages):
+                selected = select_new(page, uuids) if uuids else []
+                self.stats['selected'] += len(selected)
+                if not self._put(selected_pages, (page, selected)): break
+
+        def fetching():
+            for page, uuids in self._drain(selected_pages):
+                for uuid, details in self.detail_fetcher.fetch(uuids, self._running):
+                    self.stats['fetched' if details else 'failed'] += 1
+                    if not self._put(documents, (DOCUMENT, page, uuid, details)): return
+                if not self._running(): return # A page cut short by a stop is not done
+                if not self._put(documents, (PAGE_DONE, page, None, None)): return
+
+        stages = [self._stage("discovery", discovery, discovered_pages),
+                  self._stage("filter", filtering, selected_pages),
+                  self._stage("fetch", fetching, documents)]
+        for stage in stages:
+            stage.start()
+        try:
+            for event, page, uuid, details in self._drain(documents):
+                consume(event, page, uuid, details)
+        finally:
+            # Stop the producers (also when the consumer failed) and let them unwind
+            self._abort.set()
+            for stage in stages:
+                stage.join()
+        return self.stats
+
+    def _drain(self, source_queue):
+        """Yields items until the upstream stage ends or the pipeline is aborted; re-raises an upstream error."""
+        while True:
+            try:
+                item = source_queue.get(timeout=PUT_POLL_INTERVAL)
+            except queue.Empty:
+                if self._abort.is_set(): return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+
+    def pop_error(self, uuid):
+        """(error_class, message) for a document handed over with details=None."""
+        return self.detail_fetcher.pop_error(uuid)
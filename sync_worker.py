@@ -2,9 +2,17 @@
 from threading import Thread
 import datetime
 import pytz
+from detail_fetcher import DEFAULT_MAX_IN_FLIGHT
+from sync_pipeline import SyncPipeline, PAGE_DONE
+from batch_writer import DocumentBatchWriter, merge_newest_doc, DEFAULT_COMMIT_EVERY_DOCS, DEFAULT_COMMIT_EVERY_SECONDS
+from window_planner import WindowPlanner
+from backfill_scheduler import BackfillScheduler, DEFAULT_MAX_PARALLEL_UNITS
+from log_sink import get_log_sink, INFO, WARNING, ERROR
+from uuid_index import open_uuid_indexes, save_uuid_indexes
 
 class SyncWorker(Thread):
-    def __init__(self, client_name, client_id, api_client, db_manager, start_date, end_date, progress_queue):
+    def __init__(self, client_name, client_id, api_client, db_manager, start_date, end_date, progress_queue, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 commit_every_docs=DEFAULT_COMMIT_EVERY_DOCS, commit_every_seconds=DEFAULT_COMMIT_EVERY_SECONDS, max_parallel_units=DEFAULT_MAX_PARALLEL_UNITS):
         super().__init__()
         self.client_id = client_id
         self.client_name = client_name
@@ -13,119 +21,263 @@ class SyncWorker(Thread):
         self.start_date = start_date
         self.end_date = end_date
         self.progress_queue = progress_queue
+        self.log_sink = get_log_sink()
+        self.max_in_flight = max_in_flight
+        self.commit_every_docs = commit_every_docs
+        self.commit_every_seconds = commit_every_seconds
+        self.max_parallel_units = max_parallel_units
+        self.planner = WindowPlanner(api_client, pytz.timezone('Africa/Cairo'))
         self._is_running = True
         self.newest_doc_in_run = {'timestamp': None, 'uuid': None, 'internal_id': None}
         self.skipped_days_in_run = []
         self.failed_uuids_in_run = set()
+        self.uuid_indexes = {} # table_prefix -> UuidIndex shared by all work units
 
     def stop(self):
         self._is_running = False
 
+    def _log(self, message, level=INFO):
+        """Writes straight to the log sink; the UI/CLI pick the line up from there."""
+        self.log_sink.log(message, level, self.client_name)
+
     def run(self):
-        cairo_tz = pytz.timezone('Africa/Cairo')
-        
-        current_local_date = self.end_date 
-        total_days = (self.end_date - self.start_date).days + 1
+        planner = self.planner
+        # The worker owns its db_manager (a clone of the UI's), so it checks out its own pooled connection
+        if not self.db_manager.connect():
+            self._log("DB connection failed. Historical sync stopping.", WARNING)
+            self.progress_queue.put(("HISTORICAL_SYNC_COMPLETE", ([], [], self.client_name)))
+            return
+        try:
+            # Partitioned databases need monthly partitions for the whole backfill range
+            _, created = self.db_manager.ensure_partitions(self.start_date)
+            if created:
+                self._log(f"Created {len(created)} monthly partitions for the sync range.")
+            self.uuid_indexes = open_uuid_indexes(self.client_name, self.db_manager, self._log)
+            self._run_backfill(planner)
+        finally:
+            save_uuid_indexes(self.uuid_indexes)
+            self.db_manager.disconnect()
+
+    def _run_backfill(self, planner):
+
+        # --- Resume support: checkpoints left behind by an interrupted run ---
+        checkpoints = self.db_manager.get_sync_checkpoints(self.client_id)
+        if checkpoints:
+            self._log(f"Found {len(checkpoints)} checkpoints from a previous run. Resuming where it stopped.")
+
+        # --- Plan adaptive search windows instead of querying every day ---
+        directions_to_sync = [("Received", ""), ("Sent", "sent_")]
+        work_units = []
+        for direction, table_prefix in directions_to_sync:
+            if not self._is_running: break
+            self._log(f"Planning '{direction}' search windows from {self.start_date} to {self.end_date}...")
+            windows = self._plan_direction(planner, direction, checkpoints)
+            work_units.extend(
+                (window_start, window_end, direction, table_prefix, checkpoints.get((window_start, direction), {}))
+                for window_start, window_end in windows
+            )
+            self._log(f"  -> {len(windows)} '{direction}' windows contain documents.")
+        self._log(f"Planning used {planner.probe_count} probe searches.")
+
+        # Newest windows first, as the day-by-day walk did
+        work_units.sort(key=lambda unit: unit[0], reverse=True)
+        total_days = sum((window_end - window_start).days + 1 for window_start, window_end, _, _, _ in work_units)
         processed_days = 0
 
-        while current_local_date >= self.start_date and self._is_running:
-            day_start_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.min))
-            day_end_local = cairo_tz.localize(datetime.datetime.combine(current_local_date, datetime.time.max))
-            self.progress_queue.put(("LOG", f"Processing Day: {current_local_date.strftime('%Y-%m-%d')}..."))
-            
-            day_had_api_failure = False
-            directions_to_sync = [("Received", ""), ("Sent", "sent_")]
-            
-            for direction, table_prefix in directions_to_sync:
-                if not self._is_running: break
-                
-                try:
-                    # --- Step 1: Discover ALL document summaries for the day/direction ---
-                    all_summaries = []
-                    continuation_token = None
-                    while True:
-                        if not self._is_running: break
-                        search_result = self.api_client.search_documents(day_start_local, day_end_local, continuation_token=continuation_token, direction=direction)
-                        
-                        if search_result is None:
-                            day_had_api_failure = True; break
-                        
-                        all_summaries.extend(search_result.get('result', []))
-                        continuation_token = search_result.get('metadata', {}).get('continuationToken')
-                        if continuation_token == "EndofResultSet" or not continuation_token: break
-                    
-                    if day_had_api_failure: continue # Move to the next direction if discovery failed
-
-                    # --- Step 2: Pre-filter against the database ---
-                    all_discovered_uuids = [s['uuid'] for s in all_summaries if isinstance(s, dict) and 'uuid' in s]
-                    uuids_to_process = self.db_manager.filter_existing_uuids(all_discovered_uuids, table_prefix)
-                    
-                    if not uuids_to_process:
-                        if all_discovered_uuids: self.progress_queue.put(("LOG", f"  -> All {len(all_discovered_uuids)} discovered '{direction}' documents already exist."))
-                        continue # Nothing to do, move to the next direction
-
-                    summaries_to_process = {s['uuid']: s for s in all_summaries if s['uuid'] in uuids_to_process}
-                    total_to_process = len(uuids_to_process)
-                    self.progress_queue.put(("LOG", f"  -> Discovered {len(all_discovered_uuids)} '{direction}' documents, {total_to_process} are new. Fetching and batching..."))
-                    
-                    # --- Step 3: Process the new documents in a single batch ---
-                    with self.db_manager.conn.cursor() as cur:
-                        for i, uuid in enumerate(uuids_to_process):
-                            if not self._is_running: raise InterruptedError("Sync cancelled.")
-                            
-                            details = self.api_client.get_document_details(uuid)
-                            if details:
-                                success = self.db_manager.insert_document(cur, details, table_prefix)
-                                if success:
-                                    self.progress_queue.put(("LOG", f"    -> Batched doc {i+1}/{total_to_process} (UUID: {uuid[:8]}...)"))
-                                    # (The logic to track the newest doc is the same)
-                                    doc_ts_str = details.get('dateTimeReceived') or details.get('dateTimeRecevied')
-                                    if doc_ts_str:
-                                        if '.' in doc_ts_str and len(doc_ts_str.split('.')[1]) > 7:
-                                            doc_ts_str = doc_ts_str[:26] + "Z"
-                                        doc_dt = None
-                                        for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-                                            try:
-                                                doc_dt = datetime.datetime.strptime(doc_ts_str, fmt)
-                                                break
-                                            except ValueError: continue
-                                    
-                                        if doc_dt and (self.newest_doc_in_run['timestamp'] is None or doc_dt > self.newest_doc_in_run['timestamp']):
-                                            self.newest_doc_in_run['timestamp'] = doc_dt
-                                            self.newest_doc_in_run['uuid'] = details.get('uuid')
-                                            self.newest_doc_in_run['internal_id'] = details.get('internalID') or details.get('document', {}).get('internalId')
-                                        pass
-                                else:
-                                    self.progress_queue.put(("LOG", f"DB_FAIL on doc {uuid[:8]}: Skipping doc in batch."))
-                            else:
-                                self.progress_queue.put(("LOG", f"API_FAIL on doc {uuid[:8]}: Adding to retry queue."))
-                                self.failed_uuids_in_run.add(uuid)
-                    
-                    self.db_manager.conn.commit()
-                    self.progress_queue.put(("LOG", f"  -> Batch of {total_to_process} new '{direction}' documents committed."))
-
-                except InterruptedError:
-                    self.progress_queue.put(("LOG", "  -> Batch cancelled. Rolling back changes."))
-                    self.db_manager.conn.rollback()
-                except Exception as e:
-                    self.progress_queue.put(("LOG", f"CRITICAL ERROR on {current_local_date.strftime('%Y-%m-%d')} for {direction} docs: {e}"))
-                    self.db_manager.conn.rollback()
-                    day_had_api_failure = True
-            
-            if day_had_api_failure:
-                self.skipped_days_in_run.append(current_local_date.strftime('%Y-%m-%d'))
-
-            processed_days += 1
+        # --- Run the windows in parallel, each pool thread on its own DB connection ---
+        scheduler = BackfillScheduler(self.db_manager, self.max_parallel_units)
+        for unit, result in scheduler.run(work_units, self._run_unit, lambda: self._is_running):
+            window_start, window_end, direction, _, _ = unit
+            window_days = (window_end - window_start).days + 1
+            if isinstance(result, Exception):
+                self._log(f"CRITICAL ERROR on {self._window_label(window_start, window_end)} for {direction} docs: {result}", ERROR)
+                result = {'ok': False, 'newest_doc': {'timestamp': None}, 'failed_uuids': set()}
+
+            # --- Merge the unit's bookkeeping into the run (single-threaded, so no locking needed) ---
+            merge_newest_doc(self.newest_doc_in_run, result['newest_doc'])
+            self.failed_uuids_in_run.update(result['failed_uuids'])
+            if not result['ok']:
+                for offset in range(window_days):
+                    day_str = (window_start + datetime.timedelta(days=offset)).strftime('%Y-%m-%d')
+                    if day_str not in self.skipped_days_in_run:
+                        self.skipped_days_in_run.append(day_str)
+
+            processed_days += window_days
             progress_percent = (processed_days / total_days) if total_days > 0 else 1
             self.progress_queue.put(("PROGRESS", progress_percent))
-            current_local_date -= datetime.timedelta(days=1)
+        self.skipped_days_in_run.sort(reverse=True)
+
+        if self._is_running and not work_units:
+            self.progress_queue.put(("PROGRESS", 1))
         
-        if self._is_running and self.newest_doc_in_run['timestamp']:
-            self.db_manager.update_sync_status(
-                self.api_client.client_id, 
-                self.newest_doc_in_run['timestamp'], 
-                self.newest_doc_in_run['uuid'], 
-                self.newest_doc_in_run['internal_id']
-            )
+        if self._is_running:
+            if self.newest_doc_in_run['timestamp']:
+                self.db_manager.update_sync_status(
+                    self.api_client.client_id, 
+                    self.newest_doc_in_run['timestamp'], 
+                    self.newest_doc_in_run['uuid'], 
+                    self.newest_doc_in_run['internal_id']
+                )
+            # The run reached the end, so there is nothing left to resume
+            self.db_manager.clear_sync_checkpoints(self.client_id)
         
-        self.progress_queue.put(("HISTORICAL_SYNC_COMPLETE", (self.skipped_days_in_run, list(self.failed_uuids_in_run), self.client_name)))
\ No newline at end of file
+        self.progress_queue.put(("HISTORICAL_SYNC_COMPLETE", (self.skipped_days_in_run, list(self.failed_uuids_in_run), self.client_name)))
+
+    def _plan_direction(self, planner, direction, checkpoints):
+        """
+        Plans the windows for one direction. Windows of unfinished checkpoints are
+        reused as-is so their continuation tokens stay valid; completed ones are
+        skipped; only the remaining gaps are probed.
+        """
+        windows = []
+        covered = []
+        for (sync_day, cp_direction), checkpoint in checkpoints.items():
+            if cp_direction != direction: continue
+            if checkpoint['window_end'] < self.start_date or sync_day > self.end_date: continue
+            covered.append((sync_day, checkpoint['window_end']))
+            if not checkpoint.get('completed'):
+                windows.append((sync_day, checkpoint['window_end']))
+
+        gap_start = self.start_date
+        for covered_start, covered_end in sorted(covered):
+            if covered_start > gap_start:
+                windows.extend(planner.plan(gap_start, min(covered_start - datetime.timedelta(days=1), self.end_date), direction, lambda: self._is_running))
+            gap_start = max(gap_start, covered_end + datetime.timedelta(days=1))
+        if gap_start <= self.end_date:
+            windows.extend(planner.plan(gap_start, self.end_date, direction, lambda: self._is_running))
+        return windows
+
+    @staticmethod
+    def _window_label(window_start, window_end):
+        if window_start == window_end:
+            return window_start.strftime('%Y-%m-%d')
+        return f"{window_start.strftime('%Y-%m-%d')} to {window_end.strftime('%Y-%m-%d')}"
+
+    def _run_unit(self, unit, db_manager):
+        """
+        Runs one work unit on a scheduler thread and returns its own bookkeeping
+        (ok flag, newest committed doc, failed UUIDs) for the run to merge.
+        """
+        window_start, window_end, direction, table_prefix, checkpoint = unit
+        self._log(f"Processing {direction} window: {self._window_label(window_start, window_end)}...")
+        result = {
+            'ok': False,
+            'newest_doc': {'timestamp': None, 'uuid': None, 'internal_id': None},
+            'failed_uuids': set(checkpoint.get('failed_uuids', [])),
+        }
+        try:
+            result['ok'] = self._sync_window(db_manager, window_start, window_end, direction, table_prefix, checkpoint, result)
+        except Exception as e:
+            self._log(f"CRITICAL ERROR on {self._window_label(window_start, window_end)} for {direction} docs: {e}", ERROR)
+            db_manager.conn.rollback()
+        return result
+
+    def _sync_window(self, db_manager, window_start, window_end, direction, table_prefix, checkpoint, result):
+        """
+        Discovers, fetches and writes one search window/direction as a SyncPipeline:
+        the next pages are searched and filtered while the current page's details are
+        fetched and written, committing in chunks. Every commit also stores a checkpoint
+        (continuation token, processed and failed UUIDs), so an interrupted run resumes
+        from the last committed chunk.
+        Returns False if discovery failed and the window's days should be retried later.
+        """
+        window_start_local, window_end_local = self.planner.window_bounds(window_start, window_end)
+        processed_uuids = set(checkpoint.get('processed_uuids', []))
+        if checkpoint.get('continuation_token') is not None or processed_uuids:
+            self._log(f"  -> Resuming '{direction}' ({len(processed_uuids)} documents already committed).")
+
+        writer = DocumentBatchWriter(db_manager, table_prefix, commit_every_docs=self.commit_every_docs, commit_every_seconds=self.commit_every_seconds,
+                                     uuid_index=self.uuid_indexes.get(table_prefix))
+        pipeline = SyncPipeline(self.api_client, self.max_in_flight, lambda: self._is_running)
+        pending_failed = [] # (uuid, direction, error_class, message) since the last commit
+        state = {'token': checkpoint.get('continuation_token'), 'discovery_failed': False}
+
+        def checkpoint_writer(token, completed=False):
+            def save(cur, committed_uuids):
+                db_manager.save_sync_checkpoint(cur, self.client_id, window_start, window_end, direction, token, committed_uuids,
+                                                [failure[0] for failure in pending_failed], completed)
+                # Failed documents enter the durable retry queue together with the chunk they belong to
+                db_manager.record_retry_failures(pending_failed, cur)
+                result['failed_uuids'].update(failure[0] for failure in pending_failed)
+                pending_failed.clear()
+            return save
+
+        # --- Stage 1: Discover pages of summaries (pages are (token used, next token, is last)) ---
+        def discover():
+            continuation_token = state['token']
+            resuming_from_token = continuation_token is not None
+            while True:
+                search_result = self.api_client.search_documents(window_start_local, window_end_local, continuation_token=continuation_token, direction=direction)
+                if search_result is None:
+                    state['discovery_failed'] = True
+                    return
+
+                page = [s for s in search_result.get('result', []) if isinstance(s, dict) and 'uuid' in s]
+                if not page and resuming_from_token:
+                    # The stored token may have expired; rediscover the day and rely on processed_uuids to skip work.
+                    self._log(f"  -> Saved continuation token returned nothing. Rediscovering the '{direction}' window from the first page.")
+                    continuation_token = None
+                    resuming_from_token = False
+                    continue
+                resuming_from_token = False
+
+                next_token = search_result.get('metadata', {}).get('continuationToken')
+                is_last_page = next_token == "EndofResultSet" or not next_token
+                yield (continuation_token, None if is_last_page else next_token, is_last_page), [s['uuid'] for s in page]
+                if is_last_page: return
+                continuation_token = next_token
+
+        # --- Stage 2: Pre-filter against the checkpoint and the database (on its own connection) ---
+        filter_db_manager = db_manager.clone()
+        def select_new(page, page_uuids):
+            uuids_to_process = self.uuid_indexes[table_prefix].filter_new(filter_db_manager, [uuid for uuid in page_uuids if uuid not in processed_uuids])
+            if uuids_to_process:
+                self._log(f"  -> Discovered {len(page_uuids)} '{direction}' documents on this page, {len(uuids_to_process)} are new. Fetching and batching...")
+            return uuids_to_process
+
+        # --- Stage 4: Write fetched details in committed chunks (stage 3, the concurrent fetch, runs inside the pipeline) ---
+        def consume(event, page, uuid, details):
+            page_token, next_token, is_last_page = page
+            if event == PAGE_DONE:
+                # Page boundary: commit and move the checkpoint to the next page
+                state['token'] = next_token
+                writer.commit(checkpoint_writer(next_token, completed=is_last_page))
+                return
+            if details:
+                writer.add(details)
+                self._log(f"    -> Batched doc (UUID: {uuid[:8]}...)")
+            else:
+                self._log(f"API_FAIL on doc {uuid[:8]}: Adding to retry queue.", WARNING)
+                pending_failed.append((uuid, direction, *pipeline.pop_error(uuid)))
+            # Mid-page commits keep the current page's token; processed_uuids cover the partial page
+            if writer.commit_if_due(checkpoint_writer(page_token)):
+                self._log(f"  -> Checkpoint: {writer.written_count} '{direction}' documents committed so far.")
+
+        if not filter_db_manager.connect():
+            raise RuntimeError("No database connection for the discovery filter.")
+        try:
+            pipeline.run(discover, select_new, consume)
+            if not self._is_running:
+                # Everything fetched so far is complete, so keep it and checkpoint instead of rolling back
+                writer.commit(checkpoint_writer(state['token']))
+                self._log(f"  -> Sync cancelled. {writer.written_count} '{direction}' documents committed and checkpointed.")
+                return True
+            if state['discovery_failed']:
+                writer.commit(checkpoint_writer(state['token']))
+                return False
+        except Exception:
+            # The chunk is rolled back (and rediscovered on resume), but its fetch failures must still be queued
+            writer.rollback()
+            if pending_failed and db_manager.record_retry_failures(pending_failed) is not None:
+                result['failed_uuids'].update(failure[0] for failure in pending_failed)
+            raise
+        finally:
+            filter_db_manager.disconnect()
+            merge_newest_doc(result['newest_doc'], writer.newest_doc)
+
+        discovered_count, new_count = pipeline.stats['discovered'], pipeline.stats['selected']
+        if new_count == 0 and discovered_count:
+            self._log(f"  -> All {discovered_count} discovered '{direction}' documents already exist.")
+        elif new_count:
+            self._log(f"  -> Batch of {writer.written_count} new '{direction}' documents committed.")
+        return True
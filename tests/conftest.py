@@ -0,0 +1,34 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def postgres_db():
+    """
+    A throwaway database on the server named by the standard PG* environment
+    variables (PGHOST, PGPORT, PGUSER, PGPASSWORD). Skipped when none are set.
+    Yields the DatabaseManager connection parameters.
+    """
+    if not any(name.startswith("PG") for name in os.environ):
+        pytest.skip("No PG* environment variables set; Postgres tests need a server.")
+    psycopg2 = pytest.importorskip("psycopg2")
+    from db_pool import close_all_pools
+
+    db_name = f"eta_test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(dbname=os.environ.get("PGDATABASE", "postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'CREATE DATABASE "{db_name}";')
+    try:
+        yield {'dbname': db_name}
+    finally:
+        close_all_pools()
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{db_name}" WITH (FORCE);')
+        admin.close()
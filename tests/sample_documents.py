@@ -0,0 +1,69 @@
+"""ETA document-details payloads shaped like the API's responses, for the mapping and database tests."""
+import json
+
+
+def details_payload(uuid="DOC0001", received="2023-05-10T08:15:00Z", issued="2023-05-09T22:00:00Z", status="Valid",
+                    document_as_string=True, total="1140.00"):
+    """One received invoice with an EGP line and a USD line; the signed document is string-encoded by default."""
+    document = {
+        "issuer": {
+            "id": "100200300", "name": "Supplier Co", "type": "B",
+            "address": {"branchID": "0", "country": "EG", "governate": "Cairo", "regionCity": "Nasr City",
+                        "street": "Makram Ebeid", "buildingNumber": "12", "floor": "3"},
+        },
+        "receiver": {
+            "id": "400500600", "name": "Customer LLC", "type": "B",
+            "address": {"country": "EG", "governate": "Giza", "regionCity": "Dokki", "street": "Tahrir", "buildingNumber": "7"},
+        },
+        "documentType": "I",
+        "documentTypeVersion": "1.0",
+        "dateTimeIssued": issued,
+        "internalID": "INV-2023-0001",
+        "totalSalesAmount": 1000.0,
+        "totalDiscountAmount": 0,
+        "netAmount": 1000.0,
+        "totalAmount": 1140.0,
+        "taxTotals": [{"taxType": "T1", "amount": 140.0}],
+        "invoiceLines": [
+            {
+                "description": "Steel bars", "itemType": "EGS", "itemCode": "EG-100200300-1", "unitType": "KGM",
+                "quantity": 10, "internalCode": "SB-1",
+                "unitValue": {"currencySold": "EGP", "amountEGP": 50.0},
+                "salesTotal": 500.0, "netTotal": 500.0, "total": 570.0, "itemsDiscount": 0, "valueDifference": 0,
+                "totalTaxableFees": 0,
+                "taxableItems": [{"taxType": "T1", "amount": 70.0, "subType": "V009", "rate": 14}],
+            },
+            {
+                "description": "Consulting", "itemType": "EGS", "itemCode": "EG-100200300-2", "unitType": "EA",
+                "quantity": 1, "internalCode": "CS-1",
+                "unitValue": {"currencySold": "USD", "amountSold": 10.0, "amountEGP": 500.0, "currencyExchangeRate": 50.0},
+                "salesTotal": 500.0, "netTotal": 500.0, "total": 570.0, "itemsDiscount": 0, "valueDifference": 0,
+                "totalTaxableFees": 0, "discount": {"rate": 0, "amount": 0},
+                "taxableItems": [{"taxType": "T1", "amount": 70.0, "subType": "V009", "rate": 14}],
+            },
+        ],
+        "signatures": [{"signatureType": "I", "value": "MIIB"}],
+    }
+    payload = {
+        "uuid": uuid,
+        "submissionUUID": "SUB0001",
+        "longId": f"LONG{uuid}",
+        "internalId": "INV-2023-0001",
+        "typeName": "I",
+        "documentTypeNamePrimaryLang": "Invoice",
+        "dateTimeIssued": issued,
+        "dateTimeReceived": received,
+        "status": status,
+        "documentStatusReason": None,
+        "canbeCancelledUntil": "2023-05-17T08:15:00Z",
+        "canbeRejectedUntil": "2023-05-17T08:15:00Z",
+        "totalSales": 1000.0,
+        "totalDiscount": 0,
+        "netAmount": 1000.0,
+        "total": total,
+        "validationResults": {"status": "Valid"},
+        "document": json.dumps(document) if document_as_string else document,
+    }
+    if received is None:
+        del payload["dateTimeReceived"]
+    return payload
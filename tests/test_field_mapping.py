@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from field_mapping import HEADER_COLUMNS, LINE_COLUMNS, header_row, line_rows, core_document
+from sample_documents import details_payload
+
+
+def _header(payload):
+    return dict(zip(HEADER_COLUMNS, header_row(payload)))
+
+def _lines(payload):
+    return [dict(zip(LINE_COLUMNS, row)) for row in line_rows(payload)]
+
+
+def test_header_from_string_encoded_document():
+    payload = details_payload("DOC0001")
+    assert isinstance(payload["document"], str)
+    header = _header(payload)
+    assert header["uuid"] == "DOC0001"
+    assert header["internal_id"] == "INV-2023-0001"
+    assert header["document_type"] == "I"
+    assert header["date_time_issued"] == "2023-05-09T22:00:00Z"
+    assert header["date_time_received"] == "2023-05-10T08:15:00Z"
+    assert header["status"] == "Valid"
+    assert header["validation_status"] == "Valid"
+    assert header["document_lines_total_count"] == 2
+    assert header["signatures"] == '[{"signatureType": "I", "value": "MIIB"}]'
+
+
+def test_string_and_object_documents_map_identically():
+    assert header_row(details_payload(document_as_string=True)) == header_row(details_payload(document_as_string=False))
+    assert line_rows(details_payload(document_as_string=True)) == line_rows(details_payload(document_as_string=False))
+
+
+def test_addresses_and_taxes():
+    header = _header(details_payload())
+    assert (header["issuer_id"], header["issuer_name"], header["issuer_address_branch_id"]) == ("100200300", "Supplier Co", "0")
+    assert (header["issuer_address_governate"], header["issuer_address_street"], header["issuer_address_floor"]) == ("Cairo", "Makram Ebeid", "3")
+    assert (header["receiver_address_region_city"], header["receiver_address_building_number"]) == ("Dokki", "7")
+    assert header["receiver_address_room"] is None
+    assert (header["tax1_type"], header["tax1_amount"]) == ("T1", 140.0)
+    assert header["tax2_type"] is None and header["tax2_amount"] is None
+
+    lines = _lines(details_payload())
+    assert [(line["tax1_type"], line["tax1_amount"]) for line in lines] == [("T1", 70.0), ("T1", 70.0)]
+
+
+def test_line_keys_and_foreign_amount_fallback():
+    egp_line, usd_line = _lines(details_payload("DOC0001"))
+    assert (egp_line["custom_uuid"], usd_line["custom_uuid"]) == ("DOC0001-1", "DOC0001-2")
+    assert egp_line["document_uuid"] == "DOC0001"
+    assert egp_line["document_date_time_received"] == "2023-05-10T08:15:00Z"
+
+    # EGP lines have no foreign amounts
+    assert egp_line["total_foreign"] is None and egp_line["sales_total_foreign"] is None
+    # The USD line has no *Foreign values, so they are derived from the EGP amounts and the exchange rate
+    assert usd_line["unit_value_currency_sold"] == "USD"
+    assert usd_line["total_foreign"] == Decimal("11.4")
+    assert usd_line["net_total_foreign"] == Decimal("10")
+    assert usd_line["discount_amount"] == 0
+
+
+def test_foreign_amount_from_the_api_wins():
+    payload = details_payload(document_as_string=False)
+    payload["document"]["invoiceLines"][1]["totalForeign"] = 11.0
+    assert _lines(payload)[1]["total_foreign"] == 11.0
+
+
+def test_malformed_document_string_maps_payload_fields_only():
+    payload = details_payload()
+    payload["document"] = "{not json"
+    assert core_document(payload) == {}
+    header = _header(payload)
+    assert header["uuid"] == "DOC0001" and header["issuer_name"] is None
+    assert line_rows(payload) == []
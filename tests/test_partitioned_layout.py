@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from db_manager import DatabaseManager, WRITE_MODE_UPSERT, DEFAULT_PARTITION_MONTHS_AHEAD, _add_months, _month_start
+from sample_documents import details_payload
+
+
+def _write(db, docs, table_prefix=""):
+    with db.conn.cursor() as cur:
+        written = db.insert_documents(cur, docs, table_prefix, mode=WRITE_MODE_UPSERT)
+    db.conn.commit()
+    return written
+
+def _query(db, sql, params=None):
+    with db.conn.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    db.conn.rollback()
+    return rows
+
+def _partitions(db, parent_table):
+    return {name for (name,) in _query(db, "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                                            "WHERE i.inhparent = to_regclass(%s);", (parent_table,))}
+
+
+@pytest.fixture
+def partitioned_db(postgres_db):
+    db = DatabaseManager(postgres_db)
+    assert db.connect()
+    ok, message = db.check_and_create_tables(partitioned=True)
+    assert ok, message
+    yield db
+    db.disconnect()
+
+
+def test_create_partitioned_layout(partitioned_db):
+    assert partitioned_db.is_partitioned() is True
+    this_month = _month_start(datetime.datetime.now())
+    expected = {f"documents_p{_add_months(this_month, n).strftime('%Y%m')}" for n in range(DEFAULT_PARTITION_MONTHS_AHEAD + 1)}
+    assert expected | {"documents_default"} <= _partitions(partitioned_db, "documents")
+    assert "sent_document_lines_default" in _partitions(partitioned_db, "sent_document_lines")
+
+
+def test_ensure_partitions_moves_rows_out_of_default(partitioned_db):
+    _write(partitioned_db, [details_payload("OLD1", received="2021-03-04T10:00:00Z")])
+    assert _query(partitioned_db, "SELECT uuid FROM documents_default;") == [("OLD1",)]
+
+    ok, created = partitioned_db.ensure_partitions(from_date=datetime.date(2021, 3, 1))
+    assert ok
+    assert {"documents_p202103", "document_lines_p202103"} <= set(created)
+    assert _query(partitioned_db, "SELECT uuid FROM documents_p202103;") == [("OLD1",)]
+    assert _query(partitioned_db, "SELECT COUNT(*) FROM document_lines_p202103;") == [(2,)]
+    assert _query(partitioned_db, "SELECT COUNT(*) FROM documents_default;") == [(0,)]
+    assert _query(partitioned_db, "SELECT COUNT(*) FROM document_lines_default;") == [(0,)]
+
+    # Already there: nothing to create the second time
+    assert partitioned_db.ensure_partitions(from_date=datetime.date(2021, 3, 1)) == (True, [])
+
+
+def test_upsert_on_uuid_and_receipt_time(partitioned_db):
+    received = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    _write(partitioned_db, [details_payload("UPS1", received=received, total="100")])
+    _write(partitioned_db, [details_payload("UPS1", received=received, total="250")])
+    assert _query(partitioned_db, "SELECT COUNT(*), MAX(total_amount) FROM documents WHERE uuid = 'UPS1';") == [(1, 250)]
+    assert _query(partitioned_db, "SELECT COUNT(*) FROM document_lines WHERE document_uuid = 'UPS1';") == [(2,)]
+    assert _query(partitioned_db, "SELECT COUNT(*) FROM unified_financial_ledger WHERE document_uuid = 'UPS1';") == [(2,)]
+
+
+def test_missing_receipt_time_is_keyed_by_issue_time(partitioned_db):
+    docs = [details_payload("NORCV", received=None, issued="2023-05-09T22:00:00Z"), details_payload("OK1")]
+    assert _write(partitioned_db, docs) == 2
+    assert _write(partitioned_db, docs) == 2 # Stable key: the re-upsert updates instead of duplicating
+    assert _query(partitioned_db, "SELECT date_time_received FROM documents WHERE uuid = 'NORCV';") == [(datetime.datetime(2023, 5, 9, 22, 0),)]
+    assert _query(partitioned_db, "SELECT DISTINCT document_date_time_received FROM document_lines WHERE document_uuid = 'NORCV';") == [(datetime.datetime(2023, 5, 9, 22, 0),)]
+
+
+def test_migrate_flat_tables_to_partitions(postgres_db):
+    db = DatabaseManager(postgres_db)
+    assert db.connect()
+    try:
+        assert db.check_and_create_tables(partitioned=False)[0]
+        assert db.ensure_indexes()[0]
+        _write(db, [details_payload("M1", received="2022-11-20T09:00:00Z"), details_payload("M2", received="2023-01-02T09:00:00Z")])
+        _write(db, [details_payload("S1", received="2023-02-03T09:00:00Z")], "sent_")
+        with db.conn.cursor() as cur: # A legacy row without a receipt time
+            cur.execute("UPDATE documents SET date_time_received = NULL WHERE uuid = 'M2';")
+        db.conn.commit()
+        assert db.is_partitioned() is False
+
+        ok, message = db.migrate_to_partitioned()
+        assert ok, message
+        assert db.is_partitioned() is True
+        assert _query(db, "SELECT uuid FROM documents ORDER BY uuid;") == [("M1",), ("M2",)]
+        assert _query(db, "SELECT uuid FROM sent_documents;") == [("S1",)]
+        assert _query(db, "SELECT uuid FROM documents_p202211;") == [("M1",)]
+        assert _query(db, "SELECT COUNT(*) FROM document_lines WHERE document_date_time_received IS NULL;") == [(0,)]
+        assert _query(db, "SELECT COUNT(*) FROM sent_document_lines_p202302;") == [(2,)]
+        assert _query(db, "SELECT to_regclass('documents_flat');") == [(None,)]
+        assert _query(db, "SELECT COUNT(*) FROM vw_unified_financial_ledger;") == [(6,)]
+        assert db.get_index_report()['missing'] == []
+
+        # Writes keep working after the migration, including new line ids
+        _write(db, [details_payload("M3", received="2022-11-21T09:00:00Z")])
+        assert _query(db, "SELECT COUNT(*) FROM document_lines;") == [(6,)]
+
+        # The legacy row got the writer's key, so syncing it again updates it instead of adding a copy
+        _write(db, [details_payload("M2", received=None)])
+        assert _query(db, "SELECT COUNT(*) FROM documents WHERE uuid = 'M2';") == [(1,)]
+        assert _query(db, "SELECT COUNT(*) FROM document_lines WHERE document_uuid = 'M2';") == [(2,)]
+        assert _query(db, "SELECT COUNT(*) FROM unified_financial_ledger WHERE document_uuid = 'M2';") == [(2,)]
+    finally:
+        db.disconnect()
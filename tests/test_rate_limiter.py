@@ -0,0 +1,78 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket, RateLimiter, parse_retry_after, INCREASE_AFTER_SUCCESSES, INCREASE_STEP
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freezes time.monotonic() for the limiter; advance with clock['now'] += seconds."""
+    state = {'now': 1000.0}
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: state['now'])
+    return state
+
+
+def test_burst_then_spaced_at_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert [bucket.reserve() for _ in range(2)] == [0.5, 1.0] # Reservations queue up behind each other
+    clock['now'] += 1.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_throttling_halves_the_rate_and_honours_retry_after(clock):
+    bucket = TokenBucket(rate=4.0, capacity=8, min_rate=0.75, max_rate=5.0)
+    bucket.record_throttled(retry_after=10)
+    assert bucket.rate == 2.0
+    assert bucket.reserve() == pytest.approx(10.0) # Paused, even though the drained bucket refills sooner
+    clock['now'] += 10
+    bucket.record_throttled()
+    assert bucket.rate == 1.0
+    clock['now'] += 1
+    bucket.record_throttled()
+    assert bucket.rate == 0.75 # Never below min_rate
+
+
+def test_simultaneous_429s_halve_the_rate_once(clock):
+    bucket = TokenBucket(rate=4.0, capacity=8, min_rate=0.1, max_rate=5.0)
+    bucket.record_throttled()
+    bucket.record_throttled() # Another request that was in flight during the same event
+    assert bucket.rate == 2.0
+    clock['now'] += 0.4 # Still within one interval at the new rate (0.5s)
+    bucket.record_throttled()
+    assert bucket.rate == 2.0
+    clock['now'] += 0.1
+    bucket.record_throttled()
+    assert bucket.rate == 1.0
+
+
+def test_rate_recovers_additively_up_to_max(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1, min_rate=0.5, max_rate=1.15)
+    for _ in range(INCREASE_AFTER_SUCCESSES - 1):
+        bucket.record_success()
+    assert bucket.rate == 1.0
+    bucket.record_success()
+    assert bucket.rate == pytest.approx(1.0 + INCREASE_STEP)
+    for _ in range(INCREASE_AFTER_SUCCESSES):
+        bucket.record_success()
+    assert bucket.rate == 1.15
+
+
+def test_credential_budget_applies_on_top_of_the_endpoint(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", slept.append)
+    limiter = RateLimiter(endpoint_budgets={'details': {'rate': 10.0, 'capacity': 10, 'min_rate': 1.0}},
+                          credential_budgets={'details': {'rate': 1.0, 'capacity': 1, 'min_rate': 0.1}})
+    assert limiter.acquire('details', 'client-a') == 0
+    assert limiter.acquire('details', 'client-a') == 1.0 # The client's own bucket is empty
+    assert limiter.acquire('details', 'client-b') == 0   # Another client only shares the endpoint bucket
+    assert slept == [1.0]
+    limiter.record_throttled('details', 'client-b')
+    rates = limiter.current_rates()
+    assert rates[('endpoint', 'details')] == 5.0 and rates[('credential', 'client-b', 'details')] == 0.5
+    assert rates[('credential', 'client-a', 'details')] == 1.0 # Other clients keep their own rate
+
+
+@pytest.mark.parametrize("value, expected", [("7", 7.0), ("0.5", 0.5), ("-3", 0.0), (None, 3.0), ("Wed, 21 Oct 2015 07:28:00 GMT", 3.0)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from db_manager import DatabaseManager, WRITE_MODE_UPSERT
+from sample_documents import details_payload
+
+
+def _query(db, sql, params=None):
+    with db.conn.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    db.conn.rollback()
+    return rows
+
+
+@pytest.fixture
+def archived_db(postgres_db):
+    db = DatabaseManager(postgres_db)
+    assert db.connect()
+    assert db.check_and_create_tables()[0]
+    assert db.enable_raw_payload_archive()[0]
+    yield db
+    db.disconnect()
+
+
+def test_remap_restores_mapped_columns_but_keeps_status_and_archive(archived_db):
+    db = archived_db
+    with db.conn.cursor() as cur:
+        db.insert_documents(cur, [details_payload("ARC1"), details_payload("ARC2")], mode=WRITE_MODE_UPSERT)
+    db.conn.commit()
+    assert db.update_document_statuses([("ARC1", "Cancelled", "Duplicate")]) == 1
+    with db.conn.cursor() as cur: # Simulate a column the old mapping left empty
+        cur.execute("UPDATE documents SET issuer_name = NULL;")
+    db.conn.commit()
+    archived_before = _query(db, "SELECT uuid, md5(raw_payload) FROM documents ORDER BY uuid;")
+
+    ok, message = db.remap_archived_documents(batch_size=1)
+    assert ok, message
+    assert _query(db, "SELECT uuid, status, document_status_reason, issuer_name FROM documents ORDER BY uuid;") == [
+        ("ARC1", "Cancelled", "Duplicate", "Supplier Co"),
+        ("ARC2", "Valid", None, "Supplier Co"),
+    ]
+    assert _query(db, "SELECT DISTINCT document_status FROM unified_financial_ledger WHERE document_uuid = 'ARC1';") == [("Cancelled",)]
+    assert _query(db, "SELECT COUNT(*) FROM document_lines;") == [(4,)]
+    assert _query(db, "SELECT uuid, md5(raw_payload) FROM documents ORDER BY uuid;") == archived_before
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from db_manager import DatabaseManager, RETRY_MAX_ATTEMPTS
+
+
+@pytest.fixture
+def queue_db(postgres_db):
+    db = DatabaseManager(postgres_db)
+    assert db.connect()
+    assert db.check_and_create_tables()[0]
+    yield db
+    db.disconnect()
+
+
+def test_dead_letters_are_counted_once(queue_db):
+    failure = [("Q1", "Received", "timeout", "read timed out")]
+    counts = [queue_db.record_retry_failures(failure) for _ in range(RETRY_MAX_ATTEMPTS + 2)]
+    assert counts == [0] * (RETRY_MAX_ATTEMPTS - 1) + [1, 0, 0]
+    assert queue_db.get_retry_queue_counts() == {'pending': 0, 'eligible': 0, 'dead_lettered': 1}
+
+    assert queue_db.requeue_dead_letters() == 1
+    counts = [queue_db.record_retry_failures(failure) for _ in range(RETRY_MAX_ATTEMPTS)]
+    assert counts[-1] == 1 and sum(counts) == 1
+
+
+def test_dead_letter_time_is_kept(queue_db):
+    failure = [("Q2", None, "http_500", "")]
+    for _ in range(RETRY_MAX_ATTEMPTS):
+        queue_db.record_retry_failures(failure)
+    with queue_db.conn.cursor() as cur:
+        cur.execute("UPDATE retry_queue SET dead_lettered_at = '2020-01-01' WHERE uuid = 'Q2';")
+    queue_db.conn.commit()
+    queue_db.record_retry_failures(failure)
+    with queue_db.conn.cursor() as cur:
+        cur.execute("SELECT dead_lettered_at::date::text, attempts FROM retry_queue WHERE uuid = 'Q2';")
+        assert cur.fetchone() == ("2020-01-01", RETRY_MAX_ATTEMPTS + 1)
+    queue_db.conn.rollback()
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import db_manager
+from db_manager import DatabaseManager, WRITE_MODE_UPSERT
+from sample_documents import details_payload
+
+LEDGER_INDEX = "idx_unified_financial_ledger_document_uuid"
+
+
+def _ledger_index_exists(db):
+    with db.conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (LEDGER_INDEX,))
+        exists = cur.fetchone()[0]
+    db.conn.rollback()
+    return exists
+
+
+@pytest.fixture
+def schema_db(postgres_db):
+    db = DatabaseManager(postgres_db)
+    assert db.connect()
+    assert db.check_and_create_tables()[0]
+    yield db
+    db.disconnect()
+
+
+def test_schema_creates_the_ledger_index(schema_db):
+    assert _ledger_index_exists(schema_db) # Without ensure_indexes()
+
+
+def test_writer_adds_a_missing_ledger_index(schema_db):
+    with schema_db.conn.cursor() as cur:
+        cur.execute(f"DROP INDEX {LEDGER_INDEX};")
+    schema_db.conn.commit()
+    db_manager._ledger_tables.pop(schema_db.pool, None) # As in a fresh process against an older database
+
+    with schema_db.conn.cursor() as cur:
+        schema_db.insert_documents(cur, [details_payload("IDX1")], mode=WRITE_MODE_UPSERT)
+    schema_db.conn.commit()
+    assert _ledger_index_exists(schema_db)
@@ -0,0 +1,86 @@
+import pytest
+
+from uuid_index import BloomFilter, UuidIndex, FILE_MAGIC
+
+
+class StubDatabase:
+    """filter_existing_uuids/count/scan over an in-memory set of stored UUIDs, recording what it was asked."""
+    def __init__(self, stored):
+        self.stored = set(stored)
+        self.checked = []
+
+    def filter_existing_uuids(self, uuids, table_prefix=""):
+        self.checked.extend(uuids)
+        return [uuid for uuid in uuids if uuid not in self.stored]
+
+    def count_documents(self, table_prefix=""):
+        return len(self.stored)
+
+    def scan_document_uuids(self, table_prefix="", consume=None, batch_size=1000):
+        uuids = sorted(self.stored)
+        for start in range(0, len(uuids), batch_size):
+            consume(uuids[start:start + batch_size])
+        return len(uuids)
+
+
+def _uuids(prefix, count):
+    return [f"{prefix}{n:08d}" for n in range(count)]
+
+
+def test_no_false_negatives_after_add():
+    bloom = BloomFilter(capacity=5000, error_rate=0.01)
+    added = _uuids("A", 5000)
+    for uuid in added:
+        bloom.add(uuid)
+    assert all(uuid in bloom for uuid in added)
+    false_positives = sum(uuid in bloom for uuid in _uuids("B", 5000))
+    assert false_positives < 5000 * 0.03
+
+
+def test_round_trip_keeps_bits_and_counts():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for uuid in _uuids("A", 300):
+        bloom.add(uuid)
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert (restored.bit_count, restored.hash_count, restored.capacity, restored.count) == (bloom.bit_count, bloom.hash_count, 1000, 300)
+    assert restored.bits == bloom.bits
+    assert all(uuid in restored for uuid in _uuids("A", 300))
+
+
+@pytest.mark.parametrize("damage", [lambda data: data[:-1], lambda data: data[:len(FILE_MAGIC) + 4], lambda data: b"NOTBLOOM" + data[8:]])
+def test_damaged_files_are_rejected(damage):
+    bloom = BloomFilter(capacity=100)
+    bloom.add("X")
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(damage(bloom.to_bytes()))
+
+
+def test_filter_new_matches_the_database(tmp_path):
+    stored = _uuids("S", 2000)
+    db = StubDatabase(stored)
+    index = UuidIndex("Client A", index_dir=str(tmp_path), capacity=1000)
+    assert index.ensure_ready(db)
+    assert index.bloom.count == 2000 # Rebuilt larger than the configured capacity
+
+    candidates = stored[::7] + _uuids("N", 500) + stored[:3]
+    expected = StubDatabase(stored).filter_existing_uuids(candidates)
+    db.checked.clear()
+    assert index.filter_new(db, candidates) == expected
+    # Definitely-new UUIDs never reach the database; every stored one is checked
+    assert len(db.checked) < len(candidates)
+    assert set(stored[::7]) <= set(db.checked)
+
+    # Committed UUIDs are known after add(), and the saved filter loads back with them
+    index.add(["N00000001"])
+    db.stored.add("N00000001")
+    index.save()
+    reloaded = UuidIndex("Client A", index_dir=str(tmp_path))
+    assert reloaded.ensure_ready(StubDatabase([]))
+    assert reloaded.filter_new(db, ["N00000001", "N00000002"]) == ["N00000002"]
+
+
+def test_unreadable_file_is_rebuilt(tmp_path):
+    index = UuidIndex("Client B", "sent_", index_dir=str(tmp_path))
+    tmp_path.joinpath("Client_B__sent_documents.bloom").write_bytes(b"garbage")
+    assert index.ensure_ready(StubDatabase(["S1", "S2"]))
+    assert index.bloom.count == 2
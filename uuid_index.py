@@ -0,0 +1,187 @@
+# uuid_index.py
+import hashlib
+import math
+import os
+import struct
+import threading
+from log_sink import safe_file_part
+
+DEFAULT_INDEX_DIR = "uuid_index"
+DEFAULT_CAPACITY = 1_000_000   # Documents per table before the filter is rebuilt larger
+DEFAULT_ERROR_RATE = 0.01      # Share of new UUIDs that still need a DB check
+FILE_MAGIC = b"ETABLM1\n"
+HEADER_FORMAT = "<QIQQ"        # bit count, hash count, capacity, items added
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings. `item in bloom` is False only for items
+    that were never added; True means "possibly added". Hashing is blake2b with
+    double hashing, so the bit positions are stable across processes and runs.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE, bit_count=None, hash_count=None, bits=None, count=0):
+        self.capacity = capacity
+        self.bit_count = bit_count or max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = hash_count or max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.bit_count + 7) // 8)
+        self.count = count
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def to_bytes(self):
+        return FILE_MAGIC + struct.pack(HEADER_FORMAT, self.bit_count, self.hash_count, self.capacity, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        header_size = len(FILE_MAGIC) + struct.calcsize(HEADER_FORMAT)
+        if not data.startswith(FILE_MAGIC) or len(data) < header_size:
+            raise ValueError("Not a UUID index file.")
+        bit_count, hash_count, capacity, count = struct.unpack(HEADER_FORMAT, data[len(FILE_MAGIC):header_size])
+        bits = bytearray(data[header_size:])
+        if len(bits) != (bit_count + 7) // 8:
+            raise ValueError("UUID index file is truncated.")
+        return cls(capacity, bit_count=bit_count, hash_count=hash_count, bits=bits, count=count)
+
+
+class UuidIndex:
+    """
+    Local presence index of one client's header table. Discovery asks it first:
+    UUIDs the filter has never seen are definitely new and skip the database;
+    only possible hits are checked with filter_existing_uuids. The filter is
+    persisted under uuid_index/, updated after every committed write and rebuilt
+    from the table when missing, unreadable or over capacity.
+
+    Documents written by another process are not in the filter until it is
+    rebuilt; they are then fetched and upserted once more, which costs a detail
+    call but never a wrong row.
+    """
+    def __init__(self, client_name, table_prefix="", index_dir=DEFAULT_INDEX_DIR, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.client_name = client_name
+        self.table_prefix = table_prefix
+        self.path = os.path.join(index_dir, f"{safe_file_part(client_name)}__{table_prefix}documents.bloom")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None
+        self.dirty = False
+        self.stats = {'checked': 0, 'skipped_db': 0, 'false_positives': 0}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as index_file:
+                return BloomFilter.from_bytes(index_file.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"UUID index {self.path} is unreadable ({e}). It will be rebuilt.")
+            return None
+
+    def ensure_ready(self, db_manager):
+        """Loads the persisted filter, or rebuilds it from the database. Returns False if neither worked."""
+        with self._lock:
+            if self.bloom is None:
+                self.bloom = self._load()
+            if self.bloom is not None and not self.bloom.saturated:
+                return True
+        return self.rebuild(db_manager)
+
+    def rebuild(self, db_manager):
+        """Re-reads every stored UUID of the table into a fresh filter sized for it and saves it."""
+        total = db_manager.count_documents(self.table_prefix)
+        if total is None:
+            return False
+        bloom = BloomFilter(max(self.capacity, total * 2), self.error_rate)
+        def add_batch(batch):
+            for uuid in batch:
+                bloom.add(uuid)
+        if db_manager.scan_document_uuids(self.table_prefix, add_batch) is None:
+            return False
+        with self._lock:
+            self.bloom = bloom
+            self.dirty = True
+        self.save()
+        print(f"UUID index for '{self.client_name}' {self.table_prefix}documents rebuilt with {bloom.count} documents.")
+        return True
+
+    def filter_new(self, db_manager, uuids):
+        """Same result as db_manager.filter_existing_uuids, querying only the UUIDs the filter may have seen."""
+        if self.bloom is None:
+            return db_manager.filter_existing_uuids(uuids, self.table_prefix)
+        with self._lock:
+            possible_hits = {uuid for uuid in uuids if uuid in self.bloom}
+        self.stats['checked'] += len(uuids)
+        self.stats['skipped_db'] += len(uuids) - len(possible_hits)
+        if not possible_hits:
+            return list(uuids)
+        new_hits = set(db_manager.filter_existing_uuids(list(possible_hits), self.table_prefix))
+        self.stats['false_positives'] += len(new_hits)
+        return [uuid for uuid in uuids if uuid not in possible_hits or uuid in new_hits]
+
+    def add(self, uuids):
+        """Records committed UUIDs."""
+        if self.bloom is None:
+            return
+        with self._lock:
+            for uuid in uuids:
+                if uuid: self.bloom.add(uuid)
+            self.dirty = True
+
+    def save(self):
+        """Writes the filter atomically (temp file + rename) if it changed."""
+        with self._lock:
+            if self.bloom is None or not self.dirty:
+                return
+            data = self.bloom.to_bytes()
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "wb") as index_file:
+                index_file.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save UUID index {self.path}: {e}")
+            self.dirty = True
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_uuid_index(client_name, table_prefix=""):
+    """One shared index per client and table, so parallel workers add to the same filter."""
+    with _indexes_lock:
+        key = (client_name, table_prefix)
+        if key not in _indexes:
+            _indexes[key] = UuidIndex(client_name, table_prefix)
+        return _indexes[key]
+
+def open_uuid_indexes(client_name, db_manager, log=print):
+    """Readies the received/sent indexes of a client; a table whose index cannot be built falls back to DB checks."""
+    indexes = {}
+    for table_prefix in ("", "sent_"):
+        index = get_uuid_index(client_name, table_prefix)
+        if not index.ensure_ready(db_manager):
+            log(f"UUID index for {table_prefix}documents is unavailable. Checking discovered documents against the database only.")
+        indexes[table_prefix] = index
+    return indexes
+
+def save_uuid_indexes(indexes):
+    for index in indexes.values():
+        index.save()
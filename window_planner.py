@@ -0,0 +1,80 @@
+# window_planner.py
+import datetime
+
+DEFAULT_MAX_WINDOW_DAYS = 30       # Same span the date-analysis probes already use against the search API
+DEFAULT_DENSE_WINDOW_DAYS = 7      # Busy windows without a result count are split down to this size
+DEFAULT_MAX_RESULTS_PER_WINDOW = 5000
+
+class WindowPlanner:
+    """
+    Plans the search windows for a discovery run instead of querying every
+    calendar day. Each month-sized window is probed with a cheap pageSize=1
+    search: empty windows are dropped, and non-empty ones are split in half
+    recursively while they hold more than `max_results_per_window` results.
+    A window whose probe fails or reports no count is not trusted to be empty
+    and is searched in `dense_window_days` pieces instead. Windows are whole
+    Cairo days, returned oldest first as inclusive (start_date, end_date) pairs.
+    """
+    def __init__(self, api_client, local_tz, max_window_days=DEFAULT_MAX_WINDOW_DAYS,
+                 dense_window_days=DEFAULT_DENSE_WINDOW_DAYS, max_results_per_window=DEFAULT_MAX_RESULTS_PER_WINDOW):
+        self.api_client = api_client
+        self.local_tz = local_tz
+        self.max_window_days = max_window_days
+        self.dense_window_days = dense_window_days
+        self.max_results_per_window = max_results_per_window
+        self.probe_count = 0
+
+    def window_bounds(self, start_date, end_date):
+        """Returns the timezone-aware datetimes covering the local dates start_date..end_date."""
+        window_start = self.local_tz.localize(datetime.datetime.combine(start_date, datetime.time.min))
+        window_end = self.local_tz.localize(datetime.datetime.combine(end_date, datetime.time.max))
+        return window_start, window_end
+
+    def plan(self, start_date, end_date, direction, should_continue=None):
+        windows = []
+        chunk_start = start_date
+        while chunk_start <= end_date:
+            if should_continue is not None and not should_continue():
+                break
+            chunk_end = min(end_date, chunk_start + datetime.timedelta(days=self.max_window_days - 1))
+            self._plan_window(chunk_start, chunk_end, direction, windows)
+            chunk_start = chunk_end + datetime.timedelta(days=1)
+        return windows
+
+    def _probe(self, start_date, end_date, direction):
+        """Returns (has_documents, total_count) for the window, or None if the probe failed."""
+        self.probe_count += 1
+        window_start, window_end = self.window_bounds(start_date, end_date)
+        result = self.api_client.search_documents(window_start, window_end, page_size=1, direction=direction)
+        if result is None:
+            return None
+        total_count = result.get('metadata', {}).get('totalCount')
+        if total_count is None:
+            # The client maps a search 400 to an empty result without metadata; that is not "no documents"
+            return None
+        return bool(result.get('result')), total_count
+
+    def _plan_window(self, start_date, end_date, direction, windows):
+        days = (end_date - start_date).days + 1
+        probe = self._probe(start_date, end_date, direction)
+
+        if probe is None:
+            # Unknown content: fall back to dense-sized windows so no day is silently skipped
+            piece_start = start_date
+            while piece_start <= end_date:
+                piece_end = min(end_date, piece_start + datetime.timedelta(days=self.dense_window_days - 1))
+                windows.append((piece_start, piece_end))
+                piece_start = piece_end + datetime.timedelta(days=1)
+            return
+
+        has_documents, total_count = probe
+        if not has_documents:
+            return
+
+        if days == 1 or total_count <= self.max_results_per_window:
+            windows.append((start_date, end_date))
+            return
+
+        mid_date = start_date + datetime.timedelta(days=days // 2 - 1)
+        self._plan_window(start_date, mid_date, direction, windows)
+        self._plan_window(mid_date + datetime.timedelta(days=1), end_date, direction, windows)